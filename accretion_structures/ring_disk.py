@@ -5,20 +5,27 @@ Model of concentrical rings for the accretion disk
 @author: Eduard Larrañaga - 2023
 ===============================================================================
 """
+from numpy import asarray, array, searchsorted, clip, where
 
 class structure:
     def __init__(self, blackhole, corotating=True):
         self.in_edge = 5.9
         self.out_edge = 20
+        # Sense of rotation of the gas (see common/spectral.py)
+        self.corotating = corotating
 
-    def energy_flux(self, r):
+    def energy_flux(self, r, phi=None):
+        '''
+        Energy flux at the radii r (number or array): 1 inside the rings 
+        and 0 outside. The azimuths phi are not used.
+        '''
         tol = 0.2
-        radii = [6,8,10,12,14,16,18]
-        intensity = 0.
-        for radius in radii:
-            if r>radius-tol and r<radius+tol:
-                intensity = 1.
-        return intensity
+        radii = array([6,8,10,12,14,16,18])
+        r = asarray(r, dtype=float)
+        # Nearest ring to each radius
+        k = clip(searchsorted(radii, r), 1, radii.size - 1)
+        nearest = where(r - radii[k-1] < radii[k] - r, radii[k-1], radii[k])
+        return where((r > nearest - tol) & (r < nearest + tol), 1., 0.)
 
 
 
@@ -5,20 +5,25 @@ Model of concentrical rings for the accretion disk
 @author: Eduard Larrañaga - 2023
 ===============================================================================
 """
+from numpy import asarray, array, searchsorted, minimum, where
 
 class structure:
     def __init__(self, blackhole, corotating=True):
         self.in_edge = 5.9
         self.out_edge = 20
+        # Sense of rotation of the gas (see common/spectral.py)
+        self.corotating = corotating
 
-    def energy_flux(self, r):
-        tol = 0.2
-        radii = [6,8,10,12,14,16,18,20]
-        intensity = 0.
-        for i in range(len(radii)-1):
-            if r>radii[i] and r<radii[i+1]:
-                intensity = i+1
-        return intensity
+    def energy_flux(self, r, phi=None):
+        '''
+        Energy flux at the radii r (number or array): i+1 between the 
+        radii i and i+1 of the list. The azimuths phi are not used.
+        '''
+        radii = array([6,8,10,12,14,16,18,20])
+        r = asarray(r, dtype=float)
+        k = searchsorted(radii, r)
+        inside = (k > 0) & (k < radii.size) & (r != radii[minimum(k, radii.size - 1)])
+        return where(inside, k, 0).astype(float)
 
 
 
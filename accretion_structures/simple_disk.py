@@ -5,19 +5,25 @@ Thind accretion disk with a simple linear model of spectrum
 @author: Eduard Larrañaga - 2023
 ===============================================================================
 """
+from numpy import asarray, where
 
 class structure:
     def __init__(self, blackhole, R_min , R_max, corotating=True):
         self.in_edge = R_min
         self.out_edge = R_max
+        # Sense of rotation of the gas (see common/spectral.py)
+        self.corotating = corotating
 
-    def energy_flux(self, r):
+    def energy_flux(self, r, phi=None):
+        '''
+        Energy flux at the radii r (number or array), decreasing linearly 
+        from 1 at the inner edge to 0 at the outer edge. The azimuths phi 
+        are not used.
+        '''
+        r = asarray(r, dtype=float)
         m = (1.-0.)/(self.in_edge - self.out_edge)
         intensity = m * (r - self.out_edge)
-        if r>self.in_edge and r<self.out_edge:
-            return intensity
-        else:
-            return 0.
+        return where((r > self.in_edge) & (r < self.out_edge), intensity, 0.)
 
 
 
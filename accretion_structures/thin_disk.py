@@ -6,12 +6,13 @@ emitted from the surface of the disk
 @author: Eduard Larrañaga - 2023
 ===============================================================================
 """
-from numpy import cos, sqrt, arccos, pi, log, linspace, min
-from scipy.interpolate import interp1d
+from numpy import cos, sqrt, arccos, pi, log, asarray, where, clip, minimum
 
 class structure:
     def __init__(self, blackhole, corotating=True, R_min=False, R_max=20.):
         self.out_edge = R_max
+        # Sense of rotation of the gas (see common/spectral.py)
+        self.corotating = corotating
         self.M = blackhole.M
         self.a = blackhole.a
         if corotating:
@@ -23,10 +24,9 @@ class structure:
         if R_min:
             self.in_edge = R_min
 
-        rr = linspace(self.in_edge, self.out_edge, 100000)
-        ff = self.f(rr)
-        ff = ff - min(ff)
-        self.energy = interp1d(rr,ff)
+        # The flux vanishes at the ISCO and it has a single maximum, so its 
+        # minimum in the disk is at one of the edges
+        self.f_min = minimum(self.f(self.in_edge), self.f(self.out_edge))
 
     def f(self, r):
         a_M = self.a/self.M
@@ -44,11 +44,14 @@ class structure:
         return c*(t1 + t2 + t3 + t4)
 
     
-    def energy_flux(self,r):
-        if r>self.in_edge and r<self.out_edge:
-            return self.energy(r)
-        else:
-            return 0.
+    def energy_flux(self, r, phi=None):
+        '''
+        Energy flux at the radii r (number or array). The disk is 
+        axisymmetric and the azimuths phi are not used.
+        '''
+        r = asarray(r, dtype=float)
+        inside = (r > self.in_edge) & (r < self.out_edge)
+        return where(inside, self.f(clip(r, self.in_edge, self.out_edge)) - self.f_min, 0.)
 
 
 
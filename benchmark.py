@@ -0,0 +1,243 @@
+"""
+===============================================================================
+Performance benchmark
+Renders a fixed set of scenes at several resolutions and stores, for each
+run, the throughput (photons/second), the peak memory, the startup time
+(from the start of the script to the end of the setup stage) and the time
+of each stage in a JSON file, so that the results of different
+commits can be compared.
+
+    python benchmark.py                        # all the scenes
+    python benchmark.py --scenes kerr_0.6_85 --resolutions 64 128
+    python benchmark.py --integrator bundle --output results.json
+    python benchmark.py --compare old.json new.json
+
+Each run is executed in a new process, so that the startup time and the peak
+memory of the runs do not affect each other. The stages are
+- import  : import of the modules of the code
+- setup   : creation of the black hole, the detector and the structure
+- photons : creation of the photons (Image.create_photons)
+- compile : integration of a single photon (compilation of the kernels of
+            the jit integrator, if any)
+- render  : integration and shading of all the photons (Image.create_image),
+            best of --repeat renders
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+import time
+START = time.perf_counter()
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+from datetime import datetime
+
+
+# Scenes: black hole, parameters, inclination (degrees) and accretion structure
+SCENES = {
+    'schwarzschild_85': ('schwarzschild', {'M': 1.}, 85, 'thin_disk'),
+    'kerr_0.6_30': ('kerr', {'M': 1., 'a': 0.6}, 30, 'thin_disk'),
+    'kerr_0.6_60': ('kerr', {'M': 1., 'a': 0.6}, 60, 'thin_disk'),
+    'kerr_0.6_85': ('kerr', {'M': 1., 'a': 0.6}, 85, 'thin_disk'),
+    'kerr_0.99_30': ('kerr', {'M': 1., 'a': 0.99}, 30, 'thin_disk'),
+    'kerr_0.99_60': ('kerr', {'M': 1., 'a': 0.99}, 60, 'thin_disk'),
+    'kerr_0.99_85': ('kerr', {'M': 1., 'a': 0.99}, 85, 'thin_disk'),
+    'num_schwarzschild_85': ('num_schwarzschild', {'M': 1.}, 85, 'thin_disk'),
+    'scalar_hair_5.0_1.6_85': ('scalar_hair_BH', {'phi1': 5.0, 'pp0': 1.6}, 85,
+                               'simple_disk'),
+}
+RESOLUTIONS = [64, 128]
+D = 100.
+X_SIDE = 25.
+
+
+def run_scene(name, x_pixels, integrator, repeat=3):
+    '''
+    Renders a scene in the current process and returns the dictionary of
+    results. The render is repeated and its best time is kept.
+    '''
+    result = {'scene': name, 'x_pixels': x_pixels, 'integrator': integrator}
+    stages = {}
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        t = time.perf_counter()
+        from importlib import import_module
+        from numpy import pi, bincount
+        from detectors import image_plane
+        from common.common import Image
+        from accretion_structures import simple_disk, thin_disk
+        kind, params, iota, disk = SCENES[name]
+        module = import_module('black_holes.' + kind)
+        stages['import'] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        blackhole = module.BlackHole(**params)
+        detector = image_plane.detector(D=D, iota=(pi/180)*iota,
+                                        x_pixels=x_pixels, x_side=X_SIDE,
+                                        ratio='16:9')
+        if disk == 'thin_disk':
+            acc_structure = thin_disk.structure(blackhole)
+        else:
+            acc_structure = simple_disk.structure(blackhole, 6, 20)
+        image = Image(blackhole, acc_structure, detector)
+        stages['setup'] = time.perf_counter() - t
+        result['startup'] = time.perf_counter() - START
+
+        t = time.perf_counter()
+        image.create_photons()
+        stages['photons'] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        from common.common import trace_photons
+        trace_photons(image.photons[:1], blackhole, acc_structure, detector,
+                      integrator)
+        stages['compile'] = time.perf_counter() - t
+
+        renders = []
+        for _ in range(repeat):
+            t = time.perf_counter()
+            image.create_image(integrator=integrator)
+            renders.append(time.perf_counter() - t)
+        stages['render'] = min(renders)
+        result['renders'] = renders
+
+        n = detector.x_pixels*detector.y_pixels
+        result.update(y_pixels=detector.y_pixels, photons=n,
+                      photons_per_second=n/stages['render'],
+                      status=bincount(image.status.ravel(), minlength=6).tolist())
+    except Exception as error:
+        result['error'] = '%s: %s' % (type(error).__name__, error)
+    finally:
+        sys.stdout = stdout
+    result['stages'] = stages
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result['peak_memory_mb'] = rss/2**20 if sys.platform == 'darwin' else rss/1024
+    return result
+
+
+def environment():
+    '''
+    Returns the description of the code and the machine of the run
+    '''
+    import numpy
+    import scipy
+    try:
+        import numba
+        numba_version = numba.__version__
+    except ImportError:
+        numba_version = None
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+                                ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'date': datetime.now().isoformat(timespec='seconds'),
+            'machine': platform.machine(), 'processor': platform.processor(),
+            'cpus': os.cpu_count(), 'platform': platform.platform(),
+            'python': platform.python_version(), 'numpy': numpy.__version__,
+            'scipy': scipy.__version__, 'numba': numba_version}
+
+
+def compare(old_file, new_file):
+    '''
+    Prints the ratio of the throughput of the runs in common of two files
+    '''
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+    key = lambda r: (r['scene'], r['x_pixels'], r['integrator'])
+    old_runs = {key(r): r for r in old['results'] if 'error' not in r}
+    print('old: %s (%s)' % (old['environment']['commit'], old['environment']['date']))
+    print('new: %s (%s)' % (new['environment']['commit'], new['environment']['date']))
+    print('%-24s %6s %10s %12s %12s %8s %10s'
+          % ('scene', 'pixels', 'integrator', 'old ph/s', 'new ph/s', 'speedup',
+             'memory'))
+    for r in new['results']:
+        o = old_runs.get(key(r))
+        if o is None or 'error' in r:
+            continue
+        print('%-24s %6d %10s %12.1f %12.1f %8.2f %+9.0f%%'
+              % (r['scene'], r['x_pixels'], r['integrator'],
+                 o['photons_per_second'], r['photons_per_second'],
+                 r['photons_per_second']/o['photons_per_second'],
+                 100*(r['peak_memory_mb']/o['peak_memory_mb'] - 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Performance benchmark')
+    parser.add_argument('--scenes', nargs='+', default=list(SCENES),
+                        choices=list(SCENES))
+    parser.add_argument('--resolutions', nargs='+', type=int, default=RESOLUTIONS)
+    parser.add_argument('--integrator', default='jit')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of renders of each run (the best time '
+                             'is kept)')
+    parser.add_argument('--output', default=None,
+                        help='JSON file of results (default: '
+                             'benchmarks/<date>_<commit>.json)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    parser.add_argument('--run', nargs=2, metavar=('SCENE', 'X_PIXELS'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.run:
+        # Single run in a child process
+        print(json.dumps(run_scene(args.run[0], int(args.run[1]),
+                                   args.integrator, args.repeat)))
+        return
+
+    env = environment()
+    results = []
+    print('%-24s %6s %10s %12s %10s %10s %10s'
+          % ('scene', 'pixels', 'integrator', 'photons/s', 'render s',
+             'startup s', 'memory MB'))
+    for name in args.scenes:
+        for x_pixels in args.resolutions:
+            out = subprocess.run([sys.executable, os.path.abspath(__file__),
+                                  '--run', name, str(x_pixels),
+                                  '--integrator', args.integrator,
+                                  '--repeat', str(args.repeat)],
+                                 capture_output=True, text=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__)))
+            try:
+                result = json.loads(out.stdout.strip().splitlines()[-1])
+            except (IndexError, ValueError):
+                result = {'scene': name, 'x_pixels': x_pixels,
+                          'integrator': args.integrator,
+                          'error': out.stderr.strip()[-500:]}
+            results.append(result)
+            if 'error' in result:
+                print('%-24s %6d %10s   skipped (%s)'
+                      % (name, x_pixels, args.integrator, result['error']))
+            else:
+                print('%-24s %6d %10s %12.1f %10.3f %10.3f %10.1f'
+                      % (name, x_pixels, args.integrator,
+                         result['photons_per_second'], result['stages']['render'],
+                         result['startup'], result['peak_memory_mb']))
+
+    output = args.output
+    if output is None:
+        commit = (env['commit'] or 'unknown')[:8]
+        output = os.path.join('benchmarks', '%s_%s.json'
+                              % (env['date'].replace(':', '-'), commit))
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({'environment': env, 'results': results}, f, indent=1)
+    print('\nResults saved in %s' % output)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,7 +11,8 @@ Kerr metric
 ===============================================================================
 """
 
-from numpy import sin, cos, sqrt
+from numpy import sin, cos, sqrt, zeros_like, empty, array
+from common.jit import njit
 
 class BlackHole:
     '''
@@ -41,9 +42,11 @@ class BlackHole:
         # Auxiliary functions
         r2 = x[1]*x[1]
         a2 = self.a*self.a
-        sin_theta2 = sin(x[2])*sin(x[2])
+        sin_theta = sin(x[2])
+        cos_theta = cos(x[2])
+        sin_theta2 = sin_theta*sin_theta
         Delta = r2 - 2*self.M*x[1] + a2
-        Sigma = r2 + a2*cos(x[2])*cos(x[2])
+        Sigma = r2 + a2*cos_theta*cos_theta
         
         # Metric components
         g_tt = -(1 - 2*self.M*x[1]/Sigma)
@@ -87,7 +90,7 @@ class BlackHole:
         Delta = r2 - 2*self.M*q[1] + a2
 
         W = -q[4]*(r2 + a2) - self.a*q[7] 
-        partXi = r2 + (q[7] + self.a*q[4])**2 + a2*(1 + q[4]*q[4])*cos_th2 + q[7]*q[7]*cos_th2/sin_th2
+        partXi = r2 + (q[7] + self.a*q[4])**2 + a2*(1 - q[4]*q[4])*cos_th2 + q[7]*q[7]*cos_th2/sin_th2
         Xi = W**2 - Delta*partXi
 
         dXidE = 2*W*(r2 + a2) + 2.*self.a*Delta*(q[7] + self.a*q[4]*sin_th2)
@@ -103,7 +106,7 @@ class BlackHole:
 
         dAdth = Delta*auxth/Sigma2
         dBdth = auxth/Sigma2
-        dCdth = ((1+q[4]**2)*auxth + q[7]*q[7] * cos_th/(sin_th2*sin_th) )/Sigma + (Xi/(Delta*Sigma2))*auxth
+        dCdth = ((1 - q[4]**2)*auxth + q[7]*q[7] * cos_th/(sin_th2*sin_th) )/Sigma + (Xi/(Delta*Sigma2))*auxth
 
         # Geodesics differential equations 
         dtdlmbda = dXidE/(2.*Delta*Sigma)
@@ -111,14 +114,78 @@ class BlackHole:
         dthdlmbda = q[6]/Sigma
         dphidlmbda = - dXidL/(2.*Delta*Sigma)
         
-        dk_tdlmbda = 0.
+        dk_tdlmbda = zeros_like(q[1])
         dk_rdlmbda = -dAdr*q[5]*q[5] - dBdr*q[6]*q[6] + dCdr 
         dk_thdlmbda = -dAdth*q[5]*q[5] - dBdth*q[6]*q[6] + dCdth 
-        dk_phidlmbda = 0.
+        dk_phidlmbda = zeros_like(q[1])
         
         return [dtdlmbda, drdlmbda, dthdlmbda, dphidlmbda, 
                 dk_tdlmbda, dk_rdlmbda, dk_thdlmbda, dk_phidlmbda]
 
+    def compiled(self):
+        '''
+        Returns the compiled geodesic equations and the array of 
+        parameters they need (see common/jit.py)
+        '''
+        return geodesics_kernel, array([self.M, self.a, self.a*self.a])
+
+    def kerr_schild(self):
+        '''
+        Returns the array of parameters [M, a, a^2] of the geodesic equations
+        in Cartesian Kerr-Schild coordinates (see common/kerr_schild.py)
+        '''
+        return array([self.M, self.a, self.a*self.a])
+
+
+@njit(cache=True)
+def geodesics_kernel(q, params):
+    '''
+    Compiled version of BlackHole.geodesics for a single ray
+    params = [M, a, a^2]
+    '''
+    M = params[0]
+    a = params[1]
+    a2 = params[2]
+    r = q[1]
+    E = q[4]
+    L = q[7]
+    r2 = r*r
+    sin_th = sin(q[2])
+    cos_th = cos(q[2])
+    sin_th2 = sin_th*sin_th
+    cos_th2 = cos_th*cos_th
+    Sigma = r2 + a2*cos_th2
+    Sigma2 = Sigma*Sigma
+    Delta = r2 - 2*M*r + a2
+
+    W = -E*(r2 + a2) - a*L
+    partXi = r2 + (L + a*E)**2 + a2*(1 - E*E)*cos_th2 + L*L*cos_th2/sin_th2
+    Xi = W*W - Delta*partXi
+
+    dXidE = 2*W*(r2 + a2) + 2.*a*Delta*(L + a*E*sin_th2)
+    dXidL = -2*a*W - 2*a*E*Delta - 2*L*Delta/sin_th2
+    dXidr = -4*r*E*W - 2*(r - M)*partXi - 2*r*Delta
+
+    dAdr = (r - M)/Sigma - (r*Delta)/Sigma2
+    dBdr = -r/Sigma2
+    dCdr = dXidr/(2*Delta*Sigma) - (Xi*(r - M))/(Sigma*Delta*Delta) - r*Xi/(Delta*Sigma2)
+
+    auxth = a2*cos_th*sin_th
+    dAdth = Delta*auxth/Sigma2
+    dBdth = auxth/Sigma2
+    dCdth = ((1 - E*E)*auxth + L*L*cos_th/(sin_th2*sin_th))/Sigma + (Xi/(Delta*Sigma2))*auxth
+
+    dq = empty(8)
+    dq[0] = dXidE/(2.*Delta*Sigma)
+    dq[1] = (Delta/Sigma)*q[5]
+    dq[2] = q[6]/Sigma
+    dq[3] = -dXidL/(2.*Delta*Sigma)
+    dq[4] = 0.
+    dq[5] = -dAdr*q[5]*q[5] - dBdr*q[6]*q[6] + dCdr
+    dq[6] = -dAdth*q[5]*q[5] - dBdth*q[6]*q[6] + dCdth
+    dq[7] = 0.
+    return dq
+
 
 
 
@@ -12,18 +12,24 @@ ds^2 = -(1-2M/r)dt^2 + dr^2 /(1-2M/r) + r^2 dtheta^2 + r^2 sin^2 (theta) dphi^2
 ===============================================================================
 """
 
-from numpy import sin, cos, loadtxt, linspace, asarray
-from scipy.interpolate import interp1d
+from numpy import sin, cos, loadtxt, zeros_like
+from black_holes.table_store import DATA_DIR
+from black_holes.tabulated import UniformTable
+import os
 
 class BlackHole:
     '''
     Definition of the Black Hole described by Schwarzschild metric
     '''
     def __init__(self, M):
-        data = loadtxt('metrics/numerical_data/schwarzschild_data/N.txt')
-        self.N = interp1d(data[:,0], data[:,1])
-        data = loadtxt('metrics/numerical_data/schwarzschild_data/derN.txt')
-        self.dNdr = interp1d(data[:,0], data[:,1])
+        # Tables N.txt and derN.txt generated by beta_files/gen_num_schw.py
+        data_dir = os.path.join(DATA_DIR, 'schwarzschild_data')
+        data = loadtxt(os.path.join(data_dir, 'N.txt'))
+        der_data = loadtxt(os.path.join(data_dir, 'derN.txt'))
+        # N and dN/dr on a uniform grid, for a fused lookup 
+        # (see black_holes/tabulated.py)
+        self.table = UniformTable(data[:,0], [data[:,1], der_data[:,1]], 
+                                  log_grid=False, n_values=1)
         self.M = M
         self.a = 0.
         self.EH = 2*M
@@ -43,8 +49,9 @@ class BlackHole:
         ===========================================================================
         '''
         # Metric components
-        g_tt = - self.N(x[1])
-        g_rr = 1/self.N(x[1])
+        N = self.table(x[1])[0]
+        g_tt = - N
+        g_rr = 1/N
         g_thth = x[1]**2
         g_phph = (x[1]*sin(x[2]))**2
         g_tph = 0.
@@ -64,8 +71,9 @@ class BlackHole:
         ===========================================================================
         '''
         # Metric components
-        gtt = - 1/self.N(x[1])
-        grr = self.N(x[1])
+        N = self.table(x[1])[0]
+        gtt = - 1/N
+        grr = N
         gthth = 1/x[1]**2
         gphph = 1/(x[1]*sin(x[2]))**2
         gtph = 0.
@@ -85,8 +93,9 @@ class BlackHole:
         ===========================================================================
         '''
         # Derivative of the metric components
-        drgtt =  self.dNdr(x[1])/(self.N(x[1])**2)
-        drgrr = self.dNdr(x[1])
+        N, dNdr = self.table(x[1])
+        drgtt =  dNdr/(N**2)
+        drgrr = dNdr
         drgthth = -2/x[1]**3
         drgphph = -2/(x[1]**3*sin(x[2])**2)
         drgtph = 0.
@@ -114,9 +123,17 @@ class BlackHole:
         L = k_phi
         ===========================================================================
         '''
-        # Metric and its numerical derivative
-        gtt, grr, gthth, gphph, gtph = self.inverse_metric(q[0:4])
-        drgtt, drgrr, drgthth, drgphph, drgtph = self.dr_inverse_metric(q[0:4])
+        # Metric and its numerical derivative, from a single lookup of N 
+        # and dN/dr
+        N, dNdr = self.table(q[1])
+        gtt = - 1/N
+        grr = N
+        gthth = 1/q[1]**2
+        gphph = 1/(q[1]*sin(q[2]))**2
+        drgtt =  dNdr/(N**2)
+        drgrr = dNdr
+        drgthth = -2/q[1]**3
+        drgphph = -2/(q[1]**3*sin(q[2])**2)
         
         # Geodesics differential equations 
         dtdlmbda = gtt*q[4]
@@ -124,11 +141,11 @@ class BlackHole:
         dthdlmbda = gthth*q[6]
         dphidlmbda = gphph*q[7]
         
-        dk_tdlmbda = 0.
+        dk_tdlmbda = zeros_like(q[1])
         dk_rdlmbda = - (drgtt*q[4]**2)/2 - (drgrr*q[5]**2)/2 \
                      - (drgthth*q[6]**2)/2 - (drgphph*q[7]**2)/2
         dk_thdlmbda = (cos(q[2])/sin(q[2])**3)*(q[7]/q[1])**2
-        dk_phidlmbda = 0.
+        dk_phidlmbda = zeros_like(q[1])
         
         return [dtdlmbda, drdlmbda, dthdlmbda, dphidlmbda, 
                 dk_tdlmbda, dk_rdlmbda, dk_thdlmbda, dk_phidlmbda]
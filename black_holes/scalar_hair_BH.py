@@ -11,27 +11,44 @@ ds^2 = g_tt dt^2 + g_rr dr^2  + r^2 dtheta^2 + r^2 sin^2 (theta) dphi^2
 ===============================================================================
 """
 
-from numpy import sin, cos, loadtxt, linspace, asarray
-from scipy.interpolate import interp1d
+from numpy import sin, cos, zeros_like
+from black_holes.table_store import open_store
+from black_holes.tabulated import UniformTable
 
 class BlackHole:
     '''
     Definition of the Black Hole described by Schwarzschild metric
     '''
-    def __init__(self):
+    def __init__(self, phi1=5.0, pp0=1.6, interpolate=False):
+        '''
+        =======================================================================
+        phi1, pp0 : parameters of the scalar field of the numerical solution. 
+                    The metric is read from the binary store of the tables 
+                    black_holes/numerical_data/scalarBH (see 
+                    black_holes/table_store.py)
+        interpolate : if True, the values of (phi1, pp0) without a table are 
+                      interpolated from the neighbouring tabulated solutions
+        =======================================================================
+        '''
         self.M = 1
         self.a = 0.
         self.EH = 1*self.M
         self.ISCOco = 3*self.M 
         self.ISCOcounter = 3*self.M
+        self.phi1 = phi1
+        self.pp0 = pp0
         # Load numerical metric
-        data = loadtxt('metrics/numerical_data/scalarBH/phi1=5.0/metricpp0=1.6.txt')
-        self.g_tt = interp1d(data[:,0], data[:,1], bounds_error=False, fill_value = 0)
-        self.g_rr = interp1d(data[:,0], data[:,2], bounds_error=False, fill_value = 0)
-        self.gtt = interp1d(data[:,0], data[:,3], bounds_error=False, fill_value = 0)
-        self.grr = interp1d(data[:,0], data[:,4], bounds_error=False, fill_value = 0)
-        self.drgtt = interp1d(data[:,0], data[:,5], bounds_error=False, fill_value = 0)
-        self.drgrr = interp1d(data[:,0], data[:,6], bounds_error=False, fill_value = 0)
+        store = open_store()
+        try:
+            data = store.table(phi1, pp0)
+        except ValueError:
+            if not interpolate:
+                raise
+            data = store.interpolated_table(phi1, pp0)
+        # gtt, grr and their derivatives, resampled for a fused lookup 
+        # (see black_holes/tabulated.py)
+        self.table = UniformTable(data[:,0], data[:,3:7].T, data[:,5:9].T, 
+                                  n_values=2)
 
     def metric(self,x):
         '''
@@ -46,8 +63,9 @@ class BlackHole:
         ===========================================================================
         '''
         # Metric components
-        g_tt = self.g_tt(x[1])
-        g_rr = self.g_rr(x[1])
+        gtt, grr = self.table(x[1])[:2]
+        g_tt = 1/gtt
+        g_rr = 1/grr
         g_thth = x[1]**2
         g_phph = (x[1]*sin(x[2]))**2
         g_tph = 0.
@@ -75,21 +93,20 @@ class BlackHole:
         L = k_phi
         ===========================================================================
         '''
-        # Metric and its numerical derivative
-        #gtt, grr, gthth, gphph, gtph = self.inverse_metric(q[0:4])
-        #drgtt, drgrr, drgthth, drgphph, drgtph = self.dr_inverse_metric(q[0:4])
+        # Inverse metric and its derivative, in a single lookup
+        gtt, grr, drgtt, drgrr = self.table(q[1])
         
         # Geodesics differential equations 
-        dtdlmbda = self.gtt(q[1])*q[4]
-        drdlmbda = self.grr(q[1])*q[5]
+        dtdlmbda = gtt*q[4]
+        drdlmbda = grr*q[5]
         dthdlmbda = (1./q[1]**2)*q[6]
         dphidlmbda = (1./(q[1]*sin(q[2]))**2)*q[7]
         
-        dk_tdlmbda = 0.
-        dk_rdlmbda = - (self.drgtt(q[1])*q[4]**2)/2 - (self.drgrr(q[1])*q[5]**2)/2 \
+        dk_tdlmbda = zeros_like(q[1])
+        dk_rdlmbda = - (drgtt*q[4]**2)/2 - (drgrr*q[5]**2)/2 \
                      - ((-2/q[1]**3)*q[6]**2)/2 - ((-2/(q[1]**3*sin(q[2])**2))*q[7]**2)/2
         dk_thdlmbda = (cos(q[2])/sin(q[2])**3)*(q[7]/q[1])**2
-        dk_phidlmbda = 0.
+        dk_phidlmbda = zeros_like(q[1])
         
         return [dtdlmbda, drdlmbda, dthdlmbda, dphidlmbda, 
                 dk_tdlmbda, dk_rdlmbda, dk_thdlmbda, dk_phidlmbda]
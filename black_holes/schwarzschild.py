@@ -12,7 +12,8 @@ ds^2 = -(1-2M/r)dt^2 + dr^2 /(1-2M/r) + r^2 dtheta^2 + r^2 sin^2 (theta) dphi^2
 ===============================================================================
 """
 
-from numpy import sin, cos
+from numpy import sin, cos, zeros_like, empty, array
+from common.jit import njit
 
 class BlackHole:
     '''
@@ -74,16 +75,56 @@ class BlackHole:
         dthdlmbda = q[6]/q[1]**2
         dphidlmbda = q[7]/((q[1]*sin_theta)**2)
         
-        dk_tdlmbda = 0.
+        dk_tdlmbda = zeros_like(q[1])
         dk_rdlmbda = -self.M*(q[5]/q[1])**2 + q[6]**2/q[1]**3  \
                 +q[7]**2/((q[1]**3)*sin_theta**2) \
                 -self.M*(q[4]/(q[1]-2.*self.M))**2 
         dk_thdlmbda = (cos(q[2])/sin_theta**3)*(q[7]/q[1])**2
-        dk_phidlmbda = 0.
+        dk_phidlmbda = zeros_like(q[1])
         
         return [dtdlmbda, drdlmbda, dthdlmbda, dphidlmbda, 
                 dk_tdlmbda, dk_rdlmbda, dk_thdlmbda, dk_phidlmbda]
 
+    def compiled(self):
+        '''
+        Returns the compiled geodesic equations and the array of 
+        parameters they need (see common/jit.py)
+        '''
+        return geodesics_kernel, array([self.M])
+
+    def kerr_schild(self):
+        '''
+        Returns the array of parameters [M, a, a^2] of the geodesic equations
+        in Cartesian Kerr-Schild coordinates (see common/kerr_schild.py)
+        '''
+        return array([self.M, 0., 0.])
+
+
+@njit(cache=True)
+def geodesics_kernel(q, params):
+    '''
+    Compiled version of BlackHole.geodesics for a single ray
+    params = [M]
+    '''
+    M = params[0]
+    r = q[1]
+    r2 = r*r
+    r3 = r2*r
+    sin_theta = sin(q[2])
+    sin_theta2 = sin_theta*sin_theta
+
+    dq = empty(8)
+    dq[0] = q[4]*r2/(r2 - 2*M*r)
+    dq[1] = (1 - 2*M/r)*q[5]
+    dq[2] = q[6]/r2
+    dq[3] = q[7]/(r2*sin_theta2)
+    dq[4] = 0.
+    dq[5] = -M*(q[5]/r)**2 + q[6]*q[6]/r3 + q[7]*q[7]/(r3*sin_theta2) \
+            - M*(q[4]/(r - 2.*M))**2
+    dq[6] = (cos(q[2])/(sin_theta2*sin_theta))*(q[7]/r)**2
+    dq[7] = 0.
+    return dq
+
 
 
 
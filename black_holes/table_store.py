@@ -0,0 +1,220 @@
+"""
+===============================================================================
+Binary store of the tabulated metrics
+===============================================================================
+The numerical metrics of the scalar hair black holes are given as text
+tables numerical_data/scalarBH/phi1=<phi1>/metricpp0=<pp0>.txt with the
+columns
+
+    r, g_tt, g_rr, gtt, grr, dgtt/dr, dgrr/dr, d2gtt/dr2, d2grr/dr2
+
+Parsing these tables dominates the construction of the black holes. They are
+converted once into a store with two .npy files:
+- tables.npy : all the tables stacked in a single array of shape (rows, 9),
+               read as a memory map
+- index.npy  : one record (phi1, pp0, start, stop, r_min, r_max) per table,
+               with the rows [start, stop) of the table in tables.npy and
+               the range of finite radii
+The store is created automatically the first time it is needed.
+
+Tables for values of (phi1, pp0) between the tabulated ones are obtained by
+interpolating the inverse metric functions of the neighbouring solutions at
+equal radius (the radius of all the tables is measured in units of the
+radius of the horizon, r_H = 1) with a weighted geometric mean, i.e. a
+linear interpolation of log|gtt| and log grr. pp0 is rescaled with its
+maximum value in each family phi1, so that the neighbours in phi1 are
+solutions at the same relative position in their range of pp0. The interpolated tables are
+cached in the directory interpolated/ of the store.
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+from numpy import (loadtxt, save, load, zeros, concatenate, isfinite, isclose,
+                   where, unique, interp, searchsorted, geomspace, gradient,
+                   column_stack, array, log, exp, abs, sign, errstate)
+import os
+import glob
+from black_holes.tabulated import UniformTable
+
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'numerical_data')
+SCALAR_HAIR_DIR = os.path.join(DATA_DIR, 'scalarBH')
+SCALAR_HAIR_STORE = os.path.join(DATA_DIR, 'scalarBH_store')
+
+INDEX_DTYPE = [('phi1', float), ('pp0', float), ('start', int), ('stop', int),
+               ('r_min', float), ('r_max', float)]
+
+
+def convert_tables(source=SCALAR_HAIR_DIR, store=SCALAR_HAIR_STORE):
+    '''
+    Converts the text tables phi1=*/metricpp0=*.txt of the directory
+    source into the binary store in the directory store
+    '''
+    files = []
+    for filename in glob.glob(os.path.join(source, 'phi1=*', 'metricpp0=*.txt')):
+        phi1 = os.path.basename(os.path.dirname(filename))[len('phi1='):]
+        pp0 = os.path.basename(filename)[len('metricpp0='):-len('.txt')]
+        files.append((float(phi1), float(pp0), filename))
+    if not files:
+        raise FileNotFoundError('No metric tables found in %s' % source)
+    files.sort()
+
+    index = zeros(len(files), dtype=INDEX_DTYPE)
+    tables = []
+    start = 0
+    for n, (phi1, pp0, filename) in enumerate(files):
+        data = loadtxt(filename)
+        r = data[:, 0][isfinite(data[:, 0])]
+        index[n] = (phi1, pp0, start, start + data.shape[0], r.min(), r.max())
+        tables.append(data)
+        start += data.shape[0]
+
+    os.makedirs(store, exist_ok=True)
+    save(os.path.join(store, 'tables.npy'), concatenate(tables))
+    save(os.path.join(store, 'index.npy'), index)
+
+
+class TableStore:
+    '''
+    Read access to a binary store of metric tables
+    '''
+    def __init__(self, store=SCALAR_HAIR_STORE, source=SCALAR_HAIR_DIR):
+        if not os.path.exists(os.path.join(store, 'index.npy')):
+            print('Converting the metric tables of %s ...' % source)
+            convert_tables(source, store)
+        self.store = store
+        self.index = load(os.path.join(store, 'index.npy'))
+        self.tables = load(os.path.join(store, 'tables.npy'), mmap_mode='r')
+        self.cache = {}
+
+    def available(self):
+        '''
+        Returns the list of the available pairs (phi1, pp0)
+        '''
+        return [(float(rec['phi1']), float(rec['pp0'])) for rec in self.index]
+
+    def find(self, phi1, pp0):
+        '''
+        Returns the record of the index of the table (phi1, pp0)
+        '''
+        k = where(isclose(self.index['phi1'], phi1)
+                  & isclose(self.index['pp0'], pp0))[0]
+        if k.size == 0:
+            raise ValueError('There is no metric table for phi1=%s, pp0=%s. '
+                             'Available values: %s'
+                             % (phi1, pp0, self.available()))
+        return self.index[k[0]]
+
+    def table(self, phi1, pp0):
+        '''
+        Returns the table (phi1, pp0) as a read-only view of the memory
+        map, with shape (rows, 9)
+        '''
+        rec = self.find(phi1, pp0)
+        return self.tables[rec['start']:rec['stop']]
+
+    def neighbours(self, phi1, pp0):
+        '''
+        Returns the list of pairs ((phi1, pp0), weight) of the tabulated 
+        solutions whose interpolation gives the solution (phi1, pp0)
+        '''
+        families = unique(self.index['phi1'])
+        pp0_max = array([self.index['pp0'][self.index['phi1'] == p].max() 
+                         for p in families])
+        if not families[0] <= phi1 <= families[-1]:
+            raise ValueError('phi1=%s is outside the range of the tables '
+                             '[%s, %s]' % (phi1, families[0], families[-1]))
+        # Relative position of pp0 in its range
+        x = pp0/interp(phi1, families, pp0_max)
+        k = min(searchsorted(families, phi1), families.size - 1)
+        if isclose(families[k], phi1) or k == 0:
+            bracket = [(families[k], 1.)]
+        else:
+            w = (phi1 - families[k-1])/(families[k] - families[k-1])
+            bracket = [(families[k-1], 1. - w), (families[k], w)]
+
+        result = []
+        for p, w_phi in bracket:
+            values = self.index['pp0'][self.index['phi1'] == p]
+            q = x*values.max()
+            if not values[0]*(1 - 1e-9) <= q <= values[-1]*(1 + 1e-9):
+                raise ValueError('pp0=%s is outside the range of the tables '
+                                 'for phi1=%s' % (pp0, phi1))
+            j = min(searchsorted(values, q), values.size - 1)
+            if isclose(values[j], q) or j == 0:
+                result.append(((p, values[j]), w_phi))
+            else:
+                w = (q - values[j-1])/(values[j] - values[j-1])
+                result.append(((p, values[j-1]), w_phi*(1. - w)))
+                result.append(((p, values[j]), w_phi*w))
+        return result
+
+    def interpolated_table(self, phi1, pp0, n=4000, cache=True):
+        '''
+        Returns a table (with the columns of the text tables) for the 
+        parameters (phi1, pp0), interpolated from the neighbouring 
+        tabulated solutions on a grid of n radii uniform in log r. 
+        The result is cached in memory and in the store.
+        '''
+        key = (float(phi1), float(pp0), n)
+        if key in self.cache:
+            return self.cache[key]
+        filename = os.path.join(self.store, 'interpolated', 
+                                'phi1=%r_pp0=%r_n=%d.npy' % key)
+        if cache and os.path.exists(filename):
+            data = load(filename)
+        else:
+            terms = []
+            for (p, q), w in self.neighbours(phi1, pp0):
+                data = self.table(p, q)
+                # gtt, grr, their derivatives and second derivatives (the
+                # rows with inf or nan are discarded by UniformTable)
+                with errstate(invalid='ignore', divide='ignore'):
+                    d3 = gradient(data[:,7:9], data[:,0], axis=0)
+                table = UniformTable(data[:,0], data[:,3:9].T, 
+                                     concatenate([data[:,5:9], d3], axis=1).T,
+                                     n_values=2)
+                terms.append((table, w))
+            r = geomspace(max(t.r_min for t, w in terms), 
+                          max(t.r_max for t, w in terms), n)
+            # Weighted geometric mean of the functions (linear interpolation
+            # of log|gtt| and log grr) and its derivatives
+            log_f, d1, d2 = 0., 0., 0.
+            for t, w in terms:
+                f = t(r)
+                log_f = log_f + w*log(abs(f[:2]))
+                d1 = d1 + w*f[2:4]/f[:2]
+                d2 = d2 + w*(f[4:6]/f[:2] - (f[2:4]/f[:2])**2)
+            f = sign(f[:2])*exp(log_f)
+            df = f*d1
+            d2f = f*(d2 + d1**2)
+            data = column_stack([r, 1/f[0], 1/f[1], f[0], f[1], df[0], df[1],
+                                 d2f[0], d2f[1]])
+            if cache:
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                save(filename, data)
+        self.cache[key] = data
+        return data
+
+
+# Store opened once in each process
+stores = {}
+
+def open_store(store=SCALAR_HAIR_STORE, source=SCALAR_HAIR_DIR):
+    '''
+    Returns the TableStore of the directory store, opening it only once
+    '''
+    if store not in stores:
+        stores[store] = TableStore(store, source)
+    return stores[store]
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
@@ -0,0 +1,115 @@
+"""
+===============================================================================
+Fast lookup of tabulated metric functions
+===============================================================================
+The tables of the numerical metrics are resampled once onto a grid which is
+uniform in r (or in log r). Then all the tabulated functions are evaluated
+together with a single index computation per radius (no binary search and
+no bounds checks per function), using cubic Hermite interpolation with the
+tabulated (or estimated) derivatives. Outside the range of the table the
+radius is clamped to its edges, so the functions keep their values at the
+edges of the table, and the functions that are radial derivatives of the
+others (see n_values) are zero, consistently with the constant values.
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+from numpy import (asarray, ascontiguousarray, isfinite, linspace, exp, log,
+                   diff, gradient, clip, minimum, concatenate, int64)
+from scipy.interpolate import CubicHermiteSpline
+import math
+
+
+class UniformTable:
+    '''
+    Set of functions of r tabulated on a uniform grid
+    '''
+    def __init__(self, r, values, derivatives=None, log_grid=True, n=None,
+                 n_max=200000, n_values=None):
+        '''
+        =======================================================================
+        r : increasing radii of the original table, shape (m,)
+        values : tabulated functions, shape (k, m)
+        derivatives : their derivatives with respect to r, shape (k, m)
+                      (estimated with finite differences if not given)
+        log_grid : use a grid uniform in log r instead of r
+        n : number of points of the new grid (default: the spacing of the
+            grid is the smallest spacing of the original table, with at most
+            n_max points)
+        n_values : number of leading rows of values that are the functions
+                   themselves; the following rows are radial derivatives,
+                   which vanish outside the table (default: all the rows)
+        =======================================================================
+        Only the rows of the table with finite values are used.
+        '''
+        r = asarray(r, dtype=float)
+        values = asarray(values, dtype=float)
+        if derivatives is None:
+            derivatives = gradient(values, r, axis=1)
+        derivatives = asarray(derivatives, dtype=float)
+        finite = isfinite(r) & isfinite(values).all(axis=0) \
+                 & isfinite(derivatives).all(axis=0)
+        r, values, derivatives = r[finite], values[:, finite], derivatives[:, finite]
+
+        self.log_grid = log_grid
+        self.n_values = values.shape[0] if n_values is None else n_values
+        self.r_min, self.r_max = r[0], r[-1]
+        u = log(r) if log_grid else r
+        if n is None:
+            n = min(int((u[-1] - u[0])/diff(u).min()) + 2, n_max)
+        self.u = linspace(u[0], u[-1], n)
+        self.u0 = self.u[0]
+        self.du = self.u[1] - self.u[0]
+
+        # Values and derivatives with respect to u at the new grid
+        spline = CubicHermiteSpline(r, values, derivatives, axis=1)
+        r_grid = exp(self.u) if log_grid else self.u
+        r_grid[0], r_grid[-1] = self.r_min, self.r_max
+        y = spline(r_grid)
+        dy = spline(r_grid, 1)*self.du
+        if log_grid:
+            dy = dy*r_grid
+
+        # Coefficients [c0, c1, c2, c3] of the cubic polynomial of each cell 
+        # (one column per cell, with the k functions in each block of rows), 
+        # so that all of them are obtained with a single gather
+        y0, y1, d0, d1 = y[:, :-1], y[:, 1:], dy[:, :-1], dy[:, 1:]
+        self.k = y.shape[0]
+        self.coefficients = ascontiguousarray(concatenate(
+            [y0, d0, 3*(y1 - y0) - 2*d0 - d1, 2*(y0 - y1) + d0 + d1]))
+
+    def __call__(self, r):
+        '''
+        Returns all the tabulated functions at the radii r (number or array),
+        in an array of shape (k,) + shape(r)
+        '''
+        if isinstance(r, float):
+            # Fast path for a single radius
+            inside = self.r_min <= r <= self.r_max
+            r = min(max(r, self.r_min), self.r_max)
+            s = ((math.log(r) if self.log_grid else r) - self.u0)/self.du
+            i = min(int(s), self.u.size - 2)
+            t = s - i
+        else:
+            r = asarray(r, dtype=float)
+            inside = (r >= self.r_min) & (r <= self.r_max)
+            r = clip(r, self.r_min, self.r_max)
+            s = ((log(r) if self.log_grid else r) - self.u0)/self.du
+            i = minimum(s.astype(int64), self.u.size - 2)
+            t = s - i
+        c = self.coefficients.take(i, axis=1)
+        k = self.k
+        f = ((c[3*k:]*t + c[2*k:3*k])*t + c[k:2*k])*t + c[:k]
+        if self.n_values < k:
+            f[self.n_values:] *= inside
+        return f
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
@@ -0,0 +1,140 @@
+"""
+===============================================================================
+Adaptive (quadtree) sampling of the image plane
+===============================================================================
+The photons are traced on a coarse grid of pixels and each cell of the grid
+is recursively divided into four while the rays in its corners disagree
+(different termination, crossing of the disk from different sides or a
+difference of energy flux above a threshold). The pixels inside the smooth
+cells are not traced: their final states are bilinearly interpolated from
+the corners and their energy flux is evaluated at the interpolated radius.
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+from numpy import (zeros, arange, append, unique, meshgrid, array, sign,
+                   concatenate, linspace, newaxis, where, int64)
+from common.bundle import DISK
+
+
+def subdivide(cells):
+    '''
+    Divides each cell [i0, j0, i1, j1] in four (or two, if it has a width of 
+    one pixel in one of the directions). Returns the array of children.
+    '''
+    i0, j0, i1, j1 = cells
+    can_i = i1 - i0 > 1
+    can_j = j1 - j0 > 1
+    mi = where(can_i, (i0 + i1)//2, i1)
+    mj = where(can_j, (j0 + j1)//2, j1)
+    children = [array([i0, j0, mi, mj]),
+                array([mi, j0, i1, mj])[:, can_i],
+                array([i0, mj, mi, j1])[:, can_j],
+                array([mi, mj, i1, j1])[:, can_i & can_j]]
+    return concatenate(children, axis=1)
+
+
+def fill_cell(image, i0, j0, i1, j1, traced, fP, status, flux):
+    '''
+    Fills the pixels of a smooth cell that were not traced
+    '''
+    ii = arange(i0, i1 + 1)
+    jj = arange(j0, j1 + 1)
+    u = linspace(0., 1., ii.size)[:, newaxis]
+    v = linspace(0., 1., jj.size)[newaxis, :]
+    empty = ~traced[i0:i1+1, j0:j1+1]
+    if status[i0, j0] == DISK:
+        cell = ((1 - u)*(1 - v))[..., newaxis]*fP[i0, j0] \
+             + (u*(1 - v))[..., newaxis]*fP[i1, j0] \
+             + ((1 - u)*v)[..., newaxis]*fP[i0, j1] \
+             + (u*v)[..., newaxis]*fP[i1, j1]
+        fP[i0:i1+1, j0:j1+1][empty] = cell[empty]
+        flux[i0:i1+1, j0:j1+1][empty] = image.acc_structure.energy_flux(
+                                            cell[empty][:, 1], cell[empty][:, 3])
+    status[i0:i1+1, j0:j1+1][empty] = status[i0, j0]
+
+
+def adaptive_trace(image, integrator='bundle', coarse=None, flux_tol=0.05,
+                   **kwargs):
+    '''
+    Creates the image data tracing only the photons needed to resolve the
+    structure of the image.
+    ===========================================================================
+    coarse : separation (in pixels) of the initial grid of traced photons
+             (by default min(x_pixels, y_pixels)//16, at least 2). A smaller
+             separation traces more photons but features smaller than the
+             coarse grid (thin rings, the edge of the shadow) are less likely
+             to be missed
+    flux_tol : maximum difference of the energy flux in the corners of a
+               smooth cell, relative to the maximum flux in the coarse grid
+    ===========================================================================
+    Returns the arrays image_data, final_states, status and a boolean mask
+    of the traced pixels.
+    '''
+    from common.common import trace_photons
+    nx, ny = image.detector.x_pixels, image.detector.y_pixels
+    if coarse is None:
+        coarse = max(2, min(nx, ny)//16)
+    traced = zeros([nx, ny], dtype=bool)
+    fP = zeros([nx, ny, 8])
+    status = zeros([nx, ny], dtype=int64)
+    flux = zeros([nx, ny])
+
+    def trace(ii, jj):
+        pixels = unique(ii*ny + jj)
+        pixels = pixels[~traced.ravel()[pixels]]
+        if pixels.size == 0:
+            return
+        i, j, fl, fp, st = trace_photons(image.photons[pixels], 
+                                         image.blackhole,
+                                         image.acc_structure, image.detector,
+                                         integrator, **kwargs)
+        flux[i, j] = fl
+        fP[i, j] = fp
+        status[i, j] = st
+        traced[i, j] = True
+
+    # Coarse grid
+    xs = unique(append(arange(0, nx, coarse), nx - 1))
+    ys = unique(append(arange(0, ny, coarse), ny - 1))
+    I, J = meshgrid(xs, ys, indexing='ij')
+    trace(I.ravel(), J.ravel())
+    scale = flux[traced].max()
+    if scale <= 0.:
+        scale = 1.
+
+    I0, J0 = meshgrid(xs[:-1], ys[:-1], indexing='ij')
+    I1, J1 = meshgrid(xs[1:], ys[1:], indexing='ij')
+    cells = array([I0.ravel(), J0.ravel(), I1.ravel(), J1.ravel()])
+
+    while cells.shape[1] > 0:
+        i0, j0, i1, j1 = cells
+        corners = [(i0, j0), (i1, j0), (i0, j1), (i1, j1)]
+        st = array([status[i, j] for i, j in corners])
+        side = array([sign(fP[i, j, 6]) for i, j in corners])
+        fl = array([flux[i, j] for i, j in corners])
+        uniform = (st == st[0]).all(axis=0) & (side == side[0]).all(axis=0) \
+                  & (fl.max(axis=0) - fl.min(axis=0) <= flux_tol*scale)
+        smallest = (i1 - i0 <= 1) & (j1 - j0 <= 1)
+
+        for c in cells[:, uniform & ~smallest].T:
+            fill_cell(image, *c, traced, fP, status, flux)
+
+        # Divide the non-uniform cells and trace the corners of the children
+        refine = cells[:, ~uniform & ~smallest]
+        cells = subdivide(refine)
+        if cells.shape[1] > 0:
+            trace(concatenate([cells[0], cells[2], cells[0], cells[2]]),
+                  concatenate([cells[1], cells[1], cells[3], cells[3]]))
+
+    return flux, fP, status, traced
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
@@ -0,0 +1,280 @@
+"""
+===============================================================================
+Semi-analytic ray tracing in the Kerr spacetime
+===============================================================================
+Null geodesics in the Kerr spacetime are integrable. Each ray is described by
+the conserved quantities
+
+    lambda = L/E,    eta = Q/E^2    and    nu = -2H/E^2
+
+(E = -k_t, L = k_phi, Q the Carter constant and H the Hamiltonian: the
+initial data of the detector at a finite distance is only approximately
+null, so the rays are traced as the geodesics of their initial state, as
+the other integrators do) and, in terms of the Mino time tau
+(d tau = E d lambda_affine / Sigma), the angular and radial motions
+decouple:
+
+    (d cos(theta)/d tau)^2 = alpha^2 (u_+ - cos^2(theta))(cos^2(theta) - u_-)
+    (dr/d tau)^2 = R(r) = (r^2 + a^2 - a lambda)^2
+                          - Delta (nu r^2 + eta + (lambda - a)^2)
+
+with alpha^2 = a^2 (1 - nu).
+
+The Mino time of the m-th crossing of the equatorial plane follows from the
+angular motion in terms of complete and incomplete elliptic integrals of the
+first kind, and the radius at that Mino time is obtained by inverting the
+radial integral with Jacobi elliptic functions (Gralla & Lupsasca 2020,
+Phys. Rev. D 101, 044032). When R(r) has no real roots (rays falling almost
+radially into the black hole) the radial integral is inverted numerically
+with Gauss-Legendre quadratures. There is no integration step at all.
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+from numpy import (zeros, full, sqrt, sign, cos, arcsin, arccos, abs, real,
+                   imag, sort, where, inf, clip, ones, array, pi, errstate)
+from numpy.linalg import eigvals
+from numpy.polynomial.legendre import leggauss
+from scipy.special import ellipk, ellipkinc, ellipj
+from common.bundle import DISK, HORIZON, ESCAPE
+from common.far_field import ray_constants
+
+
+def radial_roots(lam, eta, nu, blackhole):
+    '''
+    Roots of the radial potential
+    R(r) = (1 - nu) r^4 + 2M nu r^3 + (2A - a^2 nu - C) r^2 + 2MC r
+           + A^2 - a^2 C,    A = a^2 - a lambda,    C = eta + (lambda - a)^2
+    computed as the eigenvalues of the companion matrices. Returns an array
+    of shape (N, 4).
+    '''
+    a = blackhole.a
+    M = blackhole.M
+    n = lam.size
+    A = a*a - a*lam
+    C = eta + (lam - a)**2
+    lead = 1 - nu
+    companion = zeros([n, 4, 4])
+    companion[:, 1, 0] = 1.
+    companion[:, 2, 1] = 1.
+    companion[:, 3, 2] = 1.
+    companion[:, 0, 3] = -(A*A - a*a*C)/lead
+    companion[:, 1, 3] = -2*M*C/lead
+    companion[:, 2, 3] = -(2*A - a*a*nu - C)/lead
+    companion[:, 3, 3] = -2*M*nu/lead
+    return eigvals(companion)
+
+
+def mino_time_crossings(theta_o, k_th, lam, eta, a, n_max):
+    '''
+    Mino time from the detector to the m-th crossing of the equatorial plane
+    (m = 1, ..., n_max + 1). Returns an array of shape (n_max + 1, N), with
+    nan for the rays with eta < 0, which never reach the equatorial plane.
+    a is the coefficient alpha = a sqrt(1 - nu) of the angular potential
+    (an array, one value for each ray).
+    '''
+    x_o = cos(theta_o)
+    a2 = a*a
+    with errstate(invalid='ignore', divide='ignore'):
+        Dth = 0.5*(1 - (eta + lam**2)/a2)
+        u_m = Dth - sqrt(Dth**2 + eta/a2)
+        u_p = -(eta/a2)/u_m
+        m_th = u_p/u_m
+        K = ellipk(m_th)
+        F_o = ellipkinc(arcsin(clip(abs(x_o)/sqrt(u_p), 0., 1.)), m_th)
+        # The ray moves initially towards the equatorial plane?
+        towards = where(sign(k_th) == -sign(x_o), 1., -1.)
+        G = array([(2*m - 1)*K + towards*(F_o - K) for m in range(1, n_max + 2)])
+        return G/(a*sqrt(-u_m))
+
+
+def radius_four_real(tau, r_s, r1, r2, r3, r4):
+    '''
+    Radius at Mino time tau for rays whose radial potential has four real
+    roots r1 < r2 < r3 < r4 < r_s. Returns also the Mino times at which the
+    ray reaches the turning point r4 and infinity.
+    '''
+    r31, r32, r41, r42 = r3 - r1, r3 - r2, r4 - r1, r4 - r2
+    k = r32*r41/(r31*r42)
+    c = 0.5*sqrt(r31*r42)
+    tau_turn = ellipkinc(arcsin(sqrt(clip(r31*(r_s - r4)/(r41*(r_s - r3)), 0., 1.))), k)/c
+    tau_inf = tau_turn + ellipkinc(arcsin(sqrt(clip(r31/r41, 0., 1.))), k)/c
+    sn, cn, dn, ph = ellipj(c*(tau - tau_turn), k)
+    S = sn*sn
+    return (r31*r4 - S*r41*r3)/(r31 - S*r41), tau_turn, tau_inf
+
+
+def radius_two_real(tau, r_s, r1, r2, r3):
+    '''
+    Radius at Mino time tau for rays whose radial potential has two real
+    roots r1 < r2 and a pair of complex roots r3, r4 = conj(r3). Returns also
+    the function giving the Mino time needed to go from r_s to a radius r.
+    '''
+    A = abs(r3 - r2)
+    B = abs(r3 - r1)
+    r21 = r2 - r1
+    k = ((A + B)**2 - r21**2)/(4*A*B)
+    c = sqrt(A*B)
+
+    def mino(r):
+        x = (A*(r - r1) - B*(r - r2))/(A*(r - r1) + B*(r - r2))
+        return ellipkinc(arccos(clip(x, -1., 1.)), k)/c
+
+    sn, cn, dn, ph = ellipj(c*(mino(r_s) - tau), k)
+    r = ((B*r2 - A*r1) + (B*r2 + A*r1)*cn)/((B - A) + (B + A)*cn)
+    return r, lambda r_end: mino(r_s) - mino(r_end)
+
+
+def radius_no_real(tau, r_s, lam, eta, nu, blackhole, n_nodes=64, 
+                   iterations=50):
+    '''
+    Radius at Mino time tau for rays whose radial potential has no real
+    roots, obtained by bisection on the Mino time computed with
+    Gauss-Legendre quadratures in x = 1/r. Returns also the Mino time needed
+    to reach the horizon.
+    '''
+    a = blackhole.a
+    M = blackhole.M
+    nodes, weights = leggauss(n_nodes)
+
+    def mino(x_end):
+        # Mino time from 1/r_s to x_end (x_end of shape (N,) or (n, N))
+        x0 = 1/r_s
+        shape = (n_nodes,) + (1,)*x_end.ndim
+        x = 0.5*(x_end - x0)*nodes.reshape(shape) + 0.5*(x_end + x0)
+        r = 1/x
+        Delta = r*r - 2*M*r + a*a
+        R = (r*r + a*a - a*lam)**2 - Delta*(nu*r*r + eta + (lam - a)**2)
+        return 0.5*(x_end - x0)*(weights.reshape(shape)/(x*x*sqrt(R))).sum(axis=0)
+
+    tau_H = mino(full(r_s.shape, 1/blackhole.EH))
+    lo = zeros(tau.shape) + 1/r_s
+    hi = full(tau.shape, 1/blackhole.EH)
+    target = clip(tau, 0., tau_H)
+    for _ in range(iterations):
+        mid = 0.5*(lo + hi)
+        before = mino(mid) < target
+        lo = where(before, mid, lo)
+        hi = where(before, hi, mid)
+    return 1/(0.5*(lo + hi)), tau_H
+
+
+def geo_integ_analytic(iC, blackhole, acc_structure, detector, n_max=2,
+                       horizon_tol=1e-2, n_cross=None, **kwargs):
+    '''
+    Finds the crossings of the equatorial plane of the rays with initial
+    conditions iC (array of shape (8, N)) in the Kerr spacetime using the
+    constants of motion, up to the crossing of order n_max.
+    Returns the array fP of shape (8, N) with the state of each ray at its
+    first crossing inside the accretion structure (zeros if the ray does not
+    hit it) and the termination code of each ray, as
+    common.bundle.geo_integ_bundle. With n_cross, the states at the first
+    n_cross crossings are returned in an array of shape (n_cross, 8, N)
+    instead. The coordinates t and phi are not computed and they are set
+    to zero.
+    The rays are the geodesics of the initial data iC, which is only
+    approximately null at a finite distance (nu = -2H/E^2 != 0), so the
+    results are those of the other integrators with the same photons.
+    '''
+    a = blackhole.a
+    M = blackhole.M
+    if not 0 < a < M:
+        raise ValueError('The analytic integrator needs a Kerr black hole '
+                         'with 0 < a < M')
+    if n_cross is not None:
+        n_max = n_cross - 1
+    n = iC.shape[1]
+    E, lam, eta, nu = ray_constants(iC, blackhole)
+    r_s = iC[1]
+    r_plus = blackhole.EH
+
+    tau = mino_time_crossings(iC[2], iC[6], lam, eta, a*sqrt(1 - nu), n_max)
+
+    # Classification of the rays by the roots of the radial potential. The
+    # radial Mino times are computed for the monic polynomial R/(1 - nu),
+    # so they are scaled by sqrt(1 - nu).
+    roots = radial_roots(lam, eta, nu, blackhole)
+    scale = sqrt(1 - nu)
+    n_real = (abs(imag(roots)) < 1e-9*(1 + abs(roots))).sum(axis=1)
+    radius = full(tau.shape, inf)
+    tau_end = full(n, inf)
+    tau_turn = full(n, inf)
+    captured = ones(n, dtype=bool)
+
+    four = n_real == 4
+    if four.any():
+        r1, r2, r3, r4 = sort(real(roots[four]), axis=1).T
+        rs = r_s[four]
+        sc = scale[four]
+        radius[:, four], tau_turn[four], tau_inf = radius_four_real(tau[:, four]*sc, 
+                                                                   rs, r1, r2, r3, r4)
+        tau_turn[four] /= sc
+        # Rays with a turning point outside the horizon escape to infinity,
+        # the others reach the horizon in the inward leg
+        outside = r4 > r_plus
+        r31, r32, r41, r42 = r3 - r1, r3 - r2, r4 - r1, r4 - r2
+        k = r32*r41/(r31*r42)
+        tau_H = tau_turn[four] - ellipkinc(arcsin(sqrt(clip(r31*(r_plus - r4)/(r41*(r_plus - r3)),
+                                                            0., 1.))), k)/(0.5*sqrt(r31*r42)*sc)
+        tau_end[four] = where(outside, tau_inf/sc, tau_H)
+        captured[four] = ~outside
+
+    two = n_real == 2
+    if two.any():
+        rr = roots[two]
+        is_real = abs(imag(rr)) < 1e-9*(1 + abs(rr))
+        real_roots = sort(real(rr[is_real].reshape(-1, 2)), axis=1)
+        r3 = rr[~is_real].reshape(-1, 2)[:, 0]
+        r1, r2 = real_roots.T
+        radius[:, two], mino = radius_two_real(tau[:, two]*scale[two], r_s[two], 
+                                               r1, r2, r3)
+        tau_end[two] = mino(r_plus)/scale[two]
+
+    none = n_real == 0
+    if none.any():
+        radius[:, none], tau_end[none] = radius_no_real(tau[:, none], r_s[none],
+                                                       lam[none], eta[none],
+                                                       nu[none],
+                                                       blackhole)
+
+    # States at the crossings reached before the horizon or infinity
+    r_horizon = (1. + horizon_tol)*r_plus
+    states = zeros([n_max + 1, 8, n])
+    x_o = sign(cos(iC[2]))
+    for m in range(n_max + 1):
+        r = radius[m]
+        ok = (tau[m] < tau_end) & (r > r_horizon) & (eta > 0)
+        r = r[ok]
+        Delta = r*r - 2*M*r + a*a
+        R = (r*r + a*a - a*lam[ok])**2 - Delta*(nu[ok]*r*r + eta[ok] 
+                                                + (lam[ok] - a)**2)
+        inward = tau[m, ok] < tau_turn[ok]
+        states[m, 1, ok] = r
+        states[m, 2, ok] = pi/2
+        states[m, 4, ok] = -E[ok]
+        states[m, 5, ok] = where(inward, 1., -1.)*E[ok]*sqrt(clip(R, 0., inf))/Delta
+        states[m, 6, ok] = -x_o[ok]*(-1.)**m*E[ok]*sqrt(eta[ok])
+        states[m, 7, ok] = E[ok]*lam[ok]
+    status = where(captured, HORIZON, ESCAPE)
+    if n_cross is not None:
+        return states, status
+
+    # First crossing inside the accretion structure
+    fP = zeros([8, n])
+    for m in range(n_max + 1):
+        r = states[m, 1]
+        hit = (status != DISK) & (r > acc_structure.in_edge) \
+              & (r < acc_structure.out_edge)
+        fP[:, hit] = states[m][:, hit]
+        status[hit] = DISK
+    return fP, status
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
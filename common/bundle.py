@@ -0,0 +1,243 @@
+"""
+===============================================================================
+Batched integration of photon bundles in a curved spacetime
+===============================================================================
+All the photons of an image (or a chunk of them) are advanced together as
+arrays of shape (8, N) with an explicit Dormand-Prince 5(4) scheme. Each ray
+has its own adaptive step and it is removed from the bundle as soon as it
+hits the accretion structure, crosses the horizon, escapes or reaches the
+maximum value of the affine parameter.
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+from numpy import (asarray, array, zeros, full, abs, sqrt, cos, minimum,
+                   maximum, clip, isfinite, where, arange, ones)
+
+
+# Termination codes of the rays
+RUNNING = 0
+DISK = 1
+HORIZON = 2
+ESCAPE = 3
+MAX_LENGTH = 4
+FAILED = 5
+
+
+# Dormand-Prince 5(4) coefficients
+A = [[],
+     [1/5],
+     [3/40, 9/40],
+     [44/45, -56/15, 32/9],
+     [19372/6561, -25360/2187, 64448/6561, -212/729],
+     [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+     [35/384, 0., 500/1113, 125/192, -2187/6784, 11/84]]
+B = [35/384, 0., 500/1113, 125/192, -2187/6784, 11/84, 0.]
+E = [71/57600, 0., -71/16695, 71/1920, -17253/339200, 22/525, -1/40]
+
+
+def rhs(blackhole, y):
+    '''
+    Evaluates the geodesic equations for all the rays in the array y
+    of shape (8, N)
+    '''
+    return asarray(blackhole.geodesics(y, 0.))
+
+
+def dopri_step(blackhole, y, f, h):
+    '''
+    Performs a Dormand-Prince step of size h (one value per ray) from the
+    states y with derivatives f. Returns the new states, their derivatives
+    and the estimate of the local error.
+    '''
+    k = [f]
+    for s in range(1, 7):
+        dy = A[s][0]*k[0]
+        for m in range(1, s):
+            if A[s][m] != 0.:
+                dy = dy + A[s][m]*k[m]
+        k.append(rhs(blackhole, y + h*dy))
+    y_new = y + h*(B[0]*k[0] + B[2]*k[2] + B[3]*k[3] + B[4]*k[4] + B[5]*k[5])
+    err = h*(E[0]*k[0] + E[2]*k[2] + E[3]*k[3] + E[4]*k[4] + E[5]*k[5]
+             + E[6]*k[6])
+    return y_new, k[6], err
+
+
+def hermite(y0, f0, y1, f1, h, s):
+    '''
+    Cubic Hermite interpolant between the states y0 and y1 (with derivatives
+    f0 and f1) evaluated at the fraction s of the step h
+    '''
+    s2 = s*s
+    s3 = s2*s
+    h00 = 2*s3 - 3*s2 + 1
+    h10 = s3 - 2*s2 + s
+    h01 = -2*s3 + 3*s2
+    h11 = s3 - s2
+    return h00*y0 + h10*h*f0 + h01*y1 + h11*h*f1
+
+
+def equatorial_crossing(y0, f0, y1, f1, h, iterations=40):
+    '''
+    Locates, by bisection on the Hermite interpolant, the point where each
+    ray crosses the equatorial plane theta = pi/2 inside its last step.
+    Returns the fraction of the step and the state at the crossing.
+    '''
+    lo = zeros(y0.shape[1])
+    hi = ones(y0.shape[1])
+    sign0 = cos(y0[2]) > 0
+    for _ in range(iterations):
+        mid = 0.5*(lo + hi)
+        th = hermite(y0[2], f0[2], y1[2], f1[2], h, mid)
+        same = (cos(th) > 0) == sign0
+        lo = where(same, mid, lo)
+        hi = where(same, hi, mid)
+    s = 0.5*(lo + hi)
+    return s, hermite(y0, f0, y1, f1, h, s)
+
+
+def geo_integ_bundle(iC, blackhole, acc_structure, detector, rtol=1e-8,
+                     atol=1e-8, r_escape=None, horizon_tol=1e-2,
+                     max_steps=20000, n_cross=None, n_images=None, stats=None):
+    '''
+    Integrates the motion equations of a bundle of photons
+    ===========================================================================
+    iC : array of shape (8, N) with the initial conditions of the rays
+         (see initCond)
+    r_escape : rays moving outwards beyond this radius are considered to
+               escape (default: the outer edge of the accretion structure,
+               since rays moving outwards beyond it never come back)
+    horizon_tol : rays with r < (1 + horizon_tol)*EH are considered captured
+    n_cross : if given, the rays are not stopped by the accretion structure
+              and the states at their first n_cross crossings of the
+              equatorial plane are recorded (see common/transfer_map.py)
+    n_images : if given, the first n_images hits of the accretion structure
+               (the direct image and the higher order images) are recorded, 
+               each ray being stopped at its last one (see common/orders.py)
+    stats : if a dictionary is given, it is filled with the arrays steps
+            (number of steps, including the rejected ones), rhs_calls
+            (number of evaluations of the geodesic equations) and final 
+            (state at the end of the integration, or at the hit of the 
+            accretion structure, shape (8, N)) of each ray 
+            (see common/instrument.py)
+    ===========================================================================
+    Returns the array fP of shape (8, N) with the state of each ray at the
+    first crossing of the equatorial plane inside the accretion structure
+    (zeros if the ray does not hit it) and the termination code of each ray.
+    With n_cross, fP has shape (n_cross, 8, N) and it contains the states
+    at the crossings (zeros for the crossings not reached). With n_images, 
+    fP has shape (n_images, 9, N) and it contains the states at the hits, 
+    followed by their affine parameter (zeros for the hits not reached), 
+    and the status is DISK for the rays with at least one hit.
+    '''
+    if n_cross is not None and n_images is not None:
+        raise ValueError('n_cross and n_images cannot be used together')
+    iC = array(iC, dtype=float)
+    n = iC.shape[1]
+    final_lmbda = 1.5*detector.D
+    if r_escape is None:
+        r_escape = acc_structure.out_edge
+    r_horizon = (1. + horizon_tol)*blackhole.EH
+
+    if n_images is not None:
+        fP = zeros([n_images, 9, n])
+    else:
+        fP = zeros([8, n]) if n_cross is None else zeros([n_cross, 8, n])
+    crossed = zeros(n, dtype=int)
+    status = full(n, RUNNING)
+
+    # Arrays of the rays still in the bundle
+    idx = arange(n)
+    y = iC
+    f = rhs(blackhole, y)
+    lmbda = zeros(n)
+    h = -0.01*y[1]
+    steps = zeros(n, dtype=int)
+    total_steps = zeros(n, dtype=int)
+    final = iC.copy()
+
+    while idx.size > 0:
+        # Do not go beyond the final value of the affine parameter
+        h = maximum(h, -final_lmbda - lmbda)
+        y_new, f_new, err = dopri_step(blackhole, y, f, h)
+
+        scale = atol + rtol*maximum(abs(y), abs(y_new))
+        err_norm = sqrt(((err/scale)**2).mean(axis=0))
+        err_norm = where(isfinite(err_norm), err_norm, 1e10)
+        accept = err_norm <= 1.
+
+        factor = clip(0.9*err_norm**(-0.2), 0.2, 10.)
+        factor = where(accept, factor, minimum(factor, 1.))
+        h_next = h*factor
+        steps += 1
+        total_steps[idx] += 1
+
+        code = full(idx.size, RUNNING)
+
+        # Crossings of the equatorial plane inside the accretion structure
+        cross = accept & (cos(y[2])*cos(y_new[2]) <= 0.)
+        if cross.any():
+            s, yc = equatorial_crossing(y[:, cross], f[:, cross],
+                                        y_new[:, cross], f_new[:, cross],
+                                        h[cross])
+            if n_images is not None:
+                hit = (yc[1] > acc_structure.in_edge) & (yc[1] < acc_structure.out_edge)
+                c = where(cross)[0][hit]
+                rays = idx[c]
+                order = crossed[rays]
+                fP[order, :8, rays] = yc[:, hit].T
+                fP[order, 8, rays] = lmbda[c] + s[hit]*h[c]
+                crossed[rays] += 1
+                code[c[crossed[rays] >= n_images]] = DISK
+            elif n_cross is None:
+                hit = (yc[1] > acc_structure.in_edge) & (yc[1] < acc_structure.out_edge)
+                c = where(cross)[0][hit]
+                fP[:, idx[c]] = yc[:, hit]
+                code[c] = DISK
+            else:
+                rays = idx[cross]
+                order = crossed[rays]
+                rec = order < n_cross
+                fP[order[rec], :, rays[rec]] = yc[:, rec].T
+                crossed[rays] += 1
+
+        # Horizon, escape and maximum affine parameter
+        lmbda_new = lmbda + h
+        running = accept & (code == RUNNING)
+        code[running & (y_new[1] < r_horizon)] = HORIZON
+        code[running & (y_new[1] > r_escape) & (y_new[1] > y[1])] = ESCAPE
+        code[running & (lmbda_new <= -final_lmbda)] = MAX_LENGTH
+        code[(code == RUNNING) & ((abs(h_next) < 1e-12) | (steps >= max_steps))] = FAILED
+        done = code != RUNNING
+        status[idx[done]] = code[done]
+        final[:, idx[done]] = where(accept, y_new, y)[:, done]
+
+        # Advance the accepted rays and remove the finished ones
+        keep = ~done
+        y = where(accept, y_new, y)[:, keep]
+        f = where(accept, f_new, f)[:, keep]
+        lmbda = where(accept, lmbda_new, lmbda)[keep]
+        h = h_next[keep]
+        steps = steps[keep]
+        idx = idx[keep]
+
+    if n_images is not None:
+        # Rays that hit the structure less than n_images times
+        status[crossed > 0] = DISK
+    elif stats is not None and n_cross is None:
+        final[:, status == DISK] = fP[:, status == DISK]
+    if stats is not None:
+        # One evaluation at the start and six in each Dormand-Prince step
+        stats.update(steps=total_steps, rhs_calls=1 + 6*total_steps, 
+                     final=final)
+    return fP, status
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
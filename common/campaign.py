@@ -0,0 +1,234 @@
+"""
+===============================================================================
+Resumable campaigns of images of Kerr black holes
+===============================================================================
+A campaign renders one image for each entry (spin a, inclination iota,
+accretion structure) of a list of parameters. The images are distributed
+over a pool of processes and each finished image is written into a store in
+a directory with the files
+- parameters.npy : the list of parameters (the labels of the images)
+- images.npy     : array of shape (N, x_pixels, y_pixels), read and written
+                   as a memory map
+- completed.txt  : indices of the finished entries, one per line, appended
+                   once the image is on disk
+Running the campaign again on the same directory skips the completed
+entries, so an interrupted campaign only repeats the images that were in
+progress.
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+from numpy import zeros, load, save, array, array_equal, pi
+from numpy.lib.format import open_memmap
+from multiprocessing import Pool
+import os
+import sys
+import time
+
+
+PARAMETERS_DTYPE = [('a', float), ('iota', float), ('disk', 'U16')]
+
+
+def parameter_list(a, iota, disk='thin_disk'):
+    '''
+    Returns the structured array of parameters of a campaign from the
+    sequences (or single values) a, iota (in radians) and disk
+    '''
+    a = array(a, dtype=float, ndmin=1)
+    n = a.size
+    parameters = zeros(n, dtype=PARAMETERS_DTYPE)
+    parameters['a'] = a
+    parameters['iota'] = iota
+    parameters['disk'] = disk
+    return parameters
+
+
+def accretion_structure(disk, blackhole):
+    '''
+    Returns the accretion structure with name disk for the black hole
+    '''
+    from accretion_structures import (simple_disk, thin_disk, ring_disk,
+                                      ring_disk_2)
+    if disk == 'thin_disk':
+        return thin_disk.structure(blackhole)
+    elif disk == 'simple_disk':
+        return simple_disk.structure(blackhole, 6, 20)
+    elif disk == 'ring_disk':
+        return ring_disk.structure(blackhole)
+    elif disk == 'ring_disk_2':
+        return ring_disk_2.structure(blackhole)
+    raise ValueError("Unknown accretion structure '%s'" % disk)
+
+
+class CampaignStore:
+    '''
+    Directory with the images and the labels of a campaign
+    '''
+    def __init__(self, directory, parameters=None, shape=None):
+        '''
+        =======================================================================
+        directory : directory of the store
+        parameters : list of parameters of a new campaign (if the store
+                     exists, it must be the same list or None)
+        shape : (x_pixels, y_pixels) of the images of a new campaign
+        =======================================================================
+        '''
+        self.directory = directory
+        params_file = os.path.join(directory, 'parameters.npy')
+        images_file = os.path.join(directory, 'images.npy')
+        self.log_file = os.path.join(directory, 'completed.txt')
+        if os.path.exists(params_file):
+            self.parameters = load(params_file)
+            if parameters is not None and not array_equal(parameters,
+                                                          self.parameters):
+                raise ValueError('The directory %s contains a campaign with '
+                                 'other parameters' % directory)
+            self.images = open_memmap(images_file, mode='r+')
+            if shape is not None and self.images.shape[1:] != tuple(shape):
+                raise ValueError('The directory %s contains images with shape '
+                                 '%s' % (directory, self.images.shape[1:]))
+        else:
+            if parameters is None or shape is None:
+                raise FileNotFoundError('There is no campaign in %s'
+                                        % directory)
+            os.makedirs(directory, exist_ok=True)
+            self.parameters = array(parameters, dtype=PARAMETERS_DTYPE)
+            self.images = open_memmap(images_file, mode='w+', dtype=float,
+                                      shape=(len(parameters),) + tuple(shape))
+            # The parameters are written last: they mark a complete store
+            save(params_file, self.parameters)
+        self.completed = set()
+        if os.path.exists(self.log_file):
+            with open(self.log_file) as log:
+                for line in log:
+                    # A truncated last line is an entry in progress
+                    if line.endswith('\n'):
+                        self.completed.add(int(line))
+
+    def pending(self):
+        '''
+        Returns the indices of the entries that are not completed
+        '''
+        return [k for k in range(len(self.parameters))
+                if k not in self.completed]
+
+    def write(self, k, image_data):
+        '''
+        Writes the image of the entry k and marks it as completed
+        '''
+        self.images[k] = image_data
+        self.images.flush()
+        with open(self.log_file, 'a') as log:
+            log.write('%d\n' % k)
+            log.flush()
+            os.fsync(log.fileno())
+        self.completed.add(k)
+
+    def results(self):
+        '''
+        Returns the arrays (images, parameters) of the completed entries
+        '''
+        done = sorted(self.completed)
+        return array(self.images[done]), self.parameters[done]
+
+
+# Settings shared by the worker processes of a campaign
+campaign_settings = {}
+
+def init_campaign_worker(settings, quiet=True):
+    '''
+    Receives the settings of the campaign once in each worker process
+    '''
+    campaign_settings.clear()
+    campaign_settings.update(settings)
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+
+def render_entry(entry):
+    '''
+    Renders the image of one entry (k, a, iota, disk) of the campaign and
+    returns (k, image_data)
+    '''
+    from black_holes import kerr
+    from detectors import image_plane
+    from common.common import Image
+    k, a, iota, disk = entry
+    s = campaign_settings
+    blackhole = kerr.BlackHole(s['M'], a)
+    # The detectors are reused, with their grid of initial positions and
+    # momenta, by the entries with the same inclination
+    detectors = s.setdefault('detectors', {})
+    if iota not in detectors:
+        detectors[iota] = image_plane.detector(D=s['D'], iota=iota,
+                                               x_pixels=s['x_pixels'],
+                                               x_side=s['x_side'],
+                                               ratio=s['ratio'])
+    detector = detectors[iota]
+    acc_structure = accretion_structure(disk, blackhole)
+    image = Image(blackhole, acc_structure, detector)
+    image.create_photons()
+    image.create_image(integrator=s['integrator'], **s['kwargs'])
+    return k, image.image_data
+
+
+def run_campaign(directory, parameters=None, M=1., D=100., x_side=25.,
+                 x_pixels=90, ratio='16:9', integrator='jit', workers=1,
+                 **kwargs):
+    '''
+    Renders the images of the entries of parameters (see parameter_list)
+    that are not completed in the store of directory, distributing them
+    over workers processes. parameters can be omitted to resume an
+    existing campaign. Each image is written as soon as it is finished.
+    Returns the CampaignStore.
+    Additional keyword arguments are passed to the integrator.
+    '''
+    from detectors import image_plane
+    shape = None
+    if parameters is not None:
+        detector = image_plane.detector(D=D, iota=pi/2, x_pixels=x_pixels,
+                                        x_side=x_side, ratio=ratio)
+        shape = (detector.x_pixels, detector.y_pixels)
+    store = CampaignStore(directory, parameters, shape)
+    pending = store.pending()
+    n_total = len(store.parameters)
+    print('Campaign in %s: %d of %d images completed'
+          % (directory, n_total - len(pending), n_total))
+    if not pending:
+        return store
+
+    settings = dict(M=M, D=D, x_side=x_side, x_pixels=x_pixels, ratio=ratio,
+                    integrator=integrator, kwargs=kwargs)
+    entries = [(k,) + tuple(store.parameters[k].tolist()) for k in pending]
+    start_time = time.time()
+    if workers == 1:
+        init_campaign_worker(settings, quiet=False)
+        results = map(render_entry, entries)
+    else:
+        if integrator in ('jit', 'kerr_schild'):
+            # Compile the kernels once, before forking the workers, with a
+            # small image of the first entry
+            init_campaign_worker(dict(settings, x_pixels=2), quiet=False)
+            render_entry(entries[0])
+        pool = Pool(workers, initializer=init_campaign_worker,
+                    initargs=(settings,))
+        results = pool.imap_unordered(render_entry, entries)
+    for n, (k, image_data) in enumerate(results):
+        store.write(k, image_data)
+        print('\nImage %d (%d / %d of this run) saved'
+              % (k, n + 1, len(entries)))
+    if workers != 1:
+        pool.close()
+        pool.join()
+    total_time = time.time() - start_time
+    print("\n--- Total time of the campaign : %s seconds ---\n" % total_time)
+    return store
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
@@ -5,8 +5,28 @@ Common functions for ray tracing in a curved spacetime
 @author: Eduard Larrañga - 2023
 ===============================================================================
 """
-from scipy.integrate import odeint
-from numpy import linspace, cos, zeros, where, roll, save
+from scipy.integrate import odeint, LSODA, RK45, DOP853
+from scipy.optimize import brentq
+from numpy import (linspace, cos, zeros, where, roll, save, array, asarray, meshgrid, 
+                   sqrt, arange, abs, maximum, int64)
+from multiprocessing import Pool
+from common.jit import geo_integ_jit
+from common.adaptive import adaptive_trace
+from common.transfer import TransferTable
+from common.analytic import geo_integ_analytic
+from common.symplectic import geo_integ_symplectic
+from common.kerr_schild import geo_integ_kerr_schild
+from common.far_field import geo_integ_far_field
+from common.transfer_map import trace_crossings, cached_transfer_map
+from common.streaming import stream_render
+from common.tiles import create_job, TileJob
+from common.progressive import progressive_trace, save_preview
+from common.orders import image_orders
+from common.spectral import (redshift_map, disk_blackbody, spectral_images, 
+                             disk_spectrum, line_profile)
+from common.instrument import trace_instrumented, instrumented_worker, CostMaps
+from common.tolerance import trace_controlled, controlled_worker
+from common.bundle import geo_integ_bundle, DISK, HORIZON, ESCAPE, MAX_LENGTH, FAILED
 import matplotlib.pyplot as plt
 import sys
 import time
@@ -29,6 +49,9 @@ def initCond(x, k, blackhole):
     kr = k[1]
     ktheta = k[2]
     kphi = k[3]
+
+    The components can be numbers or arrays (all the photons of an image
+    at once).
     '''
     # Metric components
     g_tt, g_rr, g_thth, g_phph, g_tph= blackhole.metric(x)
@@ -43,6 +66,57 @@ def initCond(x, k, blackhole):
 
 
 
+def inverse_metric(x, blackhole):
+    '''
+    Returns the non-zero components [g^tt, g^rr, g^thth, g^phph, g^tph] 
+    of the inverse metric, obtained from blackhole.metric(x)
+    '''
+    g_tt, g_rr, g_thth, g_phph, g_tph = blackhole.metric(x)
+    det = g_tt*g_phph - g_tph*g_tph
+    return [g_phph/det, 1/g_rr, 1/g_thth, g_tt/det, -g_tph/det]
+
+
+def hamiltonian(q, blackhole):
+    '''
+    Returns H = g^{mu nu} k_mu k_nu / 2 for the states 
+    q = [t, r, theta, phi, k_t, k_r, k_theta, k_phi]. 
+    H = 0 for null geodesics.
+    '''
+    gtt, grr, gthth, gphph, gtph = inverse_metric(q[0:4], blackhole)
+    return 0.5*(gtt*q[4]**2 + 2*gtph*q[4]*q[7] + gphph*q[7]**2 
+                + grr*q[5]**2 + gthth*q[6]**2)
+
+
+def carter_constant(q, blackhole):
+    '''
+    Returns the Carter constant 
+    Q = k_theta^2 + cos^2(theta)*(k_phi^2/sin^2(theta) - a^2 (k_t^2 + 2H)) 
+    of the states q, where H is the Hamiltonian (H = 0 for null geodesics, 
+    but the initial data of the detector is only approximately null). It is
+    conserved in the Kerr spacetime and in the static and spherically 
+    symmetric spacetimes (a = 0), where Q + k_phi^2 is the square of the 
+    total angular momentum.
+    '''
+    cos_th2 = cos(q[2])**2
+    return q[6]**2 + cos_th2*(q[7]**2/(1 - cos_th2) 
+                              - blackhole.a**2*(q[4]**2 + 2*hamiltonian(q, blackhole)))
+
+
+def constraint_drift(q0, q, blackhole):
+    '''
+    Returns the drift of the constants of the rays between the initial 
+    states q0 and the states q: the maximum of |H - H0|/k_t^2 and 
+    |Q - Q0|/(|Q0| + k_phi^2 + (M k_t)^2), where H is the Hamiltonian (which 
+    is zero for null geodesics) and Q is the Carter constant
+    '''
+    E2 = q0[4]**2
+    Q0 = carter_constant(q0, blackhole)
+    dH = abs(hamiltonian(q, blackhole) - hamiltonian(q0, blackhole))/E2
+    dQ = abs(carter_constant(q, blackhole) - Q0)/(abs(Q0) + q0[7]**2 
+                                                  + blackhole.M**2*E2)
+    return maximum(dH, dQ)
+
+
 class Photon:
     def __init__(self, alpha, beta, freq=1.):
         '''
@@ -64,6 +138,17 @@ class Photon:
         
         # Stores the final values of coordinates and momentum 
         self.fP = None
+
+        # Termination code of the integration (see common/bundle.py)
+        self.status = None
+
+        # Number of steps and evaluations of the geodesic equations
+        self.steps = None
+        self.rhs_calls = None
+
+        # Last state of the integration (the crossing with the accretion 
+        # structure if the photon hits it)
+        self.last = None
     
     def initial_conditions(self, blackhole):
         '''
@@ -73,15 +158,50 @@ class Photon:
         self.iC = initCond(self.xin, self.kin, blackhole)
 
 
-def geo_integ(p, blackhole, acc_structure, detector):
+class Photons:
+    '''
+    Set of photons stored as arrays: the pixel coordinates i, j and the
+    initial conditions iC with shape (8, N). Indexing (with a slice or an
+    array of indices) returns a subset of the photons.
+    '''
+    def __init__(self, i, j, iC):
+        self.i = i
+        self.j = j
+        self.iC = iC
+
+    def __len__(self):
+        return self.i.size
+
+    def __getitem__(self, k):
+        return Photons(self.i[k], self.j[k], self.iC[:, k])
+
+    def photon(self, m, detector):
+        '''
+        Returns the photon m as a Photon object
+        '''
+        p = Photon(alpha=detector.alphaRange[self.i[m]], 
+                   beta=detector.betaRange[self.j[m]])
+        p.i, p.j = self.i[m], self.j[m]
+        p.iC = self.iC[:, m]
+        return p
+
+
+def geo_integ(p, blackhole, acc_structure, detector, rtol=None, atol=None):
     '''
     Integrates the motion equations of the photon 
+    (rtol and atol are the tolerances of odeint, which uses its own 
+    default values if they are not given)
     '''
     final_lmbda = 1.5*detector.D
     lmbda = linspace(0, -final_lmbda,int(7*final_lmbda))
-    sol = odeint(blackhole.geodesics, p.iC, lmbda)
+    sol, info = odeint(blackhole.geodesics, p.iC, lmbda, rtol=rtol, atol=atol,
+                       full_output=True)
+    p.steps = info['nst'][-1]
+    p.rhs_calls = info['nfe'][-1]
     
     p.fP = [0.,0.,0.,0.,0.,0.,0.,0.]
+    p.status = MAX_LENGTH
+    p.last = sol[-1]
     zi = cos(sol[:,2])
     zi1 = roll(zi,-1)
     zi1[-1] = 0.
@@ -89,7 +209,131 @@ def geo_integ(p, blackhole, acc_structure, detector):
     for i in indxs: 
         if sol[i,1] < acc_structure.out_edge and sol[i,1] > acc_structure.in_edge:
             p.fP = sol[i]
+            p.last = sol[i]
+            p.status = DISK
+            break
+
+
+SOLVERS = {'LSODA': LSODA, 'RK45': RK45, 'DOP853': DOP853}
+
+def geo_integ_events(p, blackhole, acc_structure, detector, method='LSODA',
+                     rtol=1e-8, atol=1e-8, r_escape=None, horizon_tol=1e-2):
+    '''
+    Integrates the motion equations of the photon until it hits the 
+    accretion structure, crosses the horizon (r < (1 + horizon_tol)*EH), 
+    escapes moving outwards beyond r_escape (default: the outer edge 
+    of the accretion structure) 
+    or reaches lambda = -1.5*D. The crossings of the equatorial plane 
+    are located by root-finding on the dense output of the solver.
+    '''
+    final_lmbda = 1.5*detector.D
+    if r_escape is None:
+        r_escape = acc_structure.out_edge
+    r_horizon = (1. + horizon_tol)*blackhole.EH
+    solver = SOLVERS[method](lambda lmbda, q: asarray(blackhole.geodesics(q, lmbda)),
+                             0., p.iC, -final_lmbda, rtol=rtol, atol=atol)
+    
+    p.fP = zeros(8)
+    p.status = MAX_LENGTH
+    p.steps = 0
+    p.last = solver.y.copy()
+    y_old = solver.y.copy()
+    while solver.status == 'running':
+        solver.step()
+        p.steps += 1
+        p.rhs_calls = solver.nfev
+        if solver.status == 'failed':
+            p.status = FAILED
+            break
+        y = solver.y
+        if cos(y_old[2])*cos(y[2]) <= 0.:
+            sol = solver.dense_output()
+            lmbda_c = brentq(lambda lmbda: cos(sol(lmbda)[2]), solver.t_old, solver.t)
+            yc = sol(lmbda_c)
+            if yc[1] > acc_structure.in_edge and yc[1] < acc_structure.out_edge:
+                p.fP = yc
+                p.last = yc
+                p.status = DISK
+                break
+        p.last = y.copy()
+        if y[1] < r_horizon:
+            p.status = HORIZON
+            break
+        if y[1] > r_escape and y[1] > y_old[1]:
+            p.status = ESCAPE
             break
+        y_old = y.copy()
+
+
+def trace_photons(photons, blackhole, acc_structure, detector, 
+                  integrator='odeint', r_switch=None, **kwargs):
+    '''
+    Integrates the trajectories of a set of photons (see Photons) with the 
+    chosen integrator and returns the arrays (i, j, flux, fP, status) with the 
+    pixel coordinates, the energy flux, the final state and the 
+    termination code of each photon. With r_switch, the bundle integrators
+    only integrate inside r_switch (see common/far_field.py).
+    '''
+    if r_switch is not None and integrator in ('odeint', 'events', 'analytic'):
+        raise ValueError("The integrator '%s' cannot be used with r_switch" 
+                         % integrator)
+    if integrator in ('odeint', 'events'):
+        fP = zeros([len(photons), 8])
+        status = zeros(len(photons), dtype=int64)
+        for m in range(len(photons)):
+            p = photons.photon(m, detector)
+            if integrator == 'odeint':
+                geo_integ(p, blackhole, acc_structure, detector, **kwargs)
+            else:
+                geo_integ_events(p, blackhole, acc_structure, detector, **kwargs)
+            fP[m] = p.fP
+            status[m] = p.status
+    elif integrator in ('bundle', 'jit', 'analytic', 'symplectic', 
+                        'kerr_schild'):
+        integ = {'bundle': geo_integ_bundle, 'jit': geo_integ_jit, 
+                 'analytic': geo_integ_analytic, 
+                 'symplectic': geo_integ_symplectic,
+                 'kerr_schild': geo_integ_kerr_schild}[integrator]
+        if r_switch is None:
+            fP, status = integ(photons.iC, blackhole, acc_structure, detector, 
+                               **kwargs)
+        else:
+            fP, status = geo_integ_far_field(integ, photons.iC, blackhole, 
+                                             acc_structure, detector, r_switch, 
+                                             **kwargs)
+        fP = fP.T
+    else:
+        raise ValueError("Unknown integrator '%s'" % integrator)
+    flux = acc_structure.energy_flux(fP[:,1], fP[:,3])
+    return photons.i, photons.j, flux, fP, status
+
+
+# Scene shared by the worker processes of a parallel render
+worker_scene = {}
+
+def init_worker(blackhole, acc_structure, detector, integrator, kwargs):
+    '''
+    Receives the scene once in each worker process
+    '''
+    worker_scene.update(blackhole=blackhole, acc_structure=acc_structure, 
+                        detector=detector, integrator=integrator, kwargs=kwargs)
+
+def trace_worker(photons):
+    '''
+    Integrates a chunk of photons in a worker process
+    '''
+    s = worker_scene
+    return trace_photons(photons, s['blackhole'], s['acc_structure'], 
+                         s['detector'], s['integrator'], **s['kwargs'])
+
+def crossings_worker(photons):
+    '''
+    Records the crossings of a chunk of photons in a worker process 
+    (see common/transfer_map.py)
+    '''
+    s = worker_scene
+    return trace_crossings(photons, s['blackhole'], s['acc_structure'], 
+                           s['detector'], s['integrator'], **s['kwargs'])
 
 
 class Image:
@@ -104,39 +348,393 @@ class Image:
 
     def create_photons(self):
         '''
-        Creates the photon list
+        Creates the set of photons of all the pixels (see Photons), ordered 
+        by rows of constant alpha. The initial positions and momenta are 
+        taken from the detector, which computes them only once.
         '''
         print('Creating photons ...')
-        self.photon_list = []
-        i=0
-        for a in self.detector.alphaRange:
-            j = 0
-            for b in self.detector.betaRange:
-                p = Photon(alpha=a, beta=b)
-                p.xin, p.kin = self.detector.photon_coords(a, b) 
-                p.i, p.j = i, j
-                p.initial_conditions(self.blackhole)
-                self.photon_list.append(p)
-                j += 1
-            i += 1
+        xin, kin = self.detector.photon_grid()
+        nx, ny = self.detector.x_pixels, self.detector.y_pixels
+        i, j = meshgrid(arange(nx), arange(ny), indexing='ij')
+        iC = array(initCond(xin.reshape(4, -1), kin.reshape(4, -1), 
+                            self.blackhole))
+        self.photons = Photons(i.ravel(), j.ravel(), iC)
     
-    def create_image(self):
+    def create_image(self, integrator='odeint', workers=1, chunk_size=None, 
+                     instrument=False, drift_tol=None, tolerances=None, 
+                     **kwargs):
         '''
         Creates the image data 
+        integrator : 'odeint' integrates each photon separately, 
+                     'events' integrates each photon separately and stops 
+                     as soon as it hits the disk, crosses the horizon 
+                     or escapes,
+                     'bundle' integrates each chunk of photons 
+                     together (see common/bundle.py), 
+                     'jit' uses the compiled kernels of the metric when 
+                     numba is installed (see common/jit.py), 
+                     'analytic' finds the crossings of the disk of a Kerr 
+                     black hole from the constants of motion with elliptic 
+                     integrals, without integration steps 
+                     (see common/analytic.py), 
+                     'symplectic' integrates each chunk of photons together
+                     with a fixed step symplectic method that keeps the 
+                     drift of the null condition bounded 
+                     (see common/symplectic.py), 
+                     'kerr_schild' uses compiled kernels in Cartesian 
+                     Kerr-Schild coordinates, regular at the horizon and at 
+                     the poles, for the Kerr and Schwarzschild black holes 
+                     (see common/kerr_schild.py). 
+        workers : number of processes used to integrate the photons. 
+                  The results are identical to the ones of the serial path 
+                  (workers=1), except for the rays in which odeint fails 
+                  (excess work near the horizon), whose output depends on 
+                  the previous calls even in a serial run. In platforms 
+                  without fork the call must be protected by 
+                  if __name__ == '__main__'.
+        chunk_size : number of photons in each work unit (default 64 for 
+                     the per-photon integrators and 2048 for the others)
+        instrument : record the evaluations of the geodesic equations, the 
+                     steps, the wall time, the termination and the warnings 
+                     of each photon in self.cost (see common/instrument.py)
+        drift_tol : if given, each photon is traced with the loosest 
+                    tolerance (rtol = atol) of the list tolerances (default: 
+                    drift_tol, drift_tol/10, ..., drift_tol/10^4) for which 
+                    the drift of the Hamiltonian and the Carter constant is 
+                    below drift_tol, tracing again only the photons that 
+                    violate it (see common/tolerance.py). The tolerance of 
+                    each photon is recorded in self.cost.rtol.
+        r_switch : if given (Kerr and Schwarzschild black holes), the rays 
+                   are moved analytically from the detector to the radius 
+                   r_switch, at least the outer edge of the accretion 
+                   structure, and only integrated inside it (not with 
+                   'odeint', 'events' or 'analytic'; see 
+                   common/far_field.py). It is also accepted by 
+                   create_image_orders and create_transfer_map.
+        Additional keyword arguments are passed to the integrator.
         '''
+        if chunk_size is None:
+            chunk_size = 64 if integrator in ('odeint', 'events') else 2048
+        n_photons = len(self.photons)
+        chunks = [self.photons[start:start+chunk_size] 
+                  for start in range(0, n_photons, chunk_size)]
         self.image_data = zeros([self.detector.x_pixels, self.detector.y_pixels])
-        photon=1
+        self.final_states = zeros([self.detector.x_pixels, self.detector.y_pixels, 8])
+        self.status = zeros([self.detector.x_pixels, self.detector.y_pixels], 
+                            dtype=int64)
+        trace, worker, trace_kwargs = trace_photons, trace_worker, kwargs
+        if drift_tol is not None:
+            trace, worker = trace_controlled, controlled_worker
+            trace_kwargs = dict(kwargs, drift_tol=drift_tol, tolerances=tolerances)
+        elif instrument:
+            trace, worker = trace_instrumented, instrumented_worker
+        if trace is not trace_photons:
+            self.cost = CostMaps(self.detector.x_pixels, self.detector.y_pixels)
         print('Integrating trajectories ...')
         start_time = time.time()
-        for p in self.photon_list:
-            geo_integ(p, self.blackhole, self.acc_structure, self.detector)
-            self.image_data[p.i, p.j] = self.acc_structure.energy_flux(p.fP[1])
-            sys.stdout.write("\rPhoton # %d" %photon)
+        if workers == 1:
+            results = (trace(chunk, self.blackhole, self.acc_structure, 
+                             self.detector, integrator, **trace_kwargs) 
+                       for chunk in chunks)
+        else:
+            if integrator in ('jit', 'kerr_schild'):
+                # Compile the kernels once, before forking the workers
+                trace_photons(chunks[0][:1], self.blackhole, self.acc_structure, 
+                              self.detector, integrator, **kwargs)
+            pool = Pool(workers, initializer=init_worker, 
+                        initargs=(self.blackhole, self.acc_structure, 
+                                  self.detector, integrator, trace_kwargs))
+            results = pool.imap(worker, chunks)
+        photon = 0
+        for chunk, result in zip(chunks, results):
+            i, j, flux, fP, status = result[:5]
+            self.image_data[i, j] = flux
+            self.final_states[i, j] = fP
+            self.status[i, j] = status
+            if len(result) > 5:
+                self.cost.record(i, j, status, result[5])
+            photon += len(chunk)
+            sys.stdout.write("\rPhoton # %d / %d" %(photon, n_photons))
             sys.stdout.flush()
-            photon +=1
+        if workers != 1:
+            pool.close()
+            pool.join()
         total_time= time.time() - start_time
         print("\n\n--- Total time of integration : %s seconds ---" % total_time)
-        print("\n--- Time of integration : %s seconds/photon ---\n" % (total_time/len(self.photon_list)))
+        print("\n--- Time of integration : %s seconds/photon ---\n" % (total_time/n_photons))
+        if instrument or drift_tol is not None:
+            self.cost.summary()
+
+    def create_image_adaptive(self, integrator='bundle', coarse=None, flux_tol=0.05, 
+                              **kwargs):
+        '''
+        Creates the image data tracing a coarse grid of photons and refining 
+        it only where the neighboring rays disagree (see common/adaptive.py). 
+        The other pixels are interpolated. 
+        coarse : separation (in pixels) of the initial grid of photons 
+                 (None: derived from the size of the detector, see 
+                 common/adaptive.py)
+        flux_tol : tolerance in the energy flux, relative to its maximum
+        Additional keyword arguments are passed to the integrator.
+        '''
+        print('Integrating trajectories (adaptive sampling) ...')
+        start_time = time.time()
+        self.image_data, self.final_states, self.status, self.traced = \
+            adaptive_trace(self, integrator, coarse, flux_tol, **kwargs)
+        total_time= time.time() - start_time
+        n_traced = self.traced.sum()
+        print("\n--- Traced photons : %d of %d (%.1f %%) ---" 
+              % (n_traced, self.traced.size, 100*n_traced/self.traced.size))
+        print("\n--- Total time of integration : %s seconds ---\n" % total_time)
+
+    def create_image_orders(self, integrator='jit', n_images=3, workers=1, 
+                            chunk_size=2048, **kwargs):
+        '''
+        Creates the images of the first n_images hits of the accretion 
+        structure by each photon (the direct image and the higher order 
+        images of the photon ring) in a single integration 
+        (see common/orders.py).
+        self.image_layers : energy flux of each order, shape 
+                            (n_images, x_pixels, y_pixels)
+        self.order_states : states at the hits of each order, shape 
+                            (n_images, x_pixels, y_pixels, 8)
+        self.order_lmbda : affine parameter of the hits of each order
+        self.image_data is the sum of all the orders and 
+        self.final_states the states of the direct image.
+        integrator : 'bundle', 'jit', 'symplectic' or 'kerr_schild'
+        Additional keyword arguments are passed to the integrator.
+        '''
+        print('Integrating trajectories (%d orders) ...' % n_images)
+        start_time = time.time()
+        hits, self.status = image_orders(self, integrator, n_images, workers, 
+                                         chunk_size, **kwargs)
+        self.order_states = hits[..., :8]
+        self.order_lmbda = hits[..., 8]
+        self.image_layers = self.acc_structure.energy_flux(hits[..., 1], 
+                                                           hits[..., 3])
+        self.image_data = self.image_layers.sum(axis=0)
+        self.final_states = self.order_states[0]
+        total_time= time.time() - start_time
+        print("\n--- Total time of integration : %s seconds ---\n" % total_time)
+
+    def create_image_progressive(self, integrator='jit', coarse=16, finest=1, 
+                                 show=False, savefig=False, filename=None, 
+                                 callback=None, workers=1, chunk_size=2048, 
+                                 **kwargs):
+        '''
+        Creates the image data in levels of increasing resolution: first the 
+        photons of a grid with a separation of coarse pixels, then the ones 
+        of a grid of coarse/2 pixels (without tracing again the previous 
+        ones), and so on down to finest (see common/progressive.py). After 
+        each level self.image_data, self.final_states and self.status hold 
+        the image at the resolution of the level and self.traced the mask of 
+        the traced pixels.
+        show : display the preview of each level
+        savefig : save the preview of each level in 
+                  'images/'+filename+'_stride<stride>.png'
+        callback : function called as callback(image, stride) after each 
+                   level. The render stops if it returns True.
+        The render can also be stopped with Ctrl-C, keeping the last 
+        complete level. Additional keyword arguments are passed to the 
+        integrator.
+        '''
+        print('Integrating trajectories (progressive) ...')
+        start_time = time.time()
+        levels = progressive_trace(self, integrator, coarse, finest, workers, 
+                                   chunk_size, **kwargs)
+        try:
+            for stride, flux, fP, status, traced in levels:
+                self.image_data, self.final_states, self.status = flux, fP, status
+                self.traced = traced
+                print("--- Stride %d : %d photons traced, %s seconds ---" 
+                      % (stride, traced.sum(), time.time() - start_time))
+                if savefig:
+                    save_preview(flux, 'images/%s_stride%d.png' % (filename, stride))
+                if show:
+                    ax = plt.figure().add_subplot(aspect='equal')
+                    ax.imshow(flux.T, cmap='inferno', origin='lower')
+                    ax.set_title('stride %d' % stride)
+                    plt.pause(0.001)
+                if callback is not None and callback(self, stride):
+                    break
+        except KeyboardInterrupt:
+            print('\n--- Stopped, keeping the last complete level ---')
+        finally:
+            levels.close()
+        total_time= time.time() - start_time
+        print("\n--- Total time of integration : %s seconds ---\n" % total_time)
+
+    def create_image_streaming(self, filename, integrator='jit',
+                               batch_size=65536, workers=1,
+                               save_status=False, **kwargs):
+        '''
+        Creates the image data in batches of rows with about batch_size
+        photons, which are generated, traced and shaded one batch at a
+        time, and writes it into the file filename+'.npy'
+        (see common/streaming.py). The memory needed does not depend on the
+        size of the image and create_photons() is not needed.
+        self.image_data (and self.status, written into
+        filename+'_status.npy' if save_status) are memory maps of the files.
+        Additional keyword arguments are passed to the integrator.
+        '''
+        print('Integrating trajectories (streaming) ...')
+        start_time = time.time()
+        self.image_data, self.status = stream_render(
+            self.blackhole, self.acc_structure, self.detector, filename+'.npy',
+            filename+'_status.npy' if save_status else None, integrator,
+            batch_size, workers, **kwargs)
+        total_time= time.time() - start_time
+        print("\n\n--- Total time of integration : %s seconds ---\n" % total_time)
+
+    def create_tile_job(self, directory, integrator='jit', tile_size=64, 
+                        **kwargs):
+        '''
+        Writes into directory the manifest of a job that renders the image 
+        in tiles of tile_size pixels (an integer or a pair), which can be 
+        claimed and rendered by processes on several machines sharing the 
+        directory with common.tiles.work_tiles (see common/tiles.py). 
+        The tiles are collected with merge_tiles().
+        Additional keyword arguments are passed to the integrator.
+        '''
+        self.tile_job = create_job(directory, self.blackhole, 
+                                   self.acc_structure, self.detector, 
+                                   integrator, tile_size, **kwargs)
+        return self.tile_job
+
+    def merge_tiles(self, directory):
+        '''
+        Assembles the finished tiles of the job in directory into 
+        self.image_data, self.final_states and self.status, and stores the 
+        workers and times of the tiles in self.tile_metadata
+        '''
+        job = TileJob(directory)
+        if job.detector.x_pixels != self.detector.x_pixels or \
+           job.detector.y_pixels != self.detector.y_pixels:
+            raise ValueError('The tile job in %s has another detector' 
+                             % directory)
+        self.image_data, self.final_states, self.status, self.tile_metadata = \
+            job.merge()
+        return self.image_data
+
+    def create_image_transfer(self, table=None, **kwargs):
+        '''
+        Creates the image data of a static and spherically symmetric black 
+        hole from a transfer table of planar geodesics (see 
+        common/transfer.py). The table is built if it is not given and it is 
+        stored in self.table, so it can be reused for other inclinations of 
+        the detector. It does not need the photon list.
+        Additional keyword arguments are passed to TransferTable.
+        '''
+        nx, ny = self.detector.x_pixels, self.detector.y_pixels
+        b_max = sqrt(self.detector.alphaRange.max()**2 + self.detector.betaRange.max()**2)
+        start_time = time.time()
+        if table is None:
+            print('Creating the transfer table ...')
+            table = TransferTable(self.blackhole, self.detector.D, b_max, **kwargs)
+        elif table.D != self.detector.D or table.b[-1] < b_max:
+            raise ValueError('The transfer table does not cover this detector')
+        self.table = table
+        alpha, beta = meshgrid(self.detector.alphaRange, self.detector.betaRange, 
+                               indexing='ij')
+        fP, status = table.crossings(alpha, beta, self.detector.iota, 
+                                     self.acc_structure.in_edge, 
+                                     self.acc_structure.out_edge)
+        self.final_states = fP.T.reshape(nx, ny, 8)
+        self.status = status.reshape(nx, ny)
+        self.image_data = self.acc_structure.energy_flux(fP[1], fP[3]).reshape(nx, ny)
+        total_time= time.time() - start_time
+        print("\n--- Total time : %s seconds ---\n" % total_time)
+
+    def create_transfer_map(self, integrator='jit', n_cross=3, r_max=50., 
+                            cache_dir='transfer_maps', workers=1, **kwargs):
+        '''
+        Traces the photons once, recording the first n_cross crossings of 
+        the equatorial plane of each ray, and stores the result in 
+        self.transfer_map (see common/transfer_map.py). The map is read 
+        from cache_dir when the same black hole, detector and settings 
+        were traced before. Any accretion structure with out_edge <= r_max 
+        can then be shaded with shade().
+        integrator : 'bundle', 'jit', 'analytic', 'symplectic' or 
+                     'kerr_schild'
+        Additional keyword arguments are passed to the integrator.
+        '''
+        print('Creating the transfer map ...')
+        start_time = time.time()
+        self.transfer_map = cached_transfer_map(self, integrator, n_cross, 
+                                                r_max, cache_dir, workers, 
+                                                **kwargs)
+        total_time= time.time() - start_time
+        print("\n--- Total time : %s seconds ---\n" % total_time)
+
+    def shade(self, acc_structure=None):
+        '''
+        Creates the image data of an accretion structure (default: 
+        self.acc_structure) from the transfer map, without integrating 
+        the photons again. Returns the image data.
+        '''
+        if acc_structure is None:
+            acc_structure = self.acc_structure
+        self.image_data, self.final_states, self.status = \
+            self.transfer_map.shade(acc_structure)
+        return self.image_data
+
+    def emission_maps(self):
+        '''
+        Returns the maps of the radius of emission and of the redshift 
+        factor g = nu_observed/nu_emitted of the pixels that see the disk 
+        (g = 0 in the others), see common/spectral.py. The redshift is 
+        computed from the final states of the last render only once and 
+        stored in self.redshift.
+        '''
+        if getattr(self, 'redshift_states', None) is not self.final_states:
+            self.redshift = redshift_map(self.blackhole, self.acc_structure, 
+                                         self.final_states, self.status)
+            self.redshift_states = self.final_states
+        return self.final_states[..., 1], self.redshift
+
+    def bolometric_image(self):
+        '''
+        Creates the image data with the bolometric intensity g^4 F(r), 
+        including the Doppler and gravitational redshift of the Keplerian 
+        gas of the disk. Returns the image data.
+        '''
+        r, g = self.emission_maps()
+        self.image_data = where(g > 0, g**4*self.acc_structure.energy_flux(r), 0.)
+        return self.image_data
+
+    def spectral_images(self, frequencies, spectrum=None):
+        '''
+        Returns the images of the observed specific intensity at each of 
+        the frequencies (shape (len(frequencies), x_pixels, y_pixels)). 
+        spectrum(nu, r) is the emitted specific intensity (default: local 
+        black body with temperature F(r)^(1/4), with the frequencies in units 
+        of its maximum temperature, see common/spectral.py).
+        '''
+        if spectrum is None:
+            spectrum = disk_blackbody(self.acc_structure)
+        r, g = self.emission_maps()
+        return spectral_images(frequencies, r, g, spectrum)
+
+    def disk_spectrum(self, frequencies, spectrum=None):
+        '''
+        Returns the observed flux of the disk at each of the frequencies 
+        (spectrum as in spectral_images)
+        '''
+        if spectrum is None:
+            spectrum = disk_blackbody(self.acc_structure)
+        r, g = self.emission_maps()
+        alpha, beta = self.detector.alphaRange, self.detector.betaRange
+        pixel = (alpha[1] - alpha[0])*(beta[1] - beta[0])/self.detector.D**2
+        return disk_spectrum(frequencies, r, g, spectrum, pixel)
+
+    def line_profile(self, emissivity_index=3., bins=200, g_range=None):
+        '''
+        Returns the observed frequencies (in units of the rest frequency) 
+        and the profile of an emission line of the disk with emissivity 
+        proportional to r^(-emissivity_index)
+        '''
+        r, g = self.emission_maps()
+        return line_profile(r, g, emissivity_index, bins, g_range)
 
     def save_data(self, filename):
         save(filename+'.npy', self.image_data)
@@ -157,6 +755,15 @@ class Image:
         plt.show()
     
 
+    def plot_cost(self, quantity='rhs_calls', log=True, savefig=False, 
+                  filename=None, cmap='viridis'):
+        '''
+        Plots the map of the cost of the integration recorded by 
+        create_image(instrument=True): rhs_calls, steps, time, status or 
+        warnings
+        '''
+        self.cost.plot(quantity, log, savefig, filename, cmap)
+
     def plotContours(self, savefig=False, filename=None, cmap='gray'):
         '''
         Contour plots in the image of the BH 
@@ -0,0 +1,301 @@
+"""
+===============================================================================
+Analytic propagation of the rays in the far field of a Kerr black hole
+===============================================================================
+The rays start at the detector, at r ~ D, and the integrators spend a large
+part of their steps in the nearly flat region far from the black hole. Since
+the geodesics of the Kerr metric are integrable, the rays are moved
+analytically from the detector to the switch radius r_switch and only the
+strong field region r < r_switch is integrated numerically.
+
+With E = -k_t, lambda = k_phi/E, eta = Q/E^2 and nu = -2H/E^2 (the initial
+data of the detector at a finite distance is only approximately null, so
+the rays are propagated as geodesics with the Hamiltonian H of their
+initial state) the motion in the Mino time p (d lambda_affine = Sigma dp/E,
+measured along the path of the ray) separates as
+    (dr/dp)^2 = R(r) = (r^2 + a^2 - a lambda)^2
+                       - Delta (nu r^2 + eta + (lambda - a)^2),
+    (du/dp)^2 = eta + (alpha^2 - eta - lambda^2) u^2 - alpha^2 u^4,
+with u = cos(theta) and alpha^2 = a^2 (1 - nu). The Mino time and the
+radial parts of t, phi and the affine parameter between two radii are
+computed with Gauss-Legendre quadratures in x = 1/r (with the substitution
+x = x_t - s^2 near a radial turning point x_t). The angular motion
+u = sqrt(u_+) sn(F(phi_0) + c p | m) and its contributions to t, phi and
+the affine parameter are given by incomplete elliptic integrals (in Carlson
+form).
+
+The rays for which the closed form is not used are integrated from the
+detector: those with eta <= 0 (which never cross the equatorial plane) and,
+when the crossings are recorded (n_cross), those that cross the equatorial
+plane outside r_switch. The rays that turn back before reaching r_switch
+escape without integration (except with n_cross).
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+from numpy import (array, zeros, full, sqrt, sin, cos, arcsin, arccos,
+                   arctan2, log, abs, sign, where, clip, floor, ceil, pi,
+                   minimum, maximum, real, imag, isfinite, errstate, nan,
+                   inf, int64)
+from numpy.polynomial.legendre import leggauss
+from scipy.special import ellipk, ellipj, elliprf, elliprd, elliprj
+from common.bundle import ESCAPE
+
+
+def jacobi_amplitude(X, m):
+    '''
+    Amplitude phi = am(X | m) of the Jacobi elliptic functions for m <= 1
+    (negative values of m through the imaginary modulus transformation)
+    '''
+    K = ellipk(m)
+    k = floor(X/(2*K) + 0.5)
+    X_r = X - 2*k*K
+    # sn(X|m) = sd(X sqrt(1 - m)|-m/(1 - m))/sqrt(1 - m) for m < 0
+    scale = where(m < 0, sqrt(1 - clip(m, None, 0.)), 1.)
+    sn, cn, dn, ph = ellipj(X_r*scale, where(m < 0, -m/(1 - m), m))
+    return where(m < 0, arctan2(sn, scale*cn), ph) + k*pi
+
+
+def elliptic_integrals(phi, m, n):
+    '''
+    Incomplete elliptic integrals of the first kind F(phi|m), of the third
+    kind Pi(n; phi|m) and D(phi|m) = (F - E)/m = int sin^2/sqrt(1 - m sin^2),
+    for any amplitude phi (through the periods of the complete integrals)
+    '''
+    k = floor(phi/pi + 0.5)
+    phi_r = phi - k*pi
+    s = sin(phi_r)
+    c2 = cos(phi_r)**2
+    q = 1 - m*s*s
+    s3 = s*s*s
+    RF = elliprf(c2, q, 1.)
+    F = s*RF + 2*k*elliprf(0., 1 - m, 1.)
+    D = s3*elliprd(c2, q, 1.)/3 + 2*k*elliprd(0., 1 - m, 1.)/3
+    Pi = (s*RF + n*s3*elliprj(c2, q, 1., 1 - n*s*s)/3
+          + 2*k*(elliprf(0., 1 - m, 1.) + n*elliprj(0., 1 - m, 1., 1 - n)/3))
+    return F, D, Pi
+
+
+def ray_constants(q, blackhole):
+    '''
+    Returns E, lambda, eta and nu of the rays with states q (array of shape
+    (8, N))
+    '''
+    from common.common import hamiltonian
+    a = blackhole.a
+    E = -q[4]
+    lam = q[7]/E
+    nu = -2*hamiltonian(q, blackhole)/(E*E)
+    cos_th2 = cos(q[2])**2
+    eta = (q[6]**2 + cos_th2*(q[7]**2/(1 - cos_th2)
+                              + a*a*(nu - 1)*E*E))/(E*E)
+    return E, lam, eta, nu
+
+
+def turning_radius(lam, eta, nu, blackhole):
+    '''
+    Largest real root of the radial potential R(r) (see
+    common.analytic.radial_roots), -inf if it has no real roots
+    '''
+    from common.analytic import radial_roots
+    roots = radial_roots(lam, eta, nu, blackhole)
+    is_real = abs(imag(roots)) < 1e-9*(1 + abs(roots))
+    return where(is_real, real(roots), -inf).max(axis=1)
+
+
+def radial_integrals(x0, x1, x_t, lam, eta, nu, blackhole, n_nodes=32):
+    '''
+    Integrals of the radial motion between x0 = 1/r0 and x1 = 1/r1 (with no
+    radial turning point in between): the Mino time and the radial parts
+    of phi, t and the affine parameter (times E), as positive quantities.
+    x_t is the turning point closest to the interval (nan if there is none).
+    '''
+    a, M = blackhole.a, blackhole.M
+    A = a*a - a*lam
+    C = eta + (lam - a)**2
+    nodes, weights = leggauss(n_nodes)
+    nodes, weights = nodes[:, None], weights[:, None]
+    lo, hi = minimum(x0, x1), maximum(x0, x1)
+    # Substitution x = x_t - s^2 for the rays close to a turning point
+    near = isfinite(x_t)
+    x_t = where(near, x_t, 0.)
+    s_lo, s_hi = sqrt(clip(x_t - hi, 0., None)), sqrt(clip(x_t - lo, 0., None))
+    s = 0.5*(s_hi - s_lo)*nodes + 0.5*(s_hi + s_lo)
+    x = where(near, x_t - s*s, 0.5*(hi - lo)*nodes + 0.5*(hi + lo))
+    dx = where(near, 0.5*(s_hi - s_lo)*weights*2*s, 0.5*(hi - lo)*weights)
+
+    Delta = 1 - 2*M*x + a*a*x*x
+    P = (1 + A*x*x)**2 - Delta*(nu + C*x*x)
+    w = dx/sqrt(P)
+    # Terms c0/x^2 + c1/x of the integrands of t and the affine parameter
+    d0 = 1/sqrt(1 - nu)
+    d1 = -d0*M*nu/(1 - nu)
+    c1 = 2*M*d0 + d1
+    mino = w.sum(axis=0)
+    phi = (w*a*x*(2*M - a*lam*x)/Delta).sum(axis=0)
+    t = ((w*(1 + a*a*x*x)*(1 + A*x*x)/Delta - dx*(d0 + c1*x))/(x*x)).sum(axis=0)
+    t += d0*(1/lo - 1/hi) + c1*log(hi/lo)
+    affine = ((w - dx*(d0 + d1*x))/(x*x)).sum(axis=0)
+    affine += d0*(1/lo - 1/hi) + d1*log(hi/lo)
+    return mino, phi, t, affine
+
+
+def angular_motion(u0, k_th, lam, eta, nu, a, p):
+    '''
+    Returns u = cos(theta), du/dp and the angular parts of phi (without the
+    factor lambda), of t and of the affine parameter (without the factor
+    a^2) after the Mino time p from u0, and the initial and final
+    amplitudes phi_0 and phi of the motion. Requires eta > 0.
+    '''
+    alpha2 = a*a*(1 - nu)
+    B = alpha2 - eta - lam*lam
+    root = sqrt(B*B + 4*alpha2*eta)
+    with errstate(invalid='ignore', divide='ignore'):
+        # u_+ and alpha^2 u_- without cancellations
+        q = where(B <= 0, 0.5*(B - root), 0.5*(B + root))
+        u_p = where(B <= 0, -eta/q, q/where(alpha2 > 0, alpha2, 1.))
+        a2u_m = where(B <= 0, q, -eta*alpha2/q)
+    m = u_p*alpha2/a2u_m
+    c = sqrt(-a2u_m)
+    direction = where(k_th != 0, sign(k_th), -sign(u0))
+    phi_0 = arcsin(clip(u0/sqrt(u_p), -1., 1.))
+    F_0, D_0, Pi_0 = elliptic_integrals(phi_0, m, u_p)
+    phi = jacobi_amplitude(F_0 + direction*c*p, m)
+    F_1, D_1, Pi_1 = elliptic_integrals(phi, m, u_p)
+    u = sqrt(u_p)*sin(phi)
+    du = direction*c*sqrt(u_p)*cos(phi)*sqrt(1 - m*sin(phi)**2)
+    G_phi = direction*(Pi_1 - Pi_0)/c
+    G_u2 = direction*u_p*(D_1 - D_0)/c
+    return u, du, G_phi, G_u2, phi_0, phi
+
+
+def far_field_map(q, blackhole, r_end, n_nodes=32):
+    '''
+    Moves the rays with states q (array of shape (8, N), in the direction of
+    the integration) analytically to the radius r_end, inwards or
+    outwards. Returns the new states, the affine parameter of the path, the
+    mask of the rays that reach r_end (the others reach a turning point
+    before r_end or move away from it), the mask of the rays moved (those
+    that reach r_end with eta > 0) and the mask of the rays that cross the
+    equatorial plane on the way.
+    '''
+    q = array(q, dtype=float)
+    a, M = blackhole.a, blackhole.M
+    n = q.shape[1]
+    r_end = full(n, r_end, dtype=float)
+    E, lam, eta, nu = ray_constants(q, blackhole)
+    inward = r_end < q[1]
+    r_t = turning_radius(lam, eta, nu, blackhole)
+    # k_r > 0 on the inward legs of the path
+    reaches = where(inward, q[5] > 0, q[5] < 0) \
+              & where(inward, r_t < r_end, r_t < q[1]) & isfinite(q).all(axis=0)
+    ok = reaches & (eta > 0)
+
+    new = q.copy()
+    lmbda = zeros(n)
+    crossed = zeros(n, dtype=bool)
+    if not ok.any():
+        return new, lmbda, reaches, ok, crossed
+    q, E, lam, eta, nu = q[:, ok], E[ok], lam[ok], eta[ok], nu[ok]
+    r0, r1 = q[1], r_end[ok]
+    x_t = 1/where(r_t[ok] > 0, r_t[ok], nan)
+    p, I_phi, I_t, I_lmbda = radial_integrals(1/r0, 1/r1, x_t, lam, eta, nu,
+                                              blackhole, n_nodes)
+    u, du, G_phi, G_u2, phi_0, phi = angular_motion(cos(q[2]), q[6], lam, eta,
+                                                    nu, a, p)
+    theta = arccos(clip(u, -1., 1.))
+    Delta = r1*r1 - 2*M*r1 + a*a
+    R = (r1*r1 + a*a - a*lam)**2 - Delta*(nu*r1*r1 + eta + (lam - a)**2)
+    y = q.copy()
+    y[0] = q[0] - (I_t + (a*lam - a*a)*p + a*a*G_u2)
+    y[1] = r1
+    y[2] = theta
+    y[3] = q[3] - (I_phi + where(lam != 0, lam*G_phi, 0.))
+    y[5] = where(inward[ok], 1., -1.)*E*sqrt(clip(R, 0., None))/Delta
+    y[6] = E*du/sin(theta)
+    new[:, ok] = y
+    lmbda[ok] = (I_lmbda + a*a*G_u2)/E
+    crossed[ok] = floor(maximum(phi_0, phi)/pi) >= ceil(minimum(phi_0, phi)/pi)
+    return new, lmbda, reaches, ok, crossed
+
+
+def geo_integ_far_field(integ, iC, blackhole, acc_structure, detector,
+                        r_switch, r_escape=None, n_cross=None, n_images=None,
+                        stats=None, n_nodes=32, **kwargs):
+    '''
+    Integrates the rays with initial conditions iC (array of shape (8, N))
+    with the bundle integrator integ (see common.bundle.geo_integ_bundle)
+    only inside r_switch: the rays are moved analytically from the detector
+    to r_switch and, when r_escape > r_switch, the escaping rays are
+    integrated up to r_switch and moved analytically to r_escape.
+    r_switch must be at least the outer edge of the accretion structure.
+    The maximum affine parameter of the integration (1.5 D) is counted from
+    r_switch. Returns fP and status, and fills stats, as integ.
+    '''
+    if not hasattr(blackhole, 'kerr_schild'):
+        raise ValueError('The far field propagation needs a Kerr or '
+                         'Schwarzschild black hole')
+    if r_switch < acc_structure.out_edge:
+        raise ValueError('r_switch must be at least the outer edge of the '
+                         'accretion structure')
+    iC = array(iC, dtype=float)
+    n = iC.shape[1]
+    if r_escape is None:
+        r_escape = acc_structure.out_edge
+    start, lmbda, reaches, moved, crossed = far_field_map(iC, blackhole, 
+                                                          r_switch, n_nodes)
+    # Rays that turn back (or move away) before r_switch
+    away = ~reaches & isfinite(iC).all(axis=0)
+    if n_cross is not None:
+        # Their crossings of the equatorial plane are recorded
+        moved &= ~crossed
+        away[:] = False
+    traced = ~away
+    start = where(moved, start, iC)[:, traced]
+
+    # Outward legs beyond r_switch (not with n_cross, whose crossings there
+    # are recorded)
+    outer = r_escape > r_switch and n_cross is None
+    sub_stats = {} if stats is not None else None
+    fP_t, status_t = integ(start, blackhole, acc_structure, detector,
+                           r_escape=r_switch if outer else r_escape,
+                           n_cross=n_cross, n_images=n_images,
+                           stats=sub_stats, **kwargs)
+
+    if n_images is not None:
+        fP = zeros([n_images, 9, n])
+        # The affine parameter decreases along the path of the integrators
+        hits = fP_t[:, 8] != 0.
+        fP_t[:, 8] -= where(hits, lmbda[traced], 0.)
+        fP[:, :, traced] = fP_t
+    elif n_cross is not None:
+        fP = zeros([n_cross, 8, n])
+        fP[:, :, traced] = fP_t
+    else:
+        fP = zeros([8, n])
+        fP[:, traced] = fP_t
+    status = full(n, ESCAPE, dtype=int64)
+    status[traced] = status_t
+    if stats is not None:
+        final = iC.copy()
+        final[:, traced] = sub_stats['final']
+        if outer:
+            escaped = traced & (status == ESCAPE)
+            final[:, escaped] = far_field_map(final[:, escaped], blackhole,
+                                              r_escape, n_nodes)[0]
+        steps = zeros(n, dtype=int64)
+        rhs_calls = zeros(n, dtype=int64)
+        steps[traced] = sub_stats['steps']
+        rhs_calls[traced] = sub_stats['rhs_calls']
+        stats.update(steps=steps, rhs_calls=rhs_calls, final=final)
+    return fP, status
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
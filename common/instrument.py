@@ -0,0 +1,196 @@
+"""
+===============================================================================
+Instrumentation of the integration of the photons
+===============================================================================
+For each ray the following quantities are recorded, in arrays of shape
+(x_pixels, y_pixels) aligned with the image data:
+- rhs_calls : number of evaluations of the geodesic equations
+- steps     : number of steps of the integrator
+- time      : wall time (seconds)
+- status    : termination code (see common/bundle.py)
+- warnings  : number of warnings issued by the integrator
+- drift     : drift of the null constraint H = 0 and of the Carter constant
+              between the initial and the last state of the ray (see
+              common.common.constraint_drift)
+The per-ray integrators (odeint, events) are timed ray by ray and their
+warnings are caught ray by ray. The batched integrators (bundle, jit,
+analytic, symplectic) integrate a chunk of rays at once: the time of the
+chunk is shared among its rays in proportion to their evaluations of the
+geodesic equations, and the rays that gave up (FAILED) count as one warning. The analytic
+integrator does not integrate, so it has no evaluations or steps and its
+drift is not defined (nan).
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+from numpy import zeros, ones, full, arange, log10, nan, nanmax, isfinite, int64
+from collections import Counter
+import warnings
+import time
+from common.bundle import (RUNNING, DISK, HORIZON, ESCAPE, MAX_LENGTH,
+                           FAILED)
+
+
+STATUS_NAMES = {RUNNING: 'running', DISK: 'disk', HORIZON: 'horizon',
+                ESCAPE: 'escape', MAX_LENGTH: 'max length', FAILED: 'failed'}
+
+
+def trace_instrumented(photons, blackhole, acc_structure, detector,
+                       integrator='odeint', **kwargs):
+    '''
+    Integrates a set of photons as common.common.trace_photons and returns
+    the arrays (i, j, flux, fP, status, stats), where stats is a dictionary
+    with the arrays rhs_calls, steps, time, warnings and drift of each 
+    photon and the list messages of the warnings
+    '''
+    from common.common import (trace_photons, geo_integ, geo_integ_events,
+                               constraint_drift)
+    n = len(photons)
+    stats = dict(rhs_calls=zeros(n, dtype=int64), steps=zeros(n, dtype=int64),
+                 time=zeros(n), warnings=zeros(n, dtype=int64), 
+                 drift=full(n, nan), messages=[])
+    if integrator in ('odeint', 'events'):
+        fP = zeros([n, 8])
+        status = zeros(n, dtype=int64)
+        for m in range(n):
+            p = photons.photon(m, detector)
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                start = time.perf_counter()
+                if integrator == 'odeint':
+                    geo_integ(p, blackhole, acc_structure, detector, **kwargs)
+                else:
+                    geo_integ_events(p, blackhole, acc_structure, detector,
+                                     **kwargs)
+                stats['time'][m] = time.perf_counter() - start
+            fP[m] = p.fP
+            status[m] = p.status
+            stats['rhs_calls'][m] = p.rhs_calls
+            stats['steps'][m] = p.steps
+            stats['warnings'][m] = len(caught)
+            stats['messages'] += [str(w.message) for w in caught]
+            stats['drift'][m] = constraint_drift(photons.iC[:, m], p.last, 
+                                                 blackhole)
+        flux = acc_structure.energy_flux(fP[:,1], fP[:,3])
+        return photons.i, photons.j, flux, fP, status, stats
+
+    counts = {}
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        start = time.perf_counter()
+        i, j, flux, fP, status = trace_photons(photons, blackhole,
+                                               acc_structure, detector,
+                                               integrator, stats=counts,
+                                               **kwargs)
+        elapsed = time.perf_counter() - start
+    final = counts.pop('final', None)
+    stats.update(counts)
+    if final is not None:
+        stats['drift'] = constraint_drift(photons.iC, final, blackhole)
+    weight = stats['rhs_calls'] if stats['rhs_calls'].sum() > 0 else ones(n)
+    stats['time'] = elapsed*weight/weight.sum()
+    stats['warnings'][status == FAILED] += 1
+    stats['messages'] += [str(w.message) for w in caught]
+    return i, j, flux, fP, status, stats
+
+
+def instrumented_worker(photons):
+    '''
+    Integrates a chunk of photons with instrumentation in a worker process
+    '''
+    from common.common import worker_scene
+    s = worker_scene
+    return trace_instrumented(photons, s['blackhole'], s['acc_structure'],
+                              s['detector'], s['integrator'], **s['kwargs'])
+
+
+class CostMaps:
+    '''
+    Maps of the cost of the integration of each pixel
+    '''
+    def __init__(self, x_pixels, y_pixels):
+        self.rhs_calls = zeros([x_pixels, y_pixels], dtype=int64)
+        self.steps = zeros([x_pixels, y_pixels], dtype=int64)
+        self.time = zeros([x_pixels, y_pixels])
+        self.status = zeros([x_pixels, y_pixels], dtype=int64)
+        self.warnings = zeros([x_pixels, y_pixels], dtype=int64)
+        self.drift = full([x_pixels, y_pixels], nan)
+        # Tolerance of each photon (see common/tolerance.py)
+        self.rtol = full([x_pixels, y_pixels], nan)
+        self.messages = Counter()
+
+    def record(self, i, j, status, stats):
+        '''
+        Stores the status and the stats (see trace_instrumented) of the
+        photons with pixel coordinates i, j
+        '''
+        self.status[i, j] = status
+        for key in ('rhs_calls', 'steps', 'time', 'warnings', 'drift'):
+            getattr(self, key)[i, j] = stats[key]
+        if 'rtol' in stats:
+            self.rtol[i, j] = stats['rtol']
+        self.messages.update(stats['messages'])
+
+    def summary(self):
+        '''
+        Prints the number of rays, the mean number of evaluations and steps,
+        the fraction of the time, the warnings and the maximum drift for 
+        each termination reason, and the most frequent warnings
+        '''
+        total_time = self.time.sum()
+        print('\n%-12s %8s %12s %10s %8s %9s %10s'
+              % ('termination', 'rays', 'rhs calls', 'steps', 'time %',
+                 'warnings', 'drift'))
+        for code, name in STATUS_NAMES.items():
+            rays = self.status == code
+            if rays.any():
+                drift = self.drift[rays]
+                print('%-12s %8d %12.1f %10.1f %8.1f %9d %10.1e'
+                      % (name, rays.sum(), self.rhs_calls[rays].mean(),
+                         self.steps[rays].mean(),
+                         100*self.time[rays].sum()/max(total_time, 1e-300),
+                         self.warnings[rays].sum(),
+                         nanmax(drift) if isfinite(drift).any() else nan))
+        for message, count in self.messages.most_common(5):
+            print('%6d x %s' % (count, message))
+        print()
+
+    def plot(self, quantity='rhs_calls', log=True, savefig=False,
+             filename=None, cmap='viridis'):
+        '''
+        Plots the map of a quantity (rhs_calls, steps, time, status, 
+        warnings, drift or rtol) as a heatmap, in logarithmic scale if log
+        '''
+        import matplotlib.pyplot as plt
+        data = getattr(self, quantity)
+        ax = plt.figure().add_subplot(aspect='equal')
+        if quantity == 'status':
+            codes = arange(len(STATUS_NAMES))
+            im = ax.imshow(data.T, cmap=plt.get_cmap('tab10', codes.size),
+                           origin='lower', vmin=-0.5, vmax=codes.size - 0.5)
+            bar = plt.colorbar(im, ax=ax, ticks=codes)
+            bar.ax.set_yticklabels([STATUS_NAMES[c] for c in codes])
+        else:
+            label = quantity
+            if log:
+                data = log10(data + (1 if data.dtype == int64 else 1e-12))
+                label = r'$\log_{10}$ ' + quantity
+            im = ax.imshow(data.T, cmap=cmap, origin='lower')
+            plt.colorbar(im, ax=ax, label=label)
+        ax.set_xlabel(r'$\alpha$')
+        ax.set_ylabel(r'$\beta$')
+        plt.tick_params(left = False, right = False , labelleft = False ,
+                        labelbottom = False, bottom = False)
+        if savefig:
+            plt.savefig('images/'+filename+'_'+quantity+'.png')
+        plt.show()
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
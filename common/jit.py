@@ -0,0 +1,233 @@
+"""
+===============================================================================
+Compiled integration of the geodesic equations
+===============================================================================
+When numba is installed, the metrics that provide compiled kernels
+(a method compiled() returning the geodesic equations as a nopython function
+rhs(q, params) and the array of parameters) are integrated ray by ray with a
+compiled Dormand-Prince 5(4) scheme, without going back to Python in each
+step. Otherwise, the pure Python bundle integrator is used.
+The kernels of the metrics are cached on disk, but the integrator receives
+them as arguments, which numba cannot cache: it is compiled again (a few
+seconds) in each new process.
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+from numpy import zeros, array, cos, sqrt, abs, int64
+from common.bundle import (geo_integ_bundle, RUNNING, DISK, HORIZON, ESCAPE,
+                           MAX_LENGTH, FAILED)
+
+try:
+    from numba import njit
+    NUMBA = True
+except ImportError:
+    NUMBA = False
+
+    def njit(*args, **kwargs):
+        '''
+        Leaves the functions as pure Python when numba is not installed
+        '''
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+
+@njit
+def dopri_step(rhs, params, y, f, h):
+    '''
+    Dormand-Prince 5(4) step of size h for a single ray.
+    Returns the new state, its derivative and the error estimate.
+    '''
+    k2 = rhs(y + h*(1/5)*f, params)
+    k3 = rhs(y + h*((3/40)*f + (9/40)*k2), params)
+    k4 = rhs(y + h*((44/45)*f - (56/15)*k2 + (32/9)*k3), params)
+    k5 = rhs(y + h*((19372/6561)*f - (25360/2187)*k2 + (64448/6561)*k3
+                    - (212/729)*k4), params)
+    k6 = rhs(y + h*((9017/3168)*f - (355/33)*k2 + (46732/5247)*k3
+                    + (49/176)*k4 - (5103/18656)*k5), params)
+    y_new = y + h*((35/384)*f + (500/1113)*k3 + (125/192)*k4
+                   - (2187/6784)*k5 + (11/84)*k6)
+    f_new = rhs(y_new, params)
+    err = h*((71/57600)*f - (71/16695)*k3 + (71/1920)*k4
+             - (17253/339200)*k5 + (22/525)*k6 - (1/40)*f_new)
+    return y_new, f_new, err
+
+
+@njit(cache=True)
+def hermite(y0, f0, y1, f1, h, s):
+    '''
+    Cubic Hermite interpolant inside a step (see common/bundle.py)
+    '''
+    s2 = s*s
+    s3 = s2*s
+    return ((2*s3 - 3*s2 + 1)*y0 + (s3 - 2*s2 + s)*h*f0
+            + (-2*s3 + 3*s2)*y1 + (s3 - s2)*h*f1)
+
+
+@njit(cache=True)
+def bl_radius(q, params):
+    '''
+    Radius r of the state q in Boyer-Lindquist (spherical) coordinates
+    '''
+    return q[1]
+
+
+@njit(cache=True)
+def bl_height(q, params):
+    '''
+    Function of the state q in Boyer-Lindquist (spherical) coordinates
+    that changes sign at the equatorial plane: cos(theta)
+    '''
+    return cos(q[2])
+
+
+@njit
+def integrate_rays(iC, rhs, params, radius, height, in_edge, out_edge, 
+                   final_lmbda, r_escape, r_horizon, rtol, atol, max_steps, 
+                   n_cross, n_images):
+    '''
+    Integrates each ray with the compiled Dormand-Prince scheme, with the
+    same termination criteria of common.bundle.geo_integ_bundle. 
+    radius(q, params) returns the Boyer-Lindquist radius of the state q 
+    and height(q, params) a function that changes sign at the equatorial 
+    plane, so the same scheme integrates the rays in other coordinates 
+    (see common/kerr_schild.py).
+    Returns the states at the crossings, followed by the affine parameter
+    of the crossing, with shape (max(n_cross, n_images, 1), 9, N): the 
+    first hit of the accretion structure if n_cross = n_images = 0, the 
+    first n_cross crossings of the equatorial plane or the first n_images 
+    hits of the accretion structure; the termination codes, the number of 
+    steps (including the rejected ones) and the last state (the hit of the 
+    accretion structure, if any) of each ray.
+    '''
+    n = iC.shape[1]
+    fP = zeros((max(n_cross, n_images, 1), 9, n))
+    status = zeros(n, dtype=int64)
+    n_steps = zeros(n, dtype=int64)
+    last = zeros((8, n))
+    for m in range(n):
+        y = iC[:, m].copy()
+        f = rhs(y, params)
+        lmbda = 0.
+        h = -0.01*radius(y, params)
+        code = RUNNING
+        steps = 0
+        crossed = 0
+        hits = 0
+        while code == RUNNING:
+            h = max(h, -final_lmbda - lmbda)
+            y_new, f_new, err = dopri_step(rhs, params, y, f, h)
+            err_norm = 0.
+            for c in range(8):
+                scale = atol + rtol*max(abs(y[c]), abs(y_new[c]))
+                err_norm += (err[c]/scale)**2
+            err_norm = sqrt(err_norm/8)
+            if not err_norm < 1e10:
+                err_norm = 1e10
+            accept = err_norm <= 1.
+            factor = min(max(0.9*err_norm**(-0.2), 0.2), 10.)
+            if not accept:
+                factor = min(factor, 1.)
+            steps += 1
+
+            if accept:
+                # Crossing of the equatorial plane inside the disk
+                if height(y, params)*height(y_new, params) <= 0.:
+                    lo = 0.
+                    hi = 1.
+                    sign0 = height(y, params) > 0
+                    for _ in range(40):
+                        mid = 0.5*(lo + hi)
+                        yc = hermite(y, f, y_new, f_new, h, mid)
+                        if (height(yc, params) > 0) == sign0:
+                            lo = mid
+                        else:
+                            hi = mid
+                    yc = hermite(y, f, y_new, f_new, h, 0.5*(lo + hi))
+                    r_c = radius(yc, params)
+                    if n_cross > 0:
+                        if crossed < n_cross:
+                            fP[crossed, :8, m] = yc
+                            fP[crossed, 8, m] = lmbda + 0.5*(lo + hi)*h
+                        crossed += 1
+                    elif r_c > in_edge and r_c < out_edge:
+                        fP[hits, :8, m] = yc
+                        fP[hits, 8, m] = lmbda + 0.5*(lo + hi)*h
+                        hits += 1
+                        if hits >= n_images:
+                            code = DISK
+                lmbda_new = lmbda + h
+                if code == RUNNING:
+                    r_new = radius(y_new, params)
+                    if r_new < r_horizon:
+                        code = HORIZON
+                    elif r_new > r_escape and r_new > radius(y, params):
+                        code = ESCAPE
+                    elif lmbda_new <= -final_lmbda:
+                        code = MAX_LENGTH
+                y = y_new
+                f = f_new
+                lmbda = lmbda_new
+            h = h*factor
+            if code == RUNNING and (abs(h) < 1e-12 or steps >= max_steps):
+                code = FAILED
+        if hits > 0 and code != DISK:
+            # Rays that hit the structure less than n_images times
+            code = DISK
+        elif code == DISK and n_images <= 1:
+            y = fP[0, :8, m]
+        status[m] = code
+        n_steps[m] = steps
+        last[:, m] = y
+    return fP, status, n_steps, last
+
+
+def geo_integ_jit(iC, blackhole, acc_structure, detector, rtol=1e-8,
+                  atol=1e-8, r_escape=None, horizon_tol=1e-2,
+                  max_steps=20000, n_cross=None, n_images=None, stats=None):
+    '''
+    Integrates the motion equations of the photons in the array iC of shape
+    (8, N) with the compiled kernels of the black hole. Falls back to the
+    pure Python bundle integrator when numba is not installed or the metric
+    has no compiled kernels. Returns the arrays fP and status, and fills 
+    stats (if given), as common.bundle.geo_integ_bundle.
+    The integrator is compiled in the first call of each process, which
+    takes a few seconds: numba does not cache on disk the functions that
+    receive other functions as arguments (only the kernels of the metrics
+    are cached), so the parallel renders compile it before forking.
+    '''
+    if not (NUMBA and hasattr(blackhole, 'compiled')):
+        return geo_integ_bundle(iC, blackhole, acc_structure, detector,
+                                rtol=rtol, atol=atol, r_escape=r_escape,
+                                horizon_tol=horizon_tol, max_steps=max_steps,
+                                n_cross=n_cross, n_images=n_images, 
+                                stats=stats)
+    if r_escape is None:
+        r_escape = acc_structure.out_edge
+    rhs, params = blackhole.compiled()
+    # C order: the subsets of photons taken with an array of indices are in
+    # Fortran order and would compile another version of the integrator
+    fP, status, steps, last = integrate_rays(array(iC, dtype=float, order='C'), 
+                                             rhs, params, bl_radius, bl_height, 
+                                             float(acc_structure.in_edge),
+                                             float(acc_structure.out_edge), 
+                                             1.5*detector.D, float(r_escape), 
+                                             (1. + horizon_tol)*blackhole.EH,
+                                             rtol, atol, max_steps, n_cross or 0,
+                                             n_images or 0)
+    if stats is not None:
+        stats.update(steps=steps, rhs_calls=1 + 6*steps, final=last)
+    if n_images is not None:
+        return fP, status
+    return (fP[0, :8] if n_cross is None else fP[:, :8]), status
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
@@ -0,0 +1,262 @@
+"""
+===============================================================================
+Integration of the photons in Cartesian Kerr-Schild coordinates
+===============================================================================
+In Boyer-Lindquist coordinates the geodesic equations of the Kerr metric
+divide by Delta = r^2 - 2Mr + a^2 and by sin^2(theta), so they become stiff
+for the rays that approach the horizon or pass near the poles. In the
+(ingoing) Cartesian Kerr-Schild coordinates (T, x, y, z) the metric
+    g_{mu nu} = eta_{mu nu} + f l_mu l_nu,
+    f = 2 M r^3/(r^4 + a^2 z^2),
+    l_mu = (1, (r x + a y)/(r^2 + a^2), (r y - a x)/(r^2 + a^2), z/r),
+(with the Boyer-Lindquist radius r given by
+(x^2 + y^2)/(r^2 + a^2) + z^2/r^2 = 1) is regular at the future horizon and
+at the poles. The coordinates are related to the Boyer-Lindquist ones by
+    x + i y = (r + i a) sin(theta) exp(i Phi),    z = r cos(theta),
+    T = t + tau(r),    Phi = phi + psi(r),
+    dtau/dr = 2 M r/Delta,    dpsi/dr = a/Delta.
+The photons are traced backwards in time from the detector, so the captured
+rays approach the past horizon, where these coordinates are singular (T and
+Phi diverge). The rays are thus integrated in the outgoing coordinates, which
+are the ingoing ones of the time reversed spacetime: t -> -t, k_t -> -k_t
+maps the Kerr metric with spin a into the one with spin -a and the past
+horizon into the future horizon.
+The initial conditions of the detector are transformed to these coordinates,
+the rays are integrated with the compiled Dormand-Prince scheme of
+common/jit.py (with the same termination criteria, in terms of the
+Boyer-Lindquist radius) and the states at the crossings are transformed
+back, so the results can be used as the ones of the other integrators.
+Without numba the kernels run as pure Python functions, which works but is
+much slower than the bundle integrator.
+The azimuth phi of the transformed states is in (-pi, pi].
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+from numpy import (array, zeros, empty, sqrt, sin, cos, arccos, arctan2, log,
+                   abs, einsum, ascontiguousarray)
+from numpy.linalg import solve
+from common.jit import njit, integrate_rays
+
+
+@njit(cache=True)
+def ks_radius(q, params):
+    '''
+    Boyer-Lindquist radius of the state q in Kerr-Schild coordinates
+    params = [M, a, a^2]
+    '''
+    a2 = params[2]
+    w = q[1]*q[1] + q[2]*q[2] + q[3]*q[3] - a2
+    return sqrt(0.5*(w + sqrt(w*w + 4*a2*q[3]*q[3])))
+
+
+@njit(cache=True)
+def ks_height(q, params):
+    '''
+    Coordinate z of the state q in Kerr-Schild coordinates, which changes
+    sign at the equatorial plane
+    '''
+    return q[3]
+
+
+@njit(cache=True)
+def ks_geodesics_kernel(q, params):
+    '''
+    Geodesic equations in Hamiltonian form,
+    H = (eta^{mu nu} k_mu k_nu - f (l^mu k_mu)^2)/2, for a single ray in
+    Cartesian Kerr-Schild coordinates
+    ===========================================================================
+    T = q[0], x = q[1], y = q[2], z = q[3]
+    k_T = q[4], k_x = q[5], k_y = q[6], k_z = q[7]
+    params = [M, a, a^2]
+    ===========================================================================
+    '''
+    M = params[0]
+    a = params[1]
+    a2 = params[2]
+    x = q[1]
+    y = q[2]
+    z = q[3]
+    px = q[5]
+    py = q[6]
+    pz = q[7]
+    w = x*x + y*y + z*z - a2
+    s = sqrt(w*w + 4*a2*z*z)
+    r2 = 0.5*(w + s)
+    r = sqrt(r2)
+    D = r2 + a2
+    Q = r2*r2 + a2*z*z
+
+    f = 2*M*r*r2/Q
+    lx = (r*x + a*y)/D
+    ly = (r*y - a*x)/D
+    lz = z/r
+    lp = -q[4] + lx*px + ly*py + lz*pz
+
+    # Derivatives of r, f and l^mu k_mu
+    r_x = x*r/s
+    r_y = y*r/s
+    r_z = z*D/(r*s)
+    f_r = 2*M*r2*(3*a2*z*z - r2*r2)/(Q*Q)
+    f_z = -4*M*r*r2*a2*z/(Q*Q)
+    C = (x*px + y*py - 2*r*(lx*px + ly*py))/D - z*pz/r2
+
+    dq = empty(8)
+    dq[0] = -q[4] + f*lp
+    dq[1] = px - f*lp*lx
+    dq[2] = py - f*lp*ly
+    dq[3] = pz - f*lp*lz
+    dq[4] = 0.
+    dq[5] = 0.5*f_r*r_x*lp*lp + f*lp*(r_x*C + (r*px - a*py)/D)
+    dq[6] = 0.5*f_r*r_y*lp*lp + f*lp*(r_y*C + (a*px + r*py)/D)
+    dq[7] = 0.5*(f_r*r_z + f_z)*lp*lp + f*lp*(r_z*C + pz/r)
+    return dq
+
+
+def radial_shifts(r, M, a):
+    '''
+    Returns the shifts tau(r) = T - t and psi(r) = Phi - phi between the
+    ingoing Kerr-Schild and the Boyer-Lindquist coordinates (psi is zero at
+    infinity) and their derivatives 2Mr/Delta and a/Delta
+    '''
+    root = sqrt(M*M - a*a)
+    r_p, r_m = M + root, M - root
+    Delta = r*r - 2*M*r + a*a
+    tau = (2*M/(r_p - r_m))*(r_p*log(abs(r - r_p)) - r_m*log(abs(r - r_m)))
+    psi = (a/(r_p - r_m))*log(abs((r - r_p)/(r - r_m)))
+    return tau, psi, 2*M*r/Delta, a/Delta
+
+
+def jacobian(r, theta, Phi, M, a):
+    '''
+    Returns the matrices J[..., nu, mu] = d x_KS^nu/d x_BL^mu of the
+    transformation from Boyer-Lindquist (t, r, theta, phi) to ingoing
+    Kerr-Schild (T, x, y, z) coordinates
+    '''
+    tau, psi, dtau, dpsi = radial_shifts(r, M, a)
+    sin_th, cos_th = sin(theta), cos(theta)
+    sin_P, cos_P = sin(Phi), cos(Phi)
+    X = r*cos_P - a*sin_P
+    Y = r*sin_P + a*cos_P
+    J = zeros(r.shape + (4, 4))
+    J[..., 0, 0] = 1.
+    J[..., 0, 1] = dtau
+    J[..., 1, 1] = sin_th*(cos_P - Y*dpsi)
+    J[..., 1, 2] = cos_th*X
+    J[..., 1, 3] = -sin_th*Y
+    J[..., 2, 1] = sin_th*(sin_P + X*dpsi)
+    J[..., 2, 2] = cos_th*Y
+    J[..., 2, 3] = sin_th*X
+    J[..., 3, 1] = cos_th
+    J[..., 3, 2] = -r*sin_th
+    return J
+
+
+def time_reversed(blackhole):
+    '''
+    Returns the parameters [M, -a, a^2] of the time reversed spacetime, in
+    which the rays are integrated
+    '''
+    M, a, a2 = blackhole.kerr_schild()
+    return array([M, -a, a2])
+
+
+def bl_to_ks(q, blackhole):
+    '''
+    Transforms the states q (shape (8, N)) from Boyer-Lindquist coordinates
+    to the ingoing Kerr-Schild coordinates of the time reversed spacetime
+    '''
+    M, a, a2 = time_reversed(blackhole)
+    q = array(q, dtype=float)
+    t, r, theta, phi = -q[0], q[1], q[2], q[3]
+    k = q[4:8].copy()
+    k[0] = -k[0]
+    tau, psi, dtau, dpsi = radial_shifts(r, M, a)
+    Phi = phi + psi
+    X = r*cos(Phi) - a*sin(Phi)
+    Y = r*sin(Phi) + a*cos(Phi)
+    y = empty(q.shape)
+    y[0] = t + tau
+    y[1] = sin(theta)*X
+    y[2] = sin(theta)*Y
+    y[3] = r*cos(theta)
+    # k_BL = J^T k_KS
+    J = jacobian(r, theta, Phi, M, a)
+    y[4:8] = solve(J.transpose(0, 2, 1), k.T[..., None])[..., 0].T
+    return y
+
+
+def ks_to_bl(y, blackhole):
+    '''
+    Transforms the states y (shape (8, N)) from the ingoing Kerr-Schild
+    coordinates of the time reversed spacetime to Boyer-Lindquist
+    coordinates. The azimuth phi is in (-pi, pi].
+    '''
+    M, a, a2 = time_reversed(blackhole)
+    y = array(y, dtype=float)
+    w = y[1]**2 + y[2]**2 + y[3]**2 - a2
+    r = sqrt(0.5*(w + sqrt(w*w + 4*a2*y[3]**2)))
+    theta = arccos(y[3]/r)
+    Phi = arctan2(y[2], y[1]) - arctan2(a, r)
+    tau, psi, dtau, dpsi = radial_shifts(r, M, a)
+    q = empty(y.shape)
+    q[0] = tau - y[0]
+    q[1] = r
+    q[2] = theta
+    q[3] = arctan2(sin(Phi - psi), cos(Phi - psi))
+    J = jacobian(r, theta, Phi, M, a)
+    q[4:8] = einsum('...nm,n...->m...', J, y[4:8])
+    q[4] = -q[4]
+    return q
+
+
+def geo_integ_kerr_schild(iC, blackhole, acc_structure, detector, rtol=1e-8,
+                          atol=1e-8, r_escape=None, horizon_tol=1e-2,
+                          max_steps=20000, n_cross=None, n_images=None,
+                          stats=None):
+    '''
+    Integrates the motion equations of the photons in the array iC of shape
+    (8, N) (Boyer-Lindquist coordinates, see initCond) in Kerr-Schild
+    coordinates, for the black holes with a method kerr_schild() (Kerr and
+    Schwarzschild). Returns the arrays fP and status, and fills stats
+    (if given), in Boyer-Lindquist coordinates, as
+    common.bundle.geo_integ_bundle.
+    '''
+    if not hasattr(blackhole, 'kerr_schild'):
+        raise ValueError('The Kerr-Schild integrator needs a Kerr or '
+                         'Schwarzschild black hole')
+    if n_cross is not None and n_images is not None:
+        raise ValueError('n_cross and n_images cannot be used together')
+    if r_escape is None:
+        r_escape = acc_structure.out_edge
+    params = time_reversed(blackhole)
+    y = ascontiguousarray(bl_to_ks(iC, blackhole))
+    fP, status, steps, last = integrate_rays(y, ks_geodesics_kernel, params,
+                                             ks_radius, ks_height,
+                                             float(acc_structure.in_edge),
+                                             float(acc_structure.out_edge),
+                                             1.5*detector.D, float(r_escape),
+                                             (1. + horizon_tol)*blackhole.EH,
+                                             rtol, atol, max_steps,
+                                             n_cross or 0, n_images or 0)
+    # Transform the crossings that were reached
+    states = fP[:, :8].transpose(1, 0, 2).reshape(8, -1)
+    reached = (states != 0.).any(axis=0)
+    states[:, reached] = ks_to_bl(states[:, reached], blackhole)
+    fP[:, :8] = states.reshape(8, fP.shape[0], -1).transpose(1, 0, 2)
+    if stats is not None:
+        stats.update(steps=steps, rhs_calls=1 + 6*steps,
+                     final=ks_to_bl(last, blackhole))
+    if n_images is not None:
+        return fP, status
+    return (fP[0, :8] if n_cross is None else fP[:, :8]), status
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
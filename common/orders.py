@@ -0,0 +1,104 @@
+"""
+===============================================================================
+Higher order images of the accretion structure
+===============================================================================
+A ray that passes close to the photon orbits can cross the equatorial plane
+inside the accretion structure several times: the first hit gives the
+direct (n = 0) image and the next ones the higher order (n = 1, 2, ...)
+images, which form the photon ring. The integrators record the first
+n_images hits of each ray (state and affine parameter) in a single pass and
+stop each ray at its last one, so the layers of all the orders cost about
+the same as the direct image.
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+from numpy import zeros, int64
+from multiprocessing import Pool
+
+
+def trace_orders(photons, blackhole, acc_structure, detector, integrator='jit',
+                 n_images=3, r_switch=None, **kwargs):
+    '''
+    Integrates a set of photons (see common.common.Photons) and returns the
+    arrays (i, j, hits, status) with the pixel coordinates, the states at
+    the first n_images hits of the accretion structure followed by their
+    affine parameter (shape (N, n_images, 9), zeros for the hits not
+    reached) and the termination code of each photon. With r_switch, the
+    rays are only integrated inside r_switch (see common/far_field.py).
+    '''
+    from common.common import (geo_integ_bundle, geo_integ_jit, 
+                               geo_integ_symplectic, geo_integ_kerr_schild,
+                               geo_integ_far_field)
+    integs = {'bundle': geo_integ_bundle, 'jit': geo_integ_jit,
+              'symplectic': geo_integ_symplectic,
+              'kerr_schild': geo_integ_kerr_schild}
+    if integrator not in integs:
+        raise ValueError("The integrator '%s' cannot record the higher "
+                         "order images" % integrator)
+    if r_switch is None:
+        hits, status = integs[integrator](photons.iC, blackhole, acc_structure,
+                                          detector, n_images=n_images, **kwargs)
+    else:
+        hits, status = geo_integ_far_field(integs[integrator], photons.iC,
+                                           blackhole, acc_structure, detector,
+                                           r_switch, n_images=n_images, 
+                                           **kwargs)
+    return photons.i, photons.j, hits.transpose(2, 0, 1), status
+
+
+def orders_worker(photons):
+    '''
+    Records the hits of a chunk of photons in a worker process
+    '''
+    from common.common import worker_scene
+    s = worker_scene
+    return trace_orders(photons, s['blackhole'], s['acc_structure'],
+                        s['detector'], s['integrator'], **s['kwargs'])
+
+
+def image_orders(image, integrator='jit', n_images=3, workers=1,
+                 chunk_size=2048, **kwargs):
+    '''
+    Traces the photons of image.photons, in parallel if workers > 1, and
+    returns the arrays hits (shape (n_images, x_pixels, y_pixels, 9)) and
+    status of the image
+    '''
+    from common.common import init_worker
+    nx, ny = image.detector.x_pixels, image.detector.y_pixels
+    hits = zeros([nx, ny, n_images, 9])
+    status = zeros([nx, ny], dtype=int64)
+    photons = image.photons
+    chunks = [photons[start:start+chunk_size]
+              for start in range(0, len(photons), chunk_size)]
+    kwargs = dict(kwargs, n_images=n_images)
+    if workers == 1:
+        results = (trace_orders(chunk, image.blackhole, image.acc_structure,
+                                image.detector, integrator, **kwargs)
+                   for chunk in chunks)
+    else:
+        if integrator in ('jit', 'kerr_schild'):
+            # Compile the kernels once, before forking the workers
+            trace_orders(chunks[0][:1], image.blackhole, image.acc_structure,
+                         image.detector, integrator, **kwargs)
+        pool = Pool(workers, initializer=init_worker,
+                    initargs=(image.blackhole, image.acc_structure,
+                              image.detector, integrator, kwargs))
+        results = pool.imap(orders_worker, chunks)
+    for i, j, h, st in results:
+        hits[i, j] = h
+        status[i, j] = st
+    if workers != 1:
+        pool.close()
+        pool.join()
+    return hits.transpose(2, 0, 1, 3), status
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
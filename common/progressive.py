@@ -0,0 +1,105 @@
+"""
+===============================================================================
+Progressive rendering of the image
+===============================================================================
+The photons are traced in levels of decreasing stride: first the pixels
+(i, j) with i and j multiples of the coarse stride, then the multiples of
+half of it, and so on down to the finest stride (1 for the full image). The
+photons traced in a level are not traced again in the next ones. After each
+level the image is complete at the resolution of the stride: each pixel not
+traced yet takes the values of the traced pixel at the corner of its block,
+so a preview is available long before the end of the render, which can be
+stopped at any level.
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+from numpy import zeros, arange, ix_, int64
+from multiprocessing import Pool
+
+
+def progressive_levels(coarse, finest=1):
+    '''
+    Returns the list of strides of the levels: coarse, coarse//2, ..., finest
+    '''
+    strides = []
+    stride = max(coarse, finest)
+    while stride > finest:
+        strides.append(stride)
+        stride //= 2
+    return strides + [finest]
+
+
+def progressive_trace(image, integrator='jit', coarse=16, finest=1,
+                      workers=1, chunk_size=2048, **kwargs):
+    '''
+    Traces the photons of image.photons in levels of decreasing stride
+    (see progressive_levels). It is a generator: after each level it yields
+    (stride, flux, fP, status, traced), with the arrays of the image data,
+    the final states and the termination codes filled at the resolution of
+    the stride, and the boolean mask of the traced pixels.
+    '''
+    from common.common import trace_photons, init_worker, trace_worker
+    nx, ny = image.detector.x_pixels, image.detector.y_pixels
+    traced = zeros([nx, ny], dtype=bool)
+    fP = zeros([nx, ny, 8])
+    status = zeros([nx, ny], dtype=int64)
+    flux = zeros([nx, ny])
+    pool = None
+    if workers != 1:
+        if integrator in ('jit', 'kerr_schild'):
+            # Compile the kernels once, before forking the workers
+            trace_photons(image.photons[:1], image.blackhole,
+                          image.acc_structure, image.detector, integrator,
+                          **kwargs)
+        pool = Pool(workers, initializer=init_worker,
+                    initargs=(image.blackhole, image.acc_structure,
+                              image.detector, integrator, kwargs))
+    try:
+        for stride in progressive_levels(coarse, finest):
+            level = zeros([nx, ny], dtype=bool)
+            level[::stride, ::stride] = True
+            pixels = (level & ~traced).ravel().nonzero()[0]
+            chunks = [image.photons[pixels[start:start+chunk_size]]
+                      for start in range(0, pixels.size, chunk_size)]
+            if pool is None:
+                results = (trace_photons(chunk, image.blackhole,
+                                         image.acc_structure, image.detector,
+                                         integrator, **kwargs)
+                           for chunk in chunks)
+            else:
+                results = pool.imap(trace_worker, chunks)
+            for i, j, fl, fp, st in results:
+                flux[i, j] = fl
+                fP[i, j] = fp
+                status[i, j] = st
+                traced[i, j] = True
+
+            # Fill each block with the values of its traced corner
+            block = ix_((arange(nx)//stride)*stride, (arange(ny)//stride)*stride)
+            yield (stride, flux[block], fP[block], status[block],
+                   traced.copy())
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def save_preview(image_data, filename, cmap='inferno'):
+    '''
+    Saves the image data as a png file (without axes)
+    '''
+    import matplotlib.pyplot as plt
+    scale = image_data.max()
+    plt.imsave(filename, image_data.T/(scale if scale > 0 else 1.), cmap=cmap,
+               origin='lower')
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
@@ -0,0 +1,163 @@
+"""
+===============================================================================
+Redshift and spectra of the image of an accretion disk
+===============================================================================
+The gas of the disk moves in Keplerian (circular, equatorial, geodesic)
+orbits with angular velocity Omega, obtained from the derivatives of the
+metric at the equatorial plane,
+    Omega = (-g_tph' +- sqrt(g_tph'^2 - g_tt' g_phph'))/g_phph',
+and four-velocity u = u^t (1, 0, 0, Omega). The ratio between the observed
+frequency (by an observer at rest at infinity) and the emitted one is
+    g = k_t/(u^t (k_t + Omega k_phi)),
+where k_t and k_phi are conserved along the ray, so g is obtained from the
+final state of each ray, without tracing it again.
+Once g is known in each pixel, the observed specific intensity at any
+frequency is I_obs(nu) = g^3 I_em(nu/g, r) and the bolometric intensity is
+g^4 times the emitted one, so the images at many frequencies, the spectrum
+and the profile of an emission line of the disk are computed with array
+operations on the maps of r and g.
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+from numpy import (asarray, zeros, full_like, sqrt, expm1, pi, histogram,
+                   linspace, where, isfinite, errstate, newaxis)
+from common.bundle import DISK
+
+
+def keplerian_omega(blackhole, r, corotating=True, dr=1e-5):
+    '''
+    Angular velocity of the circular equatorial geodesics at the radii r
+    (corotating or counterrotating with the black hole), from the
+    derivatives of blackhole.metric by central differences of relative
+    step dr
+    '''
+    r = asarray(r, dtype=float)
+    h = dr*r
+    x_in = [zeros(r.shape), r - h, full_like(r, pi/2), zeros(r.shape)]
+    x_out = [zeros(r.shape), r + h, full_like(r, pi/2), zeros(r.shape)]
+    g_in = blackhole.metric(x_in)
+    g_out = blackhole.metric(x_out)
+    dg_tt, dg_phph, dg_tph = [(g_out[k] - g_in[k])/(2*h) for k in (0, 3, 4)]
+    root = sqrt(dg_tph*dg_tph - dg_tt*dg_phph)
+    if corotating:
+        return (-dg_tph + root)/dg_phph
+    return (-dg_tph - root)/dg_phph
+
+
+def redshift_factor(blackhole, r, k_t, k_phi, corotating=True):
+    '''
+    Redshift factor g = nu_observed/nu_emitted of the photons with
+    conserved momenta k_t, k_phi emitted by the Keplerian gas at the
+    radii r. It is nan where there are no circular orbits.
+    '''
+    r = asarray(r, dtype=float)
+    Omega = keplerian_omega(blackhole, r, corotating)
+    g_tt, g_rr, g_thth, g_phph, g_tph = blackhole.metric(
+        [zeros(r.shape), r, full_like(r, pi/2), zeros(r.shape)])
+    with errstate(invalid='ignore'):
+        u_t = 1/sqrt(-(g_tt + 2*g_tph*Omega + g_phph*Omega*Omega))
+        return k_t/(u_t*(k_t + Omega*k_phi))
+
+
+def redshift_map(blackhole, acc_structure, final_states, status):
+    '''
+    Returns the redshift factor of each pixel of an image from the final
+    states (shape (..., 8)) and the termination codes of its photons
+    (zero for the pixels that do not see the disk)
+    '''
+    disk = status == DISK
+    g = zeros(status.shape)
+    fP = final_states[disk]
+    g[disk] = redshift_factor(blackhole, fP[:, 1], fP[:, 4], fP[:, 7],
+                              getattr(acc_structure, 'corotating', True))
+    g[~isfinite(g)] = 0.
+    return g
+
+
+def blackbody(nu, T):
+    '''
+    Planck spectrum nu^3/(exp(nu/T) - 1) (in units with h = k_B = 1 and
+    without the constant factor). It vanishes where T = 0.
+    '''
+    with errstate(divide='ignore', over='ignore', invalid='ignore'):
+        return where(T > 0, nu**3/expm1(nu/T), 0.)
+
+
+def disk_blackbody(acc_structure):
+    '''
+    Returns the emitted specific intensity spectrum(nu, r) of a disk that
+    emits locally as a black body with temperature T = F^(1/4), where F is
+    the energy flux of the accretion structure. T is in units of its
+    maximum value in the disk, so the frequencies are in units of
+    k_B T_max/h.
+    '''
+    F_max = acc_structure.energy_flux(linspace(acc_structure.in_edge, 
+                                               acc_structure.out_edge, 
+                                               2000)).max()
+    scale = F_max if F_max > 0 else 1.
+    def spectrum(nu, r):
+        return blackbody(nu, (acc_structure.energy_flux(r)/scale)**0.25)
+    return spectrum
+
+
+def spectral_images(frequencies, r, g, spectrum):
+    '''
+    Observed specific intensity g^3 I_em(nu/g, r) at each of the
+    frequencies, for the pixels with radius of emission r and redshift
+    factor g (arrays of the same shape; g = 0 for the pixels without
+    emission). spectrum(nu, r) is the emitted specific intensity.
+    Returns an array with shape (len(frequencies),) + r.shape.
+    '''
+    nu = asarray(frequencies, dtype=float).reshape(-1, 1)
+    emits = g > 0
+    images = zeros((nu.size,) + r.shape)
+    images[:, emits] = g[emits]**3*spectrum(nu/g[emits], r[emits])
+    return images
+
+
+def disk_spectrum(frequencies, r, g, spectrum, pixel_solid_angle,
+                  max_size=2**22):
+    '''
+    Observed flux of the disk at each of the frequencies: the sum of the
+    specific intensity over the pixels times their solid angle. The
+    frequencies are processed in chunks of about max_size values.
+    '''
+    nu = asarray(frequencies, dtype=float)
+    emits = g > 0
+    r, g = r[emits], g[emits]
+    flux = zeros(nu.size)
+    step = max(max_size//max(g.size, 1), 1)
+    for start in range(0, nu.size, step):
+        chunk = nu[start:start+step, newaxis]
+        flux[start:start+step] = (g**3*spectrum(chunk/g, r)).sum(axis=1)
+    return flux*pixel_solid_angle
+
+
+def line_profile(r, g, emissivity_index=3., bins=200, g_range=None):
+    '''
+    Profile of an emission line of the disk with rest frequency nu_0 and
+    emissivity proportional to r^(-emissivity_index): the histogram of the
+    observed frequencies g nu_0 weighted by g^4 r^(-emissivity_index).
+    Returns the centers of the bins (in units of nu_0) and the profile
+    normalized to unit area.
+    '''
+    emits = g > 0
+    r, g = r[emits], g[emits]
+    if g_range is None:
+        g_range = (g.min(), g.max()) if g.size > 0 else (0., 2.)
+    profile, edges = histogram(g, bins=bins, range=g_range,
+                               weights=g**4*r**(-emissivity_index))
+    width = edges[1] - edges[0]
+    total = profile.sum()*width
+    return 0.5*(edges[1:] + edges[:-1]), profile/(total if total > 0 else 1.)
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
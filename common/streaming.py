@@ -0,0 +1,116 @@
+"""
+===============================================================================
+Streaming render of large images
+===============================================================================
+The photons of the image are not created at once: they are generated in
+batches of consecutive rows of the image plane (constant alpha), traced,
+shaded and written into an output array of shape (x_pixels, y_pixels)
+stored as a memory map in a .npy file. The memory needed depends only on
+the size of the batches, so images larger than the available memory can be
+rendered.
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+from numpy import meshgrid, arange, array, int8
+from numpy.lib.format import open_memmap
+from multiprocessing import Pool
+import sys
+
+
+def photon_rows(blackhole, detector, i0, i1):
+    '''
+    Returns the photons (see common.common.Photons) of the rows i0 <= i < i1
+    of the image plane
+    '''
+    from common.common import Photons, initCond
+    alpha, beta = meshgrid(detector.alphaRange[i0:i1], detector.betaRange,
+                           indexing='ij')
+    xin, kin = detector.photon_coords(alpha.ravel(), beta.ravel())
+    i, j = meshgrid(arange(i0, i1), arange(detector.y_pixels), indexing='ij')
+    return Photons(i.ravel(), j.ravel(),
+                   array(initCond(xin, kin, blackhole)))
+
+
+def render_rows(rows, blackhole, acc_structure, detector, integrator,
+                **kwargs):
+    '''
+    Creates, traces and shades the photons of the rows (i0, i1). Returns
+    (i0, i1, flux, status) with the arrays of shape (i1 - i0, y_pixels).
+    '''
+    from common.common import trace_photons
+    i0, i1 = rows
+    photons = photon_rows(blackhole, detector, i0, i1)
+    i, j, flux, fP, status = trace_photons(photons, blackhole, acc_structure,
+                                           detector, integrator, **kwargs)
+    shape = (i1 - i0, detector.y_pixels)
+    return i0, i1, flux.reshape(shape), status.reshape(shape)
+
+
+def stream_worker(rows):
+    '''
+    Renders a batch of rows in a worker process
+    '''
+    from common.common import worker_scene
+    s = worker_scene
+    return render_rows(rows, s['blackhole'], s['acc_structure'],
+                       s['detector'], s['integrator'], **s['kwargs'])
+
+
+def stream_render(blackhole, acc_structure, detector, filename,
+                  status_filename=None, integrator='jit', batch_size=65536,
+                  workers=1, **kwargs):
+    '''
+    Renders the image in batches of rows with about batch_size photons and
+    writes the energy flux into the .npy file filename (and the termination
+    codes into status_filename, if given). Returns the memory maps of the
+    output files.
+    '''
+    from common.common import init_worker
+    nx, ny = detector.x_pixels, detector.y_pixels
+    image_data = open_memmap(filename, mode='w+', dtype=float, shape=(nx, ny))
+    status = None
+    if status_filename is not None:
+        status = open_memmap(status_filename, mode='w+', dtype=int8,
+                             shape=(nx, ny))
+    n_rows = max(batch_size//ny, 1)
+    batches = [(i0, min(i0 + n_rows, nx)) for i0 in range(0, nx, n_rows)]
+    if workers == 1:
+        results = (render_rows(rows, blackhole, acc_structure, detector,
+                               integrator, **kwargs) for rows in batches)
+    else:
+        if integrator in ('jit', 'kerr_schild'):
+            # Compile the kernels once, before forking the workers
+            from common.common import trace_photons
+            trace_photons(photon_rows(blackhole, detector, 0, 1)[:1],
+                          blackhole, acc_structure, detector, integrator,
+                          **kwargs)
+        pool = Pool(workers, initializer=init_worker,
+                    initargs=(blackhole, acc_structure, detector, integrator,
+                              kwargs))
+        results = pool.imap_unordered(stream_worker, batches)
+    done = 0
+    for i0, i1, flux, st in results:
+        image_data[i0:i1] = flux
+        if status is not None:
+            status[i0:i1] = st
+        done += i1 - i0
+        sys.stdout.write("\rRow # %d / %d" % (done, nx))
+        sys.stdout.flush()
+    if workers != 1:
+        pool.close()
+        pool.join()
+    image_data.flush()
+    if status is not None:
+        status.flush()
+    return image_data, status
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
@@ -0,0 +1,246 @@
+"""
+===============================================================================
+Symplectic integration of photon bundles in a curved spacetime
+===============================================================================
+The geodesic equations of the metrics are the Hamilton equations of
+H = g^{mu nu} k_mu k_nu / 2. The rays of a bundle (arrays of shape (8, N))
+are advanced with the 2-stage Gauss-Legendre collocation method, which is
+symplectic and of order 4. Its implicit stages are solved by fixed point
+iteration, ray by ray, starting from the extrapolation of the stages of the
+previous step.
+
+A symplectic method keeps the error of the Hamiltonian bounded over long
+paths only with a fixed step, so the steps are not adapted to the local
+error. Instead, the affine parameter is transformed (Sundman transformation)
+as d lambda = -g ds and the rays are integrated with a fixed step in
+s with the Hamiltonian
+    K = -g (H - H0),    g = (r - EH) sin(theta),
+whose flow on the surface K = 0 is the flow of H backwards in lambda. The
+steps in lambda are thus proportional to the distance to the horizon: long
+far from the black hole and short close to it, as in the adaptive
+integrators, while the drift of H (and of the null condition) stays bounded
+for rays that wind many times around the photon orbits. The factor
+sin(theta) (regularized) of g = d lambda/ds also shortens the steps near
+the poles, where the equation of k_theta is stiff.
+The rays near the photon orbits are unstable, so the error of their
+crossings grows exponentially with the number of turns with any integrator:
+the symplectic integrator bounds the drift of the constants of motion, not
+the error of the positions.
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+from numpy import (array, zeros, full, abs, sqrt, sin, cos, maximum,
+                   isfinite, where, arange)
+from common.bundle import (rhs, equatorial_crossing, RUNNING, DISK, HORIZON,
+                           ESCAPE, MAX_LENGTH, FAILED)
+
+
+# 2-stage Gauss-Legendre coefficients
+C1 = 0.5 - sqrt(3)/6
+C2 = 0.5 + sqrt(3)/6
+A11 = 0.25
+A12 = 0.25 - sqrt(3)/6
+A21 = 0.25 + sqrt(3)/6
+A22 = 0.25
+
+# Regularization of the factor sin(theta) of the transformation at the poles
+POLE_EPS = 1e-2
+
+
+def time_factor(y, r_h):
+    '''
+    Returns the factor g = d lambda/ds of the transformation of the affine
+    parameter and its derivatives with respect to r and theta
+    '''
+    sin_th = sin(y[2])
+    pole = sqrt(sin_th*sin_th + POLE_EPS*POLE_EPS)
+    return ((y[1] - r_h)*pole, pole,
+            (y[1] - r_h)*sin_th*cos(y[2])/pole)
+
+
+def transformed_rhs(blackhole, y, H0):
+    '''
+    Evaluates the Hamilton equations of K = -g (H - H0) for the rays in the
+    array y of shape (8, N), with the values H0 of the Hamiltonian of each
+    ray
+    '''
+    from common.common import hamiltonian
+    g, dg_dr, dg_dth = time_factor(y, blackhole.EH)
+    F = -g*rhs(blackhole, y)
+    dH = hamiltonian(y, blackhole) - H0
+    F[5] += dH*dg_dr
+    F[6] += dH*dg_dth
+    return F
+
+
+def gauss_step(blackhole, y, K1, K2, H0, h, tol, max_iter):
+    '''
+    Performs a 2-stage Gauss-Legendre step of size h from the states y,
+    solving the stages by fixed point iteration from the initial guesses
+    K1, K2 (modified in place). Returns the new states, the number of
+    evaluations of the equations of each ray and the mask of the rays
+    whose iteration did not converge.
+    '''
+    n = y.shape[1]
+    calls = zeros(n, dtype=int)
+    a = arange(n)
+    for _ in range(max_iter):
+        N1 = transformed_rhs(blackhole, y[:, a] + h*(A11*K1[:, a] + A12*K2[:, a]), H0[a])
+        N2 = transformed_rhs(blackhole, y[:, a] + h*(A21*K1[:, a] + A22*K2[:, a]), H0[a])
+        change = h*maximum(abs(N1 - K1[:, a]), abs(N2 - K2[:, a]))
+        change = (change/maximum(abs(y[:, a]), 1.)).max(axis=0)
+        K1[:, a] = N1
+        K2[:, a] = N2
+        calls[a] += 2
+        a = a[~(change <= tol)]
+        if a.size == 0:
+            break
+    failed = zeros(n, dtype=bool)
+    failed[a] = True
+    return y + 0.5*h*(K1 + K2), calls, failed
+
+
+def geo_integ_symplectic(iC, blackhole, acc_structure, detector, step=0.1,
+                         tol=1e-12, max_iter=20, r_escape=None,
+                         horizon_tol=1e-2, max_steps=20000, n_cross=None,
+                         n_images=None, stats=None):
+    '''
+    Integrates the motion equations of a bundle of photons with a
+    symplectic method
+    ===========================================================================
+    iC : array of shape (8, N) with the initial conditions of the rays
+         (see initCond)
+    step : fixed step in the transformed parameter s (the step in the affine
+           parameter is about step*(r - EH)). The error of the energy flux
+           of a thin disk image is about 1e-5 for step = 0.1 (similar to 
+           the jit integrator with rtol = 1e-8) and 5e-7 for step = 0.05 
+           (order 4).
+    tol : tolerance of the fixed point iteration of the stages, relative
+          to the states
+    max_iter : maximum number of iterations of the stages in a step. The
+               rays whose iteration does not converge are stopped (FAILED).
+    r_escape, horizon_tol, max_steps, n_cross, n_images, stats : as in
+                                                       common.bundle.geo_integ_bundle
+    ===========================================================================
+    Returns the array fP of shape (8, N) with the state of each ray at the
+    first crossing of the equatorial plane inside the accretion structure
+    (zeros if the ray does not hit it) and the termination code of each ray.
+    With n_cross, fP has shape (n_cross, 8, N) and it contains the states
+    at the crossings (zeros for the crossings not reached). With n_images, 
+    fP has shape (n_images, 9, N) and it contains the states at the hits, 
+    followed by their affine parameter (zeros for the hits not reached), 
+    and the status is DISK for the rays with at least one hit.
+    '''
+    from common.common import hamiltonian
+    if n_cross is not None and n_images is not None:
+        raise ValueError('n_cross and n_images cannot be used together')
+    iC = array(iC, dtype=float)
+    n = iC.shape[1]
+    final_lmbda = 1.5*detector.D
+    if r_escape is None:
+        r_escape = acc_structure.out_edge
+    r_horizon = (1. + horizon_tol)*blackhole.EH
+
+    if n_images is not None:
+        fP = zeros([n_images, 9, n])
+    else:
+        fP = zeros([8, n]) if n_cross is None else zeros([n_cross, 8, n])
+    crossed = zeros(n, dtype=int)
+    status = full(n, RUNNING)
+    total_steps = zeros(n, dtype=int)
+    rhs_calls = zeros(n, dtype=int)
+    final = iC.copy()
+
+    # Arrays of the rays still in the bundle
+    idx = arange(n)
+    y = iC
+    H0 = hamiltonian(y, blackhole)
+    K1 = transformed_rhs(blackhole, y, H0)
+    K2 = K1.copy()
+    rhs_calls += 1
+    lmbda = zeros(n)
+    h = step
+
+    while idx.size > 0:
+        y_new, calls, failed = gauss_step(blackhole, y, K1, K2, H0, h, tol,
+                                          max_iter)
+        rhs_calls[idx] += calls
+        total_steps[idx] += 1
+
+        code = full(idx.size, RUNNING)
+        code[failed | ~isfinite(y_new).all(axis=0)] = FAILED
+        ok = code == RUNNING
+
+        lmbda_new = lmbda - 0.5*h*(time_factor(y, blackhole.EH)[0] 
+                                   + time_factor(y_new, blackhole.EH)[0])
+
+        # Crossings of the equatorial plane inside the accretion structure
+        cross = ok & (cos(y[2])*cos(y_new[2]) <= 0.)
+        if cross.any():
+            f0 = transformed_rhs(blackhole, y[:, cross], H0[cross])
+            f1 = transformed_rhs(blackhole, y_new[:, cross], H0[cross])
+            rhs_calls[idx[cross]] += 2
+            s, yc = equatorial_crossing(y[:, cross], f0, y_new[:, cross], f1,
+                                        full(cross.sum(), h))
+            if n_images is not None:
+                # The affine parameter is interpolated linearly in the step
+                hit = (yc[1] > acc_structure.in_edge) & (yc[1] < acc_structure.out_edge)
+                c = where(cross)[0][hit]
+                rays = idx[c]
+                order = crossed[rays]
+                fP[order, :8, rays] = yc[:, hit].T
+                fP[order, 8, rays] = lmbda[c] + s[hit]*(lmbda_new[c] - lmbda[c])
+                crossed[rays] += 1
+                code[c[crossed[rays] >= n_images]] = DISK
+            elif n_cross is None:
+                hit = (yc[1] > acc_structure.in_edge) & (yc[1] < acc_structure.out_edge)
+                c = where(cross)[0][hit]
+                fP[:, idx[c]] = yc[:, hit]
+                code[c] = DISK
+            else:
+                rays = idx[cross]
+                order = crossed[rays]
+                rec = order < n_cross
+                fP[order[rec], :, rays[rec]] = yc[:, rec].T
+                crossed[rays] += 1
+
+        # Horizon, escape and maximum affine parameter
+        running = code == RUNNING
+        code[running & (y_new[1] < r_horizon)] = HORIZON
+        code[running & (y_new[1] > r_escape) & (y_new[1] > y[1])] = ESCAPE
+        code[running & (lmbda_new <= -final_lmbda)] = MAX_LENGTH
+        code[(code == RUNNING) & (total_steps[idx] >= max_steps)] = FAILED
+        done = code != RUNNING
+        status[idx[done]] = code[done]
+        final[:, idx[done]] = where(code == FAILED, y, y_new)[:, done]
+
+        # Extrapolate the stages of the next step from the collocation
+        # polynomial of this one and remove the finished rays
+        keep = ~done
+        dK = (K2 - K1)/(C2 - C1)
+        K1 = (K1 + dK)[:, keep]
+        K2 = K1 + (C2 - C1)*dK[:, keep]
+        y = y_new[:, keep]
+        H0 = H0[keep]
+        lmbda = lmbda_new[keep]
+        idx = idx[keep]
+
+    if n_images is not None:
+        # Rays that hit the structure less than n_images times
+        status[crossed > 0] = DISK
+    elif stats is not None and n_cross is None:
+        final[:, status == DISK] = fP[:, status == DISK]
+    if stats is not None:
+        stats.update(steps=total_steps, rhs_calls=rhs_calls, final=final)
+    return fP, status
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
@@ -0,0 +1,406 @@
+"""
+===============================================================================
+Tile-based render jobs for several machines
+===============================================================================
+A job splits the image plane into rectangular tiles of pixels. It is stored
+in a directory, visible from all the machines (shared filesystem), with the
+files
+- manifest.pkl      : the scene (black hole, accretion structure, detector),
+                      the integrator and its settings and the list of tiles
+                      (i0, i1, j0, j1), written once when the job is created
+- tile_NNNNN.lock   : claim of a tile by a worker process, created
+                      atomically (only one process can create it). Its
+                      modification time is updated after each chunk of
+                      photons, so a claim older than the lease belongs to a
+                      lost worker and the tile can be claimed again.
+- tile_NNNNN.npz    : image data, final states and termination codes of a
+                      finished tile, written into a temporary file and
+                      renamed, so it is either complete or absent
+- image.npz, metadata.json : result of the merge of the tiles
+Any number of processes, on any machine, run work_tiles on the directory:
+each one claims the pending tiles one by one, renders them and writes their
+files, and when the remaining tiles are claimed by other processes it waits
+until they are finished or their claims expire. A stopped process only
+loses the tiles it was rendering, which are claimed again by the other
+processes once the lease expires (or by running work_tiles again), so
+work_tiles returns on every machine when the whole job is finished. In the
+worst case (a worker that is only slow) a tile is rendered twice, with the
+same result.
+The lease must be longer than the time needed for a chunk of photons and
+than the differences between the clocks of the machines.
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+from numpy import zeros, array, meshgrid, arange, load, savez, int64, bincount
+from multiprocessing import Pool
+from copy import copy
+import socket
+import pickle
+import json
+import time
+import sys
+import os
+
+
+def tile_list(x_pixels, y_pixels, tile_size=64):
+    '''
+    Returns the array of tiles (i0, i1, j0, j1), row by row, that cover an
+    image of x_pixels * y_pixels with tiles of tile_size pixels (an integer
+    or a pair (x_size, y_size))
+    '''
+    if isinstance(tile_size, int):
+        tile_size = (tile_size, tile_size)
+    tx, ty = tile_size
+    return array([(i0, min(i0 + tx, x_pixels), j0, min(j0 + ty, y_pixels))
+                  for i0 in range(0, x_pixels, tx)
+                  for j0 in range(0, y_pixels, ty)], dtype=int64)
+
+
+def photon_tile(blackhole, detector, i0, i1, j0, j1):
+    '''
+    Returns the photons (see common.common.Photons) of the pixels
+    i0 <= i < i1, j0 <= j < j1 of the image plane
+    '''
+    from common.common import Photons, initCond
+    alpha, beta = meshgrid(detector.alphaRange[i0:i1],
+                           detector.betaRange[j0:j1], indexing='ij')
+    xin, kin = detector.photon_coords(alpha.ravel(), beta.ravel())
+    i, j = meshgrid(arange(i0, i1), arange(j0, j1), indexing='ij')
+    return Photons(i.ravel(), j.ravel(),
+                   array(initCond(xin, kin, blackhole)))
+
+
+def job_key(blackhole, acc_structure, detector, integrator, tiles, kwargs):
+    '''
+    Hash of the scene, the settings of the integrator and the tiles of a job
+    '''
+    from common.transfer_map import fingerprint
+    from hashlib import sha1
+    text = '|'.join([fingerprint(blackhole), fingerprint(acc_structure),
+                     fingerprint(detector), integrator,
+                     sha1(tiles.tobytes()).hexdigest(),
+                     repr(sorted(kwargs.items()))])
+    return sha1(text.encode()).hexdigest()
+
+
+def worker_name():
+    '''
+    Name of the process (machine and process id) used in the claims and
+    temporary files
+    '''
+    return '%s.%d' % (socket.gethostname(), os.getpid())
+
+
+class TileJob:
+    '''
+    Directory with the manifest and the tiles of a render job
+    '''
+    def __init__(self, directory):
+        '''
+        Reads the manifest of the job in directory (see create_job)
+        '''
+        self.directory = directory
+        manifest_file = os.path.join(directory, 'manifest.pkl')
+        if not os.path.exists(manifest_file):
+            raise FileNotFoundError('There is no tile job in %s' % directory)
+        with open(manifest_file, 'rb') as f:
+            manifest = pickle.load(f)
+        self.blackhole = manifest['blackhole']
+        self.acc_structure = manifest['acc_structure']
+        self.detector = manifest['detector']
+        self.integrator = manifest['integrator']
+        self.kwargs = manifest['kwargs']
+        self.tiles = manifest['tiles']
+        self.key = manifest['key']
+
+    def tile_file(self, k):
+        return os.path.join(self.directory, 'tile_%05d.npz' % k)
+
+    def lock_file(self, k):
+        return os.path.join(self.directory, 'tile_%05d.lock' % k)
+
+    def is_done(self, k):
+        return os.path.exists(self.tile_file(k))
+
+    def pending(self):
+        '''
+        Returns the indices of the tiles that are not finished
+        '''
+        return [k for k in range(len(self.tiles)) if not self.is_done(k)]
+
+    def claim(self, k, lease=600.):
+        '''
+        Tries to claim the tile k for this process. Returns False if it is
+        finished or claimed by another process in the last lease seconds.
+        '''
+        if self.is_done(k):
+            return False
+        lock = self.lock_file(k)
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock) < lease:
+                    return False
+                # Claim of a lost worker: it is moved away (only one of the
+                # processes that find it succeeds) and the tile is claimed
+                # again
+                stale = '%s.%s' % (lock, worker_name())
+                os.rename(lock, stale)
+            except FileNotFoundError:
+                return False
+            if time.time() - os.path.getmtime(stale) < lease:
+                # A new claim was created after the check: restore it
+                try:
+                    os.link(stale, lock)
+                except FileExistsError:
+                    pass
+                os.remove(stale)
+                return False
+            os.remove(stale)
+            try:
+                fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                return False
+        os.write(fd, worker_name().encode())
+        os.close(fd)
+        # The tile could have been finished while the claim was made
+        if self.is_done(k):
+            self.release(k)
+            return False
+        return True
+
+    def owns(self, k):
+        '''
+        Returns True if the claim of the tile k belongs to this process (it
+        is taken over by another process once it is older than the lease)
+        '''
+        try:
+            with open(self.lock_file(k)) as f:
+                return f.read() == worker_name()
+        except FileNotFoundError:
+            return False
+
+    def renew(self, k):
+        '''
+        Updates the time of the claim of the tile k, if it belongs to this
+        process
+        '''
+        if self.owns(k):
+            try:
+                os.utime(self.lock_file(k))
+            except FileNotFoundError:
+                pass
+
+    def release(self, k):
+        '''
+        Removes the claim of the tile k, if it belongs to this process
+        '''
+        if self.owns(k):
+            try:
+                os.remove(self.lock_file(k))
+            except FileNotFoundError:
+                pass
+
+    def render(self, k, chunk_size=2048):
+        '''
+        Traces the photons of the tile k in chunks of chunk_size photons,
+        renewing the claim after each chunk, and returns the arrays
+        image_data, final_states and status of the tile
+        '''
+        from common.common import trace_photons
+        i0, i1, j0, j1 = self.tiles[k]
+        photons = photon_tile(self.blackhole, self.detector, i0, i1, j0, j1)
+        image_data = zeros([i1 - i0, j1 - j0])
+        final_states = zeros([i1 - i0, j1 - j0, 8])
+        status = zeros([i1 - i0, j1 - j0], dtype=int64)
+        for start in range(0, len(photons), chunk_size):
+            i, j, flux, fP, st = trace_photons(photons[start:start+chunk_size],
+                                               self.blackhole,
+                                               self.acc_structure,
+                                               self.detector, self.integrator,
+                                               **self.kwargs)
+            image_data[i - i0, j - j0] = flux
+            final_states[i - i0, j - j0] = fP
+            status[i - i0, j - j0] = st
+            self.renew(k)
+        return image_data, final_states, status
+
+    def write(self, k, image_data, final_states, status, elapsed):
+        '''
+        Writes the file of the tile k and releases its claim
+        '''
+        # savez adds the extension .npz to the temporary name
+        tmp = os.path.join(self.directory,
+                           '.tile_%05d.%s.npz' % (k, worker_name()))
+        savez(tmp, tile=self.tiles[k], image_data=image_data,
+              final_states=final_states, status=status,
+              worker=worker_name(), elapsed=elapsed)
+        os.replace(tmp, self.tile_file(k))
+        self.release(k)
+
+    def merge(self):
+        '''
+        Assembles the finished tiles and writes the files image.npz (arrays
+        image_data, final_states and status) and metadata.json. Returns
+        (image_data, final_states, status, metadata).
+        '''
+        from common.transfer_map import fingerprint
+        pending = self.pending()
+        if pending:
+            raise ValueError('%d of %d tiles of the job in %s are not '
+                             'finished' % (len(pending), len(self.tiles),
+                                           self.directory))
+        nx, ny = self.detector.x_pixels, self.detector.y_pixels
+        image_data = zeros([nx, ny])
+        final_states = zeros([nx, ny, 8])
+        status = zeros([nx, ny], dtype=int64)
+        tiles = []
+        for k in range(len(self.tiles)):
+            with load(self.tile_file(k)) as data:
+                i0, i1, j0, j1 = data['tile']
+                image_data[i0:i1, j0:j1] = data['image_data']
+                final_states[i0:i1, j0:j1] = data['final_states']
+                status[i0:i1, j0:j1] = data['status']
+                tiles.append(dict(tile=[int(i0), int(i1), int(j0), int(j1)],
+                                  worker=str(data['worker']),
+                                  elapsed=float(data['elapsed'])))
+        metadata = dict(key=self.key,
+                        blackhole=fingerprint(self.blackhole),
+                        acc_structure=fingerprint(self.acc_structure),
+                        detector=fingerprint(self.detector),
+                        integrator=self.integrator,
+                        kwargs={key: repr(value)
+                                for key, value in self.kwargs.items()},
+                        shape=[nx, ny],
+                        status_counts=bincount(status.ravel()).tolist(),
+                        total_time=sum(t['elapsed'] for t in tiles),
+                        tiles=tiles)
+        # Several machines can merge the same job: the files are replaced
+        # atomically
+        tmp = os.path.join(self.directory, '.image.%s.npz' % worker_name())
+        savez(tmp, image_data=image_data, final_states=final_states,
+              status=status)
+        os.replace(tmp, os.path.join(self.directory, 'image.npz'))
+        tmp = os.path.join(self.directory, '.metadata.%s.json' % worker_name())
+        with open(tmp, 'w') as f:
+            json.dump(metadata, f, indent=1)
+        os.replace(tmp, os.path.join(self.directory, 'metadata.json'))
+        return image_data, final_states, status, metadata
+
+
+def create_job(directory, blackhole, acc_structure, detector,
+               integrator='jit', tile_size=64, **kwargs):
+    '''
+    Writes the manifest of a job that renders the scene in tiles of
+    tile_size pixels (see tile_list) and returns the TileJob. If the
+    directory already contains the same job, it is returned unchanged (so
+    every machine can call create_job with the same scene); a different job
+    raises ValueError.
+    Additional keyword arguments are passed to the integrator.
+    '''
+    tiles = tile_list(detector.x_pixels, detector.y_pixels, tile_size)
+    key = job_key(blackhole, acc_structure, detector, integrator, tiles,
+                  kwargs)
+    manifest_file = os.path.join(directory, 'manifest.pkl')
+    if not os.path.exists(manifest_file):
+        os.makedirs(directory, exist_ok=True)
+        # The grid of initial conditions is not stored: each tile computes
+        # its own photons
+        detector = copy(detector)
+        detector.grid = None
+        manifest = dict(blackhole=blackhole, acc_structure=acc_structure,
+                        detector=detector, integrator=integrator,
+                        kwargs=kwargs, tiles=tiles, key=key)
+        tmp = '%s.%s' % (manifest_file, worker_name())
+        with open(tmp, 'wb') as f:
+            pickle.dump(manifest, f)
+        os.replace(tmp, manifest_file)
+    job = TileJob(directory)
+    if job.key != key:
+        raise ValueError('The directory %s contains a tile job of another '
+                         'scene' % directory)
+    return job
+
+
+def work_loop(directory, lease=600., chunk_size=2048, poll=None):
+    '''
+    Claims and renders the pending tiles of the job in directory until all
+    of them are finished. When the remaining tiles are claimed by other
+    processes, it waits poll seconds (default: lease/10, at most 30) and
+    tries again, so the tiles of a lost worker are rendered once its claims
+    expire. Returns the indices of the tiles rendered by this process.
+    '''
+    if poll is None:
+        poll = min(lease/10, 30.)
+    job = TileJob(directory)
+    rendered = []
+    pending = job.pending()
+    while pending:
+        claimed = False
+        for k in pending:
+            if not job.claim(k, lease):
+                continue
+            claimed = True
+            start_time = time.time()
+            try:
+                result = job.render(k, chunk_size)
+            except BaseException:
+                job.release(k)
+                raise
+            job.write(k, *result, elapsed=time.time() - start_time)
+            rendered.append(k)
+            sys.stdout.write("\rTile # %d rendered (%d tiles in the job)"
+                             % (len(rendered), len(job.tiles)))
+            sys.stdout.flush()
+        pending = job.pending()
+        if pending and not claimed:
+            time.sleep(poll)
+    return rendered
+
+
+def work_tiles(directory, workers=1, lease=600., chunk_size=2048,
+               poll=None):
+    '''
+    Renders the pending tiles of the job in directory with workers
+    processes of this machine (see work_loop). It can run at the same time
+    on several machines and it returns, with the number of tiles rendered
+    here, once all the tiles of the job are finished.
+    '''
+    job = TileJob(directory)
+    pending = job.pending()
+    print('Tile job in %s: %d of %d tiles finished'
+          % (directory, len(job.tiles) - len(pending), len(job.tiles)))
+    if not pending:
+        return 0
+    start_time = time.time()
+    if workers == 1:
+        rendered = [work_loop(directory, lease, chunk_size, poll)]
+    else:
+        if job.integrator in ('jit', 'kerr_schild'):
+            # Compile the kernels once, before forking the workers
+            from common.common import trace_photons
+            trace_photons(photon_tile(job.blackhole, job.detector, 0, 1, 0, 1),
+                          job.blackhole, job.acc_structure, job.detector,
+                          job.integrator, **job.kwargs)
+        pool = Pool(workers)
+        rendered = pool.starmap(work_loop,
+                                [(directory, lease, chunk_size, poll)]*workers)
+        pool.close()
+        pool.join()
+    n_rendered = sum(len(r) for r in rendered)
+    total_time = time.time() - start_time
+    print("\n--- %d tiles rendered in %s seconds ---\n"
+          % (n_rendered, total_time))
+    return n_rendered
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
@@ -0,0 +1,92 @@
+"""
+===============================================================================
+Selection of the tolerances of the integrators by the drift of the constants
+===============================================================================
+The geodesic equations are integrated in Hamiltonian form, so the
+Hamiltonian H (zero for null geodesics) and the Carter constant Q are
+conserved along the exact rays and their drift measures the error of the
+integration (see common.common.constraint_drift). All the photons are first
+traced with the loosest tolerance of a list; only the rays whose drift is
+above the bound drift_tol are traced again with the next tolerance, and so
+on. Each ray keeps the result of the loosest tolerance that satisfies the
+bound (or of the tightest one, with a warning, if none does).
+The drift of most rays is close to the tolerance, but a few rays (close to
+the photon orbits or to the horizon) have drifts up to 1000 times larger,
+so a single tolerance that bounds the drift of all the rays is much tighter
+than the one needed by most of them. By default the list starts at
+drift_tol and decreases by factors of 10.
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+from numpy import zeros, full, arange, nan, int64
+from common.instrument import trace_instrumented
+
+
+def trace_controlled(photons, blackhole, acc_structure, detector,
+                     integrator='jit', drift_tol=1e-6, tolerances=None,
+                     **kwargs):
+    '''
+    Integrates a set of photons with the loosest tolerances (rtol = atol) in
+    the list tolerances (default: drift_tol, drift_tol/10, ..., 
+    drift_tol/10^4) for which the drift of the constants of each ray is
+    below drift_tol. Returns the arrays (i, j, flux, fP, status, stats) as
+    common.instrument.trace_instrumented, where stats has also the array
+    rtol with the tolerance kept for each ray. The evaluations, steps and
+    time of stats include all the attempts.
+    '''
+    if integrator in ('analytic', 'symplectic'):
+        raise ValueError('The %s integrator has no tolerances' % integrator)
+    if tolerances is None:
+        tolerances = [drift_tol*10.**(-k) for k in range(5)]
+    n = len(photons)
+    flux = zeros(n)
+    fP = zeros([n, 8])
+    status = zeros(n, dtype=int64)
+    stats = dict(rhs_calls=zeros(n, dtype=int64), steps=zeros(n, dtype=int64),
+                 time=zeros(n), warnings=zeros(n, dtype=int64),
+                 drift=full(n, nan), rtol=full(n, nan), messages=[])
+    todo = arange(n)
+    for tol in tolerances:
+        i, j, fl, fp, st, s = trace_instrumented(photons[todo], blackhole,
+                                                 acc_structure, detector,
+                                                 integrator, rtol=tol,
+                                                 atol=tol, **kwargs)
+        flux[todo] = fl
+        fP[todo] = fp
+        status[todo] = st
+        for key in ('rhs_calls', 'steps', 'time', 'warnings'):
+            stats[key][todo] += s[key]
+        stats['drift'][todo] = s['drift']
+        stats['rtol'][todo] = tol
+        stats['messages'] += s['messages']
+        # Rays without drift (nan) are not traced again
+        todo = todo[s['drift'] > drift_tol]
+        if todo.size == 0:
+            break
+    if todo.size > 0:
+        stats['warnings'][todo] += 1
+        stats['messages'] += ['Drift of the constants above %g with the '
+                              'tolerance %g' % (drift_tol, tolerances[-1])]*todo.size
+    return photons.i, photons.j, flux, fP, status, stats
+
+
+def controlled_worker(photons):
+    '''
+    Integrates a chunk of photons with the selection of tolerances in a
+    worker process
+    '''
+    from common.common import worker_scene
+    s = worker_scene
+    return trace_controlled(photons, s['blackhole'], s['acc_structure'],
+                            s['detector'], s['integrator'], **s['kwargs'])
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
@@ -0,0 +1,217 @@
+"""
+===============================================================================
+Transfer table for static and spherically symmetric black holes
+===============================================================================
+In a static and spherically symmetric spacetime every ray moves in a plane
+and it is characterised by its impact parameter b = sqrt(alpha^2 + beta^2).
+The planar geodesics of a family of impact parameters are integrated once
+(in the equatorial plane, for a detector with iota = pi/2) and the radius r
+and the momentum k_r are tabulated as functions of the angle psi swept from
+the direction of the observer. The rays of any pixel and any inclination are
+then mapped onto the disk by rotating into their orbital plane, where the
+crossings of the equatorial plane of the black hole occur at
+psi_n = psi_0 + n*pi, and interpolating the table.
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+from numpy import (zeros, full, linspace, arange, array, sqrt, sin, cos, pi,
+                   arctan, arctan2, mod, floor, clip, nan, where, interp,
+                   abs, maximum, minimum, concatenate, rint, int64)
+from scipy.interpolate import CubicHermiteSpline
+from common.bundle import rhs, dopri_step, RUNNING, DISK, HORIZON, ESCAPE
+
+
+class TransferTable:
+    '''
+    Table of planar geodesics of a static and spherically symmetric
+    black hole observed from a distance D
+    '''
+    def __init__(self, blackhole, D, b_max, n_b=2000, n_max=2, n_psi=None,
+                 rtol=1e-8, atol=1e-8, horizon_tol=1e-2):
+        '''
+        =======================================================================
+        b_max : maximum impact parameter (half diagonal of the screen)
+        n_b : number of impact parameters in the table
+        n_max : maximum order of the crossings of the equatorial plane
+        n_psi : number of values of psi in the table (default 256 per
+                winding)
+        =======================================================================
+        '''
+        if blackhole.a != 0:
+            raise ValueError('The transfer table needs a spherically '
+                             'symmetric black hole (a = 0)')
+        from common.common import initCond
+        self.D = D
+        self.n_max = n_max
+        self.psi_max = (n_max + 1)*pi + arctan(b_max/D)
+        if n_psi is None:
+            n_psi = 256*(n_max + 1)
+        self.b = linspace(b_max/n_b, b_max, n_b)
+        self.psi = linspace(0., self.psi_max, n_psi)
+
+        # Reference rays in the equatorial plane (iota = pi/2, beta = 0)
+        r0 = sqrt(self.b**2 + D**2)
+        phi0 = arctan(self.b/D)
+        w0 = 1.
+        kr = (D/r0)*w0
+        kphi = -self.b*w0/r0**2
+        kt = sqrt(kr**2 + (r0*kphi)**2)
+        xin = [zeros(n_b), r0, full(n_b, pi/2), phi0]
+        kin = [kt, kr, zeros(n_b), kphi]
+        iC = array(initCond(xin, kin, blackhole))
+        self.E = -iC[4]
+        self.L = iC[7]
+
+        samples, self.captured = integrate_planar(iC, blackhole, 10*D, 
+                                                  self.psi_max, rtol, atol,
+                                                  (1. + horizon_tol)*blackhole.EH)
+        self.r = full([n_b, n_psi], nan)
+        self.k_r = full([n_b, n_psi], nan)
+        for m in range(n_b):
+            phi, r, k_r, dr, dk_r = samples[m]
+            inside = (self.psi >= phi[0]) & (self.psi <= phi[-1])
+            self.r[m, inside] = CubicHermiteSpline(phi, r, dr)(self.psi[inside])
+            self.k_r[m, inside] = CubicHermiteSpline(phi, k_r, dk_r)(self.psi[inside])
+
+    def lookup(self, b, psi, table):
+        '''
+        Bilinear interpolation of the table at the impact parameters b and
+        angles psi. Returns nan where the ray does not reach the angle psi.
+        '''
+        db = self.b[1] - self.b[0]
+        dpsi = self.psi[1] - self.psi[0]
+        x = clip((b - self.b[0])/db, 0., self.b.size - 1.000001)
+        y = (psi - self.psi[0])/dpsi
+        out = (y < 0) | (y > self.psi.size - 1)
+        y = clip(y, 0., self.psi.size - 1.000001)
+        i = floor(x).astype(int64)
+        j = floor(y).astype(int64)
+        u = x - i
+        v = y - j
+        value = (1 - u)*(1 - v)*table[i, j] + u*(1 - v)*table[i + 1, j] \
+              + (1 - u)*v*table[i, j + 1] + u*v*table[i + 1, j + 1]
+        return where(out, nan, value)
+
+    def crossings(self, alpha, beta, iota, in_edge, out_edge):
+        '''
+        Maps the rays with image plane coordinates (alpha, beta) onto the
+        equatorial plane for an inclination iota and returns the array fP
+        of shape (8, N) with the state of each ray at its first crossing
+        inside the accretion structure (zeros if it does not hit it) and the
+        termination code of each ray. The coordinate t is not tabulated and
+        it is set to zero.
+        '''
+        alpha = array(alpha, dtype=float).ravel()
+        beta = array(beta, dtype=float).ravel()
+        b = sqrt(alpha**2 + beta**2)
+        ang = arctan2(beta, alpha)
+        sin_iota, cos_iota = sin(iota), cos(iota)
+
+        # Orbital plane spanned by the direction of the observer o and the
+        # direction e of the ray in the image plane
+        o = array([sin_iota, 0., cos_iota])[:, None]
+        e = cos(ang)*array([0., 1., 0.])[:, None] \
+            + sin(ang)*array([-cos_iota, 0., sin_iota])[:, None]
+        normal_z = o[0]*e[1] - o[1]*e[0]
+
+        # First angle where the ray crosses the equatorial plane
+        psi_s = arctan(b/self.D)
+        delta = arctan2(e[2], o[2])
+        psi_0 = psi_s + mod(delta + pi/2 - psi_s, pi)
+
+        n = b.size
+        fP = zeros([8, n])
+        status = full(n, RUNNING)
+        E = interp(b, self.b, self.E)
+        L = interp(b, self.b, self.L)
+        for order in range(self.n_max + 1):
+            psi = psi_0 + order*pi
+            r = self.lookup(b, psi, self.r)
+            hit = (status == RUNNING) & (r > in_edge) & (r < out_edge)
+            pos = cos(psi[hit])*o + sin(psi[hit])*e[:, hit]
+            L_z = L[hit]*normal_z[hit]
+            fP[1, hit] = r[hit]
+            fP[2, hit] = pi/2
+            fP[3, hit] = arctan2(pos[1], pos[0])
+            fP[4, hit] = -E[hit]
+            fP[5, hit] = self.lookup(b[hit], psi[hit], self.k_r)
+            fP[6, hit] = where(e[2, hit]*cos(psi[hit]) - o[2]*sin(psi[hit]) > 0,
+                               1., -1.)*sqrt(maximum(L[hit]**2 - L_z**2, 0.))
+            fP[7, hit] = L_z
+            status[hit] = DISK
+        nearest = rint(clip((b - self.b[0])/(self.b[1] - self.b[0]), 0, 
+                            self.b.size - 1)).astype(int64)
+        status[(status == RUNNING) & self.captured[nearest]] = HORIZON
+        status[status == RUNNING] = ESCAPE
+        return fP, status
+
+
+def integrate_planar(iC, blackhole, final_lmbda, psi_max, rtol, atol,
+                     r_horizon):
+    '''
+    Integrates the planar reference rays with the Dormand-Prince scheme of
+    common/bundle.py and returns, for each ray, the arrays of the angle phi,
+    the radius, the momentum k_r and their derivatives with respect to phi
+    at every accepted step, until the ray is captured, escapes back beyond
+    its initial radius or sweeps an angle psi_max. Returns also a boolean
+    array indicating the rays captured by the black hole.
+    '''
+    n = iC.shape[1]
+    idx = arange(n)
+    y = iC.copy()
+    f = rhs(blackhole, y)
+    r_start = iC[1].copy()
+    lmbda = zeros(n)
+    h = -0.01*y[1]
+    captured = zeros(n, dtype=bool)
+    history = [(idx, y[[3, 1, 5]], f[[3, 1, 5]])]
+
+    while idx.size > 0:
+        h = maximum(h, -final_lmbda - lmbda)
+        y_new, f_new, err = dopri_step(blackhole, y, f, h)
+        scale = atol + rtol*maximum(abs(y), abs(y_new))
+        err_norm = sqrt(((err/scale)**2).mean(axis=0))
+        err_norm = where(err_norm == err_norm, err_norm, 1e10)
+        accept = err_norm <= 1.
+        factor = clip(0.9*err_norm**(-0.2), 0.2, 10.)
+        factor = where(accept, factor, minimum(factor, 1.))
+
+        a = where(accept)[0]
+        history.append((idx[a], y_new[[3, 1, 5]][:, a], f_new[[3, 1, 5]][:, a]))
+        lmbda_new = lmbda + h
+        done = accept & ((y_new[1] < r_horizon) | (y_new[3] > psi_max)
+                         | ((y_new[1] > r_start[idx]) & (y_new[1] > y[1]))
+                         | (lmbda_new <= -final_lmbda))
+        done |= abs(h*factor) < 1e-12
+        captured[idx[accept & (y_new[1] < r_horizon)]] = True
+        keep = ~done
+        y = where(accept, y_new, y)[:, keep]
+        f = where(accept, f_new, f)[:, keep]
+        lmbda = where(accept, lmbda_new, lmbda)[keep]
+        h = (h*factor)[keep]
+        idx = idx[keep]
+
+    ray = concatenate([hist[0] for hist in history])
+    values = concatenate([hist[1] for hist in history], axis=1)
+    derivs = concatenate([hist[2] for hist in history], axis=1)
+    order = ray.argsort(kind='stable')
+    start = concatenate([[0], (ray[order][1:] != ray[order][:-1]).nonzero()[0] + 1,
+                         [ray.size]])
+    samples = []
+    for m in range(n):
+        s = order[start[m]:start[m + 1]]
+        phi, r, k_r = values[:, s]
+        dphi = derivs[0, s]
+        samples.append((phi, r, k_r, derivs[1, s]/dphi, derivs[2, s]/dphi))
+    return samples, captured
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
@@ -0,0 +1,204 @@
+"""
+===============================================================================
+Persistent transfer maps of the image plane
+===============================================================================
+The geometric result of tracing the photons of an image does not depend on
+the accretion structure: for each pixel it is enough to store the states
+(radius, azimuth and momentum) at the first crossings of the equatorial
+plane and the way in which the ray ends (horizon or escape). Any thin
+accretion structure with r_max >= out_edge is then shaded from this map
+without integrating again, by taking the first crossing inside the
+structure. The maps are saved as .npz files whose name is a hash of the
+black hole, the detector and the settings of the integrator.
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+from numpy import zeros, array, ndarray, load, savez_compressed, int64
+from hashlib import sha1
+import os
+from common.bundle import DISK
+
+
+class Geometry:
+    '''
+    Accretion structure used to trace the transfer maps. It only defines the
+    radius beyond which the rays moving outwards escape.
+    '''
+    def __init__(self, r_max):
+        self.in_edge = 0.
+        self.out_edge = r_max
+
+
+def fingerprint(obj):
+    '''
+    Returns a string identifying the class of obj and the values of its
+    numerical attributes (numbers, strings and arrays)
+    '''
+    items = ['%s.%s' % (type(obj).__module__, type(obj).__name__)]
+    for key, value in sorted(vars(obj).items()):
+        if isinstance(value, (bool, int, float, str)):
+            items.append('%s=%r' % (key, value))
+        elif isinstance(value, ndarray):
+            items.append('%s=%s' % (key, sha1(value.tobytes()).hexdigest()))
+    return ';'.join(items)
+
+
+def scene_key(blackhole, detector, integrator, n_cross, r_max, kwargs):
+    '''
+    Hash of the black hole, the detector and the settings of the integrator
+    '''
+    text = '|'.join([fingerprint(blackhole), fingerprint(detector),
+                     integrator, repr(n_cross), repr(float(r_max)),
+                     repr(sorted(kwargs.items()))])
+    return sha1(text.encode()).hexdigest()
+
+
+def trace_crossings(photons, blackhole, geometry, detector, integrator='jit',
+                    n_cross=3, r_switch=None, **kwargs):
+    '''
+    Integrates a set of photons (see common.common.Photons) and returns the
+    arrays (i, j, crossings, status) with the pixel coordinates, the states
+    at the first n_cross crossings of the equatorial plane (shape
+    (N, n_cross, 8)) and the termination code of each photon. With
+    r_switch, the rays are only integrated inside r_switch (see
+    common/far_field.py).
+    '''
+    from common.common import (geo_integ_bundle, geo_integ_jit, 
+                               geo_integ_analytic, geo_integ_symplectic,
+                               geo_integ_kerr_schild, geo_integ_far_field)
+    integs = {'bundle': geo_integ_bundle, 'jit': geo_integ_jit,
+              'analytic': geo_integ_analytic, 
+              'symplectic': geo_integ_symplectic,
+              'kerr_schild': geo_integ_kerr_schild}
+    if integrator not in integs:
+        raise ValueError("The integrator '%s' cannot record the crossings "
+                         "of the rays" % integrator)
+    if r_switch is None:
+        crossings, status = integs[integrator](photons.iC, blackhole, geometry, 
+                                               detector, n_cross=n_cross, 
+                                               **kwargs)
+    elif integrator == 'analytic':
+        raise ValueError("The integrator 'analytic' cannot be used with "
+                         "r_switch")
+    else:
+        crossings, status = geo_integ_far_field(integs[integrator], photons.iC,
+                                                blackhole, geometry, detector,
+                                                r_switch, n_cross=n_cross, 
+                                                **kwargs)
+    return photons.i, photons.j, crossings.transpose(2, 0, 1), status
+
+
+class TransferMap:
+    '''
+    States at the first crossings of the equatorial plane of every pixel
+    '''
+    def __init__(self, crossings, status, r_max, key=None):
+        '''
+        =======================================================================
+        crossings : array of shape (x_pixels, y_pixels, n_cross, 8) with the
+                    states at the crossings (zeros if not reached)
+        status : termination code of each ray (HORIZON, ESCAPE, ...)
+        r_max : maximum outer edge of the structures that can be shaded
+        =======================================================================
+        '''
+        self.crossings = crossings
+        self.status = status
+        self.r_max = r_max
+        self.key = key
+
+    def save(self, filename):
+        savez_compressed(filename, crossings=self.crossings,
+                         status=self.status, r_max=self.r_max)
+
+    @classmethod
+    def load(cls, filename, key=None):
+        data = load(filename)
+        return cls(data['crossings'], data['status'], float(data['r_max']),
+                   key)
+
+    def shade(self, acc_structure):
+        '''
+        Returns the arrays image_data, final_states and status of the
+        accretion structure, taking in each pixel the first crossing inside
+        it. The rays that do not hit it keep the termination code of the
+        map, so the rays that were still moving outwards below r_max at the
+        end of the integration appear as MAX_LENGTH instead of ESCAPE.
+        '''
+        if acc_structure.out_edge > self.r_max:
+            raise ValueError('The accretion structure extends beyond the '
+                             'radius r_max of the transfer map')
+        nx, ny, n_cross, _ = self.crossings.shape
+        final_states = zeros([nx, ny, 8])
+        status = array(self.status, dtype=int64)
+        hit = zeros([nx, ny], dtype=bool)
+        for m in range(n_cross):
+            r = self.crossings[:, :, m, 1]
+            new = ~hit & (r > acc_structure.in_edge) & (r < acc_structure.out_edge)
+            final_states[new] = self.crossings[:, :, m][new]
+            hit |= new
+        status[hit] = DISK
+        image_data = acc_structure.energy_flux(final_states[..., 1],
+                                               final_states[..., 3])
+        return image_data, final_states, status
+
+
+def cached_transfer_map(image, integrator='jit', n_cross=3, r_max=50.,
+                        cache_dir='transfer_maps', workers=1, chunk_size=2048,
+                        **kwargs):
+    '''
+    Returns the transfer map of the scene of image, reading it from
+    cache_dir if it was computed before (cache_dir=None disables the disk
+    cache). Otherwise the photons are traced, in parallel if workers > 1,
+    and the map is saved.
+    '''
+    from multiprocessing import Pool
+    from common.common import init_worker, crossings_worker
+    blackhole, detector = image.blackhole, image.detector
+    key = scene_key(blackhole, detector, integrator, n_cross, r_max, kwargs)
+    if cache_dir is not None:
+        filename = os.path.join(cache_dir, key + '.npz')
+        if os.path.exists(filename):
+            return TransferMap.load(filename, key)
+
+    geometry = Geometry(r_max)
+    nx, ny = detector.x_pixels, detector.y_pixels
+    crossings = zeros([nx, ny, n_cross, 8])
+    status = zeros([nx, ny], dtype=int64)
+    photons = image.photons
+    chunks = [photons[start:start+chunk_size]
+              for start in range(0, len(photons), chunk_size)]
+    kwargs = dict(kwargs, n_cross=n_cross)
+    if workers == 1:
+        results = (trace_crossings(chunk, blackhole, geometry, detector,
+                                   integrator, **kwargs) for chunk in chunks)
+    else:
+        if integrator in ('jit', 'kerr_schild'):
+            # Compile the kernels once, before forking the workers
+            trace_crossings(chunks[0][:1], blackhole, geometry, detector,
+                            integrator, **kwargs)
+        pool = Pool(workers, initializer=init_worker,
+                    initargs=(blackhole, geometry, detector, integrator, kwargs))
+        results = pool.imap(crossings_worker, chunks)
+    for i, j, cr, st in results:
+        crossings[i, j] = cr
+        status[i, j] = st
+    if workers != 1:
+        pool.close()
+        pool.join()
+
+    transfer_map = TransferMap(crossings, status, r_max, key)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        transfer_map.save(filename)
+    return transfer_map
+
+
+
+###############################################################################
+
+if __name__ == '__main__':
+    print('')
+    print('THIS IS A MODULE DEFINING ONLY A PART OF THE COMPLETE CODE.')
+    print('YOU NEED TO RUN THE main.py FILE TO GENERATE THE IMAGE')
+    print('')
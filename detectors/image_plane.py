@@ -7,7 +7,7 @@ curved spacetime
 ===============================================================================
 """
 
-from numpy import sqrt, sin, cos, arccos, arctan, linspace
+from numpy import sqrt, sin, cos, arccos, arctan, linspace, meshgrid, array, zeros_like
 
 
 class detector:
@@ -38,6 +38,8 @@ class detector:
 
         self.alphaRange = linspace(-x_side, x_side, self.x_pixels)
         self.betaRange = linspace(-y_side, y_side, self.y_pixels)
+        # Initial positions and momenta of all the pixels (see photon_grid)
+        self.grid = None
         print()
         print ("Size of the screen in Pixels: ", self.x_pixels, "X", self.y_pixels)
         print ("Total Number of Photons: ", self.x_pixels*self.y_pixels)
@@ -51,7 +53,8 @@ class detector:
         Given the initial cartesian coordinates in the image plane (alpha,beta),
         the distance D to the force center and the inclination angle i, 
         this function calculates the initial spherical coordinates (r, theta, phi) 
-        and the initial components of the momentum (kt, kr, ktheta, kphi)
+        and the initial components of the momentum (kt, kr, ktheta, kphi).
+        alpha and beta can be numbers or arrays of the same shape.
         ===========================================================================
         '''
         # Transformation from (Alpha, Beta, D) to (r, theta, phi) 
@@ -63,7 +66,7 @@ class detector:
 
         # Initial position of the photon in spherical coordinates 
         # (t=0, r, theta, phi)
-        xin = [0., r, theta, phi]
+        xin = [zeros_like(r), r, theta, phi]
                        
         # Given a frequency value w0=1, this calculates the initial 
         # 4-momentum of the photon  
@@ -80,6 +83,20 @@ class detector:
         kin = [kt, kr, ktheta, kphi]
 
         return xin, kin 
+
+    def photon_grid(self):
+        '''
+        Returns the arrays xin and kin, with shape (4, x_pixels, y_pixels), 
+        with the initial position and momentum of the photons of all the 
+        pixels. They do not depend on the metric, so they are computed 
+        only once for each detector.
+        '''
+        if self.grid is None:
+            alpha, beta = meshgrid(self.alphaRange, self.betaRange, 
+                                   indexing='ij')
+            xin, kin = self.photon_coords(alpha, beta)
+            self.grid = array(xin), array(kin)
+        return self.grid
  
 
 
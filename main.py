@@ -49,7 +49,7 @@ blackhole = kerr.BlackHole(M,a)
 
 ##### SCALAR HAIR BH
 #M = 1
-#blackhole = scalar_hair_BH.BlackHole()
+#blackhole = scalar_hair_BH.BlackHole(phi1=5.0, pp0=1.6)
 
 '''
 ===============================================================================
@@ -111,6 +111,17 @@ image.create_photons()
 
 # Create the image data
 image.create_image()
+#image.create_image(integrator='bundle')
+#image.create_image(integrator='symplectic', step=0.1)
+#image.create_image(integrator='kerr_schild')
+#image.create_image_progressive(integrator='jit', coarse=16, show=True)
+#image.create_image_orders(integrator='jit', n_images=3)
+#image.create_image(integrator='jit', r_switch=50.)
+#image.create_tile_job('tiles', integrator='jit', tile_size=64)
+#image.merge_tiles('tiles')  # after common.tiles.work_tiles('tiles')
+#image.create_transfer_map(integrator='jit')
+#image.shade(acc_structure)
+#image.bolometric_image()
 
 # Plot the image
 image.plot(savefig=savefig, filename=filename, cmap='inferno')
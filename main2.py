@@ -49,7 +49,7 @@ blackhole = kerr.BlackHole(M,a)
 
 ##### SCALAR HAIR BH
 #M = 1
-#blackhole = scalar_hair_BH.BlackHole()
+#blackhole = scalar_hair_BH.BlackHole(phi1=5.0, pp0=1.6)
 
 '''
 ===============================================================================
@@ -111,6 +111,7 @@ image.create_photons()
 
 # Create the image data
 image.create_image()
+#image.create_image(integrator='bundle')
 
 # Plot the image
 image.plot(savefig=savefig, filename=filename, cmap='inferno')
@@ -2,6 +2,9 @@
 ===============================================================================
 This script produces many images of Kerr black holes with different values of 
 the spin parameter and/or inclination angles.
+The images are rendered in parallel and stored in the directory of the 
+campaign (see common/campaign.py). If the script is interrupted, running it 
+again renders only the images that were not completed.
 ===============================================================================
 @author: Eduard Larrañga - 2023
 ===============================================================================
@@ -10,16 +13,7 @@ the spin parameter and/or inclination angles.
 #warnings.filterwarnings('ignore')
 
 from numpy import pi
-from black_holes import schwarzschild
-from black_holes import kerr
-from black_holes import num_schwarzschild
-from black_holes import scalar_hair_BH
-from accretion_structures import simple_disk 
-from accretion_structures import thin_disk 
-from accretion_structures import ring_disk 
-from accretion_structures import ring_disk_2
-from detectors import image_plane 
-from common.common import Image
+from common.campaign import parameter_list, run_campaign
 import numpy as np
 
 
@@ -32,47 +26,26 @@ M = 1   # Mass
 D = 100*M  # Distance to the BH
 x_side = 25*M
 x_pixels = 90
-y_pixels = int(x_pixels*9/16)
 
+directory = 'campaign'      # Directory of the campaign
+workers = 4                 # Number of processes
 
-N = 1000                    # Number of images
-aa = np.random.random(N)    # Angular Monmentum
-
-images_data = np.zeros([N,x_pixels,y_pixels])
-labels = np.zeros([N])
-
-
-for i in range(N):
-    print('\nImage number: ', i+1)
-    a = aa[i]
-    blackhole = kerr.BlackHole(M,a)
-
-    iota = (pi/180)*(80)   # Inclination Angle
-    detector = image_plane.detector(D=D, iota=iota, x_pixels=x_pixels, 
-                                    x_side=x_side, ratio='16:9')
-
-    #acc_structure = simple_disk.structure(blackhole, 6, 20)
 
+if __name__ == '__main__':
+    N = 1000                    # Number of images
+    # The random parameters are generated with a fixed seed, so that the 
+    # same list is obtained when the campaign is resumed
+    rng = np.random.default_rng(0)
+    aa = rng.random(N)          # Angular Monmentum
+    iota = (pi/180)*(80)        # Inclination Angle
 
     ########### NOVIKOV-THORNE THIN DISK
-    #R_min = blackhole.ISCOco 
-    #R_max = 20*M
-    acc_structure = thin_disk.structure(blackhole)
-
-    image = Image()
-    # Photons creation
-    image.create_photons(blackhole, detector)
-    # Create the image data
-    image.create_image(blackhole, acc_structure)
-
-    labels[i] = a
-    images_data[i] = image.image_data
-
-    if i%50==0:
-        print('\nSaving info ...')
-        np.save('images_data.npy', images_data)
-        np.save('labels.npy', labels)
+    parameters = parameter_list(aa, iota, disk='thin_disk')
 
+    store = run_campaign(directory, parameters, M=M, D=D, x_side=x_side, 
+                         x_pixels=x_pixels, ratio='16:9', integrator='jit', 
+                         workers=workers)
 
-np.save('images_data.npy', images_data)
-np.save('labels.npy', labels)
+    images_data, labels = store.results()
+    np.save('images_data.npy', images_data)
+    np.save('labels.npy', labels['a'])
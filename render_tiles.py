@@ -0,0 +1,56 @@
+"""
+===============================================================================
+This script renders one large image of a Kerr black hole in tiles, with
+processes on several machines that share the directory of the job
+(see common/tiles.py).
+Run it on each machine: the first one writes the manifest of the job, the
+others find the same job, and all of them render the tiles that are not
+finished or claimed, waiting for the tiles claimed by the others. If a
+machine is lost, its tiles are rendered again by the others once the lease
+expires (or by running the script again). Each machine merges the image
+when all the tiles are finished (the merged files are replaced atomically).
+===============================================================================
+@author: Eduard Larrañaga - 2023
+===============================================================================
+"""
+#import warnings
+#warnings.filterwarnings('ignore')
+
+from numpy import pi
+from black_holes import kerr
+from accretion_structures import thin_disk
+from detectors import image_plane
+from common.common import Image
+from common.tiles import work_tiles
+
+
+
+############# Parameters
+
+##### KERR BH
+M = 1   # Mass
+a = 0.6 # Angular Monmentum
+
+D = 100*M                   # Distance to the BH
+iota = (pi/180)*(85)        # Inclination Angle
+x_side = 25*M
+x_pixels = 1920
+
+directory = 'tiles'         # Directory of the job (shared filesystem)
+tile_size = 128             # Size of the tiles in pixels
+workers = 4                 # Number of processes of this machine
+lease = 600.                # Seconds after which a silent claim is lost
+
+
+if __name__ == '__main__':
+    blackhole = kerr.BlackHole(M, a)
+    acc_structure = thin_disk.structure(blackhole)
+    detector = image_plane.detector(D=D, iota=iota, x_pixels=x_pixels,
+                                    x_side=x_side, ratio='16:9')
+    image = Image(blackhole, acc_structure, detector)
+    image.create_tile_job(directory, integrator='jit', tile_size=tile_size)
+
+    work_tiles(directory, workers=workers, lease=lease)
+
+    image.merge_tiles(directory)
+    image.save_data(directory + '/image_data')